@@ -1,5 +1,6 @@
 from fastapi import APIRouter
-from app.api.endpoints import url
+from app.api.endpoints import metrics, url
 
 api_router = APIRouter()
+api_router.include_router(metrics.router, tags=["metrics"])
 api_router.include_router(url.router, tags=["urls"])
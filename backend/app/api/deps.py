@@ -0,0 +1,10 @@
+from app.services.async_url_service import AsyncURLService, get_async_url_service
+
+def get_url_service() -> AsyncURLService:
+    """
+    FastAPI dependency returning the worker's URL service
+
+    The service is built by the startup hook rather than at import, and
+    tests can swap it out with ``app.dependency_overrides``.
+    """
+    return get_async_url_service()
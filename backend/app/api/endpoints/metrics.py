@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+from app.api.timing import TimedRoute
+from app.core.config import settings
+from app.utils import metrics
+from app.utils.profiler import get_profiler
+
+router = APIRouter(route_class=TimedRoute)
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Metrics in the Prometheus text format
+    """
+    # As a header rather than media_type, which would append a second charset
+    return Response(metrics.render(), headers={"content-type": metrics.CONTENT_TYPE})
+
+def _check_profiler_enabled():
+    if not settings.PROFILER_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@router.post("/debug/profiler/start", include_in_schema=False)
+def start_profiler(interval_ms: float = Query(5.0, gt=0, le=1000)):
+    """
+    Start the sampling profiler, discarding earlier samples
+    """
+    _check_profiler_enabled()
+    profiler = get_profiler()
+    profiler.start(interval=interval_ms / 1000)
+    return {"running": profiler.running, "interval_ms": profiler.interval * 1000}
+
+@router.post("/debug/profiler/stop", include_in_schema=False)
+def stop_profiler():
+    """
+    Stop the sampling profiler, keeping its samples
+    """
+    _check_profiler_enabled()
+    profiler = get_profiler()
+    profiler.stop()
+    return {"running": profiler.running, "samples": sum(profiler.samples.values())}
+
+@router.get("/debug/profiler", include_in_schema=False)
+def get_profile():
+    """
+    Samples so far as collapsed stacks, for flamegraph.pl or speedscope
+    """
+    _check_profiler_enabled()
+    return PlainTextResponse(get_profiler().collapsed())
@@ -1,59 +1,320 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from typing import List
-from app.models.url import URLCreate, URLResponse, URLAnalytics
-from app.services.url_service import url_service
-from app.utils.user_agent_parser import parse_user_agent
+import json
+from datetime import datetime, timezone
+from urllib.parse import quote
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from typing import AsyncIterator, List, Optional
+from app.core.config import settings
+from app.models.url import URLCreate, URLResponse, URLAnalytics, BulkURLError, HotLink, ClickPage
+from app.api.deps import get_url_service
+from app.api.timing import TimedRoute, timed
+from app.services import es_queries
+from app.services.async_url_service import (
+    AsyncURLService, RECENT_TAG, analytics_tag, close_async_url_service, get_async_url_service
+)
+from app.services.click_export import create_writer
+from app.utils.geoip import lookup_country
+from app.utils.response_cache import CachedResponse
+from app.utils.user_agent_parser import classify_user_agent
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+@router.on_event("startup")
+async def startup():
+    await get_async_url_service().startup()
+
+@router.on_event("shutdown")
+async def shutdown():
+    await close_async_url_service()
 
 @router.post("/shorten", response_model=URLResponse)
-async def create_short_url(url_create: URLCreate):
+async def create_short_url(url_create: URLCreate, service: AsyncURLService = Depends(get_url_service)):
     """
     Create a shortened URL from a long URL
     """
-    return url_service.create_short_url(url_create)
+    return await service.create_short_url(url_create)
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for handlers that keep reading the request body
+
+    Starlette's StreamingResponse polls ``receive`` for a disconnect while
+    streaming, which would swallow body chunks the iterator still needs.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode(self.charset)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+async def _ndjson_url_creates(request: Request, errors: List[BulkURLError]) -> AsyncIterator[URLCreate]:
+    """Parse an NDJSON request body line by line as it arrives"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            url_create = _parse_line(line, errors)
+            if url_create:
+                yield url_create
+    url_create = _parse_line(buffer, errors)
+    if url_create:
+        yield url_create
+
+def _parse_line(line: bytes, errors: List[BulkURLError]):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return URLCreate(**json.loads(line))
+    except (ValueError, TypeError, ValidationError) as e:
+        errors.append(BulkURLError(original_url=line.decode("utf-8", "replace"), error=str(e)))
+        return None
+
+async def _iterate(items: List[URLCreate]) -> AsyncIterator[URLCreate]:
+    for item in items:
+        yield item
+
+@router.post("/shorten/bulk")
+async def create_short_urls(request: Request, service: AsyncURLService = Depends(get_url_service)):
+    """
+    Shorten many URLs at once
+
+    Accepts a JSON array or NDJSON (``application/x-ndjson``) of
+    ``{"original_url": ...}`` objects and streams one NDJSON result line
+    per URL as each bulk chunk is written. Items that fail are reported as
+    ``{"original_url": ..., "error": ...}`` lines.
+    """
+    errors: List[BulkURLError] = []
+    if "ndjson" in request.headers.get("content-type", ""):
+        url_creates = _ndjson_url_creates(request, errors)
+    else:
+        try:
+            body = await request.json()
+            url_creates = _iterate([URLCreate(**item) for item in body])
+        except (ValueError, TypeError, ValidationError) as e:
+            raise HTTPException(status_code=400, detail=f"Expected a JSON array of URLs: {e}")
+
+    async def stream():
+        async for result in service.create_short_urls(url_creates):
+            yield result.json() + "\n"
+        for error in errors:
+            yield error.json() + "\n"
+
+    return _DuplexStreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _cached_response(request: Request, cached: CachedResponse) -> Response:
+    """
+    Serve a cached body, or 304 if the client's copy is current
+
+    ``no-cache`` lets browsers keep the body but revalidate every time, so
+    the dashboard's polling costs a 304 until the data actually changes.
+    """
+    headers = {
+        "ETag": cached.etag,
+        "Last-Modified": cached.last_modified,
+        "Cache-Control": "no-cache",
+        **cached.headers
+    }
+    if cached.not_modified(request.headers):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
 
 @router.get("/recent", response_model=List[URLResponse])
-async def get_recent_urls():
+async def get_recent_urls(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    service: AsyncURLService = Depends(get_url_service)
+):
     """
     Get a list of recently created shortened URLs
+
+    Newest first. When there are more, the ``X-Next-Cursor`` response
+    header holds the ``cursor`` for the next page.
+    """
+    async def build():
+        urls, next_cursor = await service.get_recent_urls_page(limit=limit, cursor=cursor)
+        body = "[" + ",".join(url.json() for url in urls) + "]"
+        modified_at = max(es_queries.epoch_seconds(url.created_at) for url in urls) if urls else None
+        return body.encode("utf-8"), {"X-Next-Cursor": next_cursor} if next_cursor else {}, modified_at
+
+    try:
+        cached = await service.response_cache.get_or_build(("recent", limit, cursor), RECENT_TAG, build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _cached_response(request, cached)
+
+@router.get("/hot", response_model=List[HotLink])
+async def get_hot_links(limit: int = Query(10, ge=1, le=100), service: AsyncURLService = Depends(get_url_service)):
+    """
+    Get the links with the most clicks right now, as seen by this worker
     """
-    return url_service.get_recent_urls(limit=10)
+    return await service.get_hot_links(limit=limit)
+
+def _check_window(start: Optional[datetime], end: Optional[datetime]):
+    """Reject empty windows; times without an offset are taken as UTC"""
+    if start is None or end is None:
+        return
+    start, end = (value.replace(tzinfo=value.tzinfo or timezone.utc) for value in (start, end))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
 
 @router.get("/analytics/{short_code}", response_model=URLAnalytics)
-async def get_url_analytics(short_code: str):
+async def get_url_analytics(
+    short_code: str,
+    request: Request,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    interval: str = Query("day", regex="^(hour|day|week)$"),
+    size: int = Query(10, ge=1, le=100),
+    service: AsyncURLService = Depends(get_url_service)
+):
     """
     Get analytics for a specific shortened URL
+
+    Counts clicks from ``from`` (inclusive) to ``to`` (exclusive), bucketed
+    by ``interval``, with the top ``size`` browsers, devices and countries.
+    Day and week views over whole days are served from the daily rollups.
     """
-    analytics = url_service.get_url_analytics(short_code)
-    if not analytics:
+    _check_window(start, end)
+
+    async def build():
+        result = await service.get_url_analytics_modified(short_code, start=start, end=end, interval=interval, size=size)
+        if result is None:
+            return None
+        analytics, modified_at = result
+        return analytics.json().encode("utf-8"), {}, modified_at
+
+    key = ("analytics", short_code, start, end, interval, size)
+    cached = await service.response_cache.get_or_build(key, analytics_tag(short_code), build)
+    if cached is None:
         raise HTTPException(status_code=404, detail="URL not found")
-    return analytics
+    return _cached_response(request, cached)
+
+@router.get("/analytics/{short_code}/clicks", response_model=ClickPage)
+async def get_url_clicks(
+    short_code: str,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    service: AsyncURLService = Depends(get_url_service)
+):
+    """
+    Export the raw clicks of a shortened URL, oldest first
+
+    Pass the returned ``next_cursor`` as ``cursor`` (with the same window)
+    to fetch the next page; it is null after the last one.
+    """
+    _check_window(start, end)
+    try:
+        page = await service.get_clicks_page(short_code, start=start, end=end, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="URL not found")
+    return page
+
+@router.get("/clicks/export")
+async def export_clicks(
+    short_code: Optional[str] = Query(None, alias="code"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    format: str = Query("ndjson", regex="^(ndjson|parquet)$"),
+    service: AsyncURLService = Depends(get_url_service)
+):
+    """
+    Stream raw clicks, of one code or of every code, oldest first
+
+    The whole selection is sent in one response, read from Elasticsearch
+    in batches, as NDJSON or Parquet.
+    """
+    _check_window(start, end)
+    if short_code is not None:
+        url = await service.get_url_by_short_code(short_code)
+        if url is None:
+            raise HTTPException(status_code=404, detail="URL not found")
+    try:
+        writer = create_writer(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"clicks-{short_code or 'all'}.{writer.extension}"
+    return StreamingResponse(
+        service.export_clicks(writer, short_code, start, end),
+        media_type=writer.media_type,
+        headers={"content-disposition": f'attachment; filename="{filename}"'}
+    )
+
+async def fast_redirect(request: Request) -> Response:
+    """
+    Redirect to the original URL with a real 301/302 and record the click
+
+    A plain Starlette endpoint: no dependency resolution, parameter
+    validation or response model, just a cache lookup, a queued click and a
+    header-only response. HEAD requests (link previews) are not counted.
+    """
+    service = get_async_url_service()
+    short_code = request.path_params["short_code"]
+    original_url = await service.get_original_url(short_code)
+    if original_url is None:
+        return JSONResponse({"detail": "URL not found"}, status_code=404)
+
+    if request.method == "GET":
+        raw_user_agent = request.headers.get("user-agent", "")
+        user_agent = classify_user_agent(raw_user_agent)
+        client_ip = request.client.host if request.client else "0.0.0.0"
+        await service.record_click(
+            short_code=short_code,
+            browser=user_agent.browser,
+            device=user_agent.device,
+            country=lookup_country(client_ip),
+            ip=client_ip,
+            os=user_agent.os,
+            user_agent=raw_user_agent
+        )
+
+    return Response(status_code=settings.REDIRECT_STATUS_CODE, headers={
+        # Same escaping as RedirectResponse, so non-ASCII URLs stay valid headers
+        "location": quote(original_url, safe=":/%#?=@[]!$&'()*+,;"),
+        "cache-control": settings.REDIRECT_CACHE_CONTROL,
+    })
+
+router.add_route("/r/{short_code}", timed(settings.API_V1_STR + "/r/{short_code}", fast_redirect), methods=["GET", "HEAD"], include_in_schema=False)
 
 @router.get("/{short_code}")
-async def redirect_to_url(short_code: str, request: Request):
+async def redirect_to_url(short_code: str, request: Request, service: AsyncURLService = Depends(get_url_service)):
     """
     Redirect to the original URL and record click data
+
+    Returns the URL as JSON for the frontend to follow; ``/r/{short_code}``
+    answers with an actual HTTP redirect.
     """
-    url = url_service.get_url_by_short_code(short_code)
+    url = await service.get_url_by_short_code(short_code)
     if not url:
         raise HTTPException(status_code=404, detail="URL not found")
-    
+
     # Parse user agent
-    user_agent = request.headers.get("user-agent", "")
-    browser, device = parse_user_agent(user_agent)
-    
+    raw_user_agent = request.headers.get("user-agent", "")
+    user_agent = classify_user_agent(raw_user_agent)
+
     # Get client IP
     client_ip = request.client.host if request.client else "0.0.0.0"
-    
-    # Record click (use a default country for now, in a real app you'd use IP geolocation)
-    url_service.record_click(
+
+    # Record click, with the country from the offline GeoIP database
+    await service.record_click(
         short_code=short_code,
-        browser=browser,
-        device=device,
-        country="Unknown",  # In a real app, determine this from IP
-        ip=client_ip
+        browser=user_agent.browser,
+        device=user_agent.device,
+        country=lookup_country(client_ip),
+        ip=client_ip,
+        os=user_agent.os,
+        user_agent=raw_user_agent
     )
-    
+
     # Return the original URL for redirection
     return {"url": url.original_url}
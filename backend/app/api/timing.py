@@ -0,0 +1,55 @@
+import time
+from functools import wraps
+from typing import Awaitable, Callable
+from fastapi import HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from app.core.config import settings
+from app.core.elasticsearch import is_unavailable
+from app.utils import metrics
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute that records its latency in ``http_request_duration_seconds``
+
+    Labelled with the route template (``/analytics/{short_code}``), so the
+    number of series stays bounded by the number of routes.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Awaitable[Response]]:
+        return timed(self.path, super().get_route_handler())
+
+def timed(route: str, handler: Callable[[Request], Awaitable[Response]]) -> Callable[[Request], Awaitable[Response]]:
+    """
+    Wrap a Starlette endpoint so it records its latency under ``route``
+
+    Elasticsearch being unreachable, overloaded or behind an open circuit
+    breaker is answered with 503 and Retry-After rather than a 500.
+    """
+
+    @wraps(handler)
+    async def timed_handler(request: Request) -> Response:
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            return response
+        except HTTPException as e:
+            status = e.status_code
+            raise
+        except RequestValidationError:
+            status = 422
+            raise
+        except Exception as e:
+            if not is_unavailable(e):
+                raise
+            status = 503
+            return JSONResponse({"detail": "Storage unavailable"}, status_code=503, headers={
+                "retry-after": str(int(settings.ELASTICSEARCH_BREAKER_RESET_TIMEOUT))
+            })
+        finally:
+            metrics.HTTP_REQUEST_SECONDS.labels(route, request.method, str(status)).observe(time.perf_counter() - started)
+
+    return timed_handler
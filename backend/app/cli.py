@@ -0,0 +1,176 @@
+"""
+Command line maintenance tasks
+
+Usage:
+    python -m app.cli migrate
+    python -m app.cli compact-rollups [--batch-size N]
+    python -m app.cli shorten-bulk INPUT [--output OUTPUT]
+    python -m app.cli build-geoip CSV OUTPUT
+    python -m app.cli build-link-table OUTPUT [--batch-size N] [--every SECONDS]
+    python -m app.cli export-clicks [--code CODE] [--from T] [--to T] [--format ndjson|parquet] [--output OUTPUT]
+    python -m app.cli replay-clicks [--code CODE] [--from T] [--to T] [--threads N] [--dry-run]
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from datetime import datetime
+from typing import Iterator, TextIO
+from app.core.elasticsearch import create_client
+from app.models.url import URLCreate
+
+def migrate(args: argparse.Namespace) -> int:
+    """Create Elasticsearch indices, templates and policies"""
+    from app.services.migrations import migrate as migrate_indices
+
+    migrate_indices(create_client())
+    return 0
+
+def compact_rollups(args: argparse.Namespace) -> int:
+    """Fold un-rolled raw clicks into the rollup index"""
+    from app.services import rollups
+
+    compacted = rollups.compact(create_client(), batch_size=args.batch_size)
+    print(f"Compacted {compacted} clicks into rollups")
+    return 0
+
+def _read_url_creates(f: TextIO) -> Iterator[URLCreate]:
+    """Read a JSON array or NDJSON of {"original_url": ...} objects"""
+    first = f.read(1)
+    while first.isspace():
+        first = f.read(1)
+    if first == "[":
+        for item in json.loads(first + f.read()):
+            yield URLCreate(**item)
+        return
+    # NDJSON: stream line by line, putting back the peeked character
+    for line in itertools.chain([first + f.readline()], f):
+        if line.strip():
+            yield URLCreate(**json.loads(line))
+
+def shorten_bulk(args: argparse.Namespace) -> int:
+    """Shorten every URL in a file, writing one NDJSON result per line"""
+    from app.services.url_service import get_url_service
+
+    url_service = get_url_service()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for result in url_service.create_short_urls(_read_url_creates(source)):
+            output.write(result.json())
+            output.write("\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        url_service.click_pipeline.stop()
+    return 0
+
+def build_geoip(args: argparse.Namespace) -> int:
+    """Compile an IP range CSV into the memory-mapped GeoIP database format"""
+    from app.utils.geoip import compile_database
+
+    database = compile_database(args.csv, args.output)
+    print(f"Wrote {len(database)} ranges in {len(database.countries)} countries to {args.output}")
+    return 0
+
+def build_link_table(args: argparse.Namespace) -> int:
+    """Snapshot the urls index into the shared link table, once or every N seconds"""
+    from app.services.link_table import build_link_table as build_table
+
+    es = create_client()
+    while True:
+        started = time.perf_counter()
+        table = build_table(es, args.output, batch_size=args.batch_size)
+        print(f"Wrote {len(table)} links to {args.output} in {time.perf_counter() - started:.1f} s")
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+def export_clicks(args: argparse.Namespace) -> int:
+    """Stream raw clicks of a code and/or time range to a file"""
+    from app.services.click_export import export_clicks as export
+
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        rows = export(create_client(), output, format=args.format, short_code=args.code,
+                      start=args.start, end=args.end, batch_size=args.batch_size)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    print(f"Exported {rows} clicks", file=sys.stderr)
+    return 0
+
+def replay_clicks(args: argparse.Namespace) -> int:
+    """Re-classify stored clicks from their raw user agents and IPs"""
+    from app.services.click_replay import ClickReplay
+
+    replay = ClickReplay(create_client(), short_code=args.code, start=args.start, end=args.end, batch_size=args.batch_size)
+    if args.dry_run:
+        replay.dry_run()
+    else:
+        replay.run(thread_count=args.threads, chunk_size=args.chunk_size)
+    fields = ", ".join(f"{field} {count}" for field, count in replay.changed_fields.most_common()) or "none"
+    print(f"Scanned {replay.scanned} clicks, {replay.changed} changed ({fields}), {replay.resumed} resumed, {replay.failed} failed"
+          + (" (dry run)" if args.dry_run else ""))
+    if replay.failed:
+        print("Run the replay again to finish the failed clicks")
+    return 1 if replay.failed else 0
+
+def _add_click_selection(parser: argparse.ArgumentParser):
+    parser.add_argument("--code", help="Only this short code (default: all)")
+    parser.add_argument("--from", dest="start", type=datetime.fromisoformat, help="ISO time, inclusive")
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat, help="ISO time, exclusive")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Clicks read per search request")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="URL Shortener maintenance tasks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migration = commands.add_parser("migrate", help="Create Elasticsearch indices, templates and policies")
+    migration.set_defaults(func=migrate)
+
+    compact = commands.add_parser("compact-rollups", help="Roll up raw clicks not yet counted in click_rollups")
+    compact.add_argument("--batch-size", type=int, default=1000)
+    compact.set_defaults(func=compact_rollups)
+
+    bulk = commands.add_parser("shorten-bulk", help="Shorten URLs from a JSON array or NDJSON file")
+    bulk.add_argument("input", help="Input file, or - for stdin")
+    bulk.add_argument("--output", default="-", help="NDJSON output file (default: stdout)")
+    bulk.set_defaults(func=shorten_bulk)
+
+    geoip = commands.add_parser("build-geoip", help="Compile a start,end,country CSV for GEOIP_DATABASE_PATH")
+    geoip.add_argument("csv", help="IP range CSV (IP strings or integers)")
+    geoip.add_argument("output", help="Compiled database file")
+    geoip.set_defaults(func=build_geoip)
+
+    links = commands.add_parser("build-link-table", help="Snapshot short codes into the LINK_TABLE_PATH file")
+    links.add_argument("output", help="Link table file, replaced atomically")
+    links.add_argument("--batch-size", type=int, default=5000)
+    links.add_argument("--every", type=float, default=0, help="Rebuild every SECONDS instead of once")
+    links.set_defaults(func=build_link_table)
+
+    export = commands.add_parser("export-clicks", help="Stream raw clicks as NDJSON or Parquet")
+    _add_click_selection(export)
+    export.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    export.add_argument("--output", default="-", help="Output file (default: stdout)")
+    export.set_defaults(func=export_clicks)
+
+    replay = commands.add_parser("replay-clicks", help="Re-derive browser, device, os and country of stored clicks")
+    _add_click_selection(replay)
+    replay.add_argument("--threads", type=int, default=4, help="Concurrent bulk requests")
+    replay.add_argument("--chunk-size", type=int, default=500, help="Actions per bulk request")
+    replay.add_argument("--dry-run", action="store_true", help="Only count what would change")
+    replay.set_defaults(func=replay_clicks)
+
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
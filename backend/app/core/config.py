@@ -17,10 +17,117 @@ class Settings(BaseSettings):
     ELASTICSEARCH_PORT: int = int(os.getenv("ELASTICSEARCH_PORT", "9200"))
     ELASTICSEARCH_URL: str = f"http://{ELASTICSEARCH_HOST}:{ELASTICSEARCH_PORT}"
     ELASTICSEARCH_API_KEY: str = os.getenv("ELASTICSEARCH_API_KEY", "")
+    ELASTICSEARCH_MAX_CONNECTIONS: int = int(os.getenv("ELASTICSEARCH_MAX_CONNECTIONS", "10"))
+    # Discover the cluster's other nodes on startup and when one fails
+    ELASTICSEARCH_SNIFF: bool = os.getenv("ELASTICSEARCH_SNIFF", "false").lower() == "true"
+    # Per-operation request timeouts in seconds
+    ELASTICSEARCH_GET_TIMEOUT: float = float(os.getenv("ELASTICSEARCH_GET_TIMEOUT", "1.0"))
+    ELASTICSEARCH_SEARCH_TIMEOUT: float = float(os.getenv("ELASTICSEARCH_SEARCH_TIMEOUT", "5.0"))
+    ELASTICSEARCH_BULK_TIMEOUT: float = float(os.getenv("ELASTICSEARCH_BULK_TIMEOUT", "30.0"))
+    ELASTICSEARCH_REQUEST_TIMEOUT: float = float(os.getenv("ELASTICSEARCH_REQUEST_TIMEOUT", "10.0"))
+    # Retries of read requests, with jittered exponential backoff (seconds)
+    ELASTICSEARCH_MAX_RETRIES: int = int(os.getenv("ELASTICSEARCH_MAX_RETRIES", "2"))
+    ELASTICSEARCH_RETRY_BACKOFF: float = float(os.getenv("ELASTICSEARCH_RETRY_BACKOFF", "0.05"))
+    ELASTICSEARCH_RETRY_BACKOFF_MAX: float = float(os.getenv("ELASTICSEARCH_RETRY_BACKOFF_MAX", "1.0"))
+    # Fail fast for ELASTICSEARCH_BREAKER_RESET_TIMEOUT seconds after this many consecutive failures
+    ELASTICSEARCH_BREAKER_FAILURES: int = int(os.getenv("ELASTICSEARCH_BREAKER_FAILURES", "5"))
+    ELASTICSEARCH_BREAKER_RESET_TIMEOUT: float = float(os.getenv("ELASTICSEARCH_BREAKER_RESET_TIMEOUT", "10.0"))
+    # Create indices when a service starts instead of via `python -m app.cli migrate`
+    ELASTICSEARCH_MIGRATE_ON_STARTUP: bool = os.getenv("ELASTICSEARCH_MIGRATE_ON_STARTUP", "false").lower() == "true"
     
     # URL shortening settings
     SHORT_URL_ALPHABET: str = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
     SHORT_URL_LENGTH: int = 6
+    SHORT_CODE_STRATEGY: str = os.getenv("SHORT_CODE_STRATEGY", "nanoid")  # nanoid or counter
+    SHORT_CODE_BLOCK_SIZE: int = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+    # Secret key for scrambling counter codes; empty keeps them sequential
+    SHORT_CODE_SCRAMBLE_KEY: str = os.getenv("SHORT_CODE_SCRAMBLE_KEY", "")
+    # Return the existing short code when the same URL is shortened again
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+    DEDUP_CACHE_SIZE: int = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+    # URLs written per bulk request by /shorten/bulk
+    BULK_SHORTEN_CHUNK_SIZE: int = int(os.getenv("BULK_SHORTEN_CHUNK_SIZE", "1000"))
+    
+    # Storage used by the standalone Flask app: memory, sqlite or elasticsearch
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "memory")
+    SQLITE_PATH: str = os.getenv("SQLITE_PATH", "urlshortener.db")
+    
+    # Short code resolution cache (per process)
+    URL_CACHE_SIZE: int = int(os.getenv("URL_CACHE_SIZE", "100000"))
+    URL_CACHE_TTL: float = float(os.getenv("URL_CACHE_TTL", "3600"))
+    URL_CACHE_NEGATIVE_TTL: float = float(os.getenv("URL_CACHE_NEGATIVE_TTL", "30"))
+
+    # Memory-mapped link table shared by every worker (see `python -m app.cli
+    # build-link-table`); codes not in it are resolved through a per-worker
+    # cache of LINK_TABLE_DELTA_SIZE entries instead of URL_CACHE_SIZE
+    LINK_TABLE_PATH: str = os.getenv("LINK_TABLE_PATH", "")
+    LINK_TABLE_CHECK_INTERVAL: float = float(os.getenv("LINK_TABLE_CHECK_INTERVAL", "10"))  # seconds between checks for a new file
+    LINK_TABLE_DELTA_SIZE: int = int(os.getenv("LINK_TABLE_DELTA_SIZE", "10000"))
+
+    # Serialized /recent and /analytics responses, per worker. New clicks and
+    # URLs invalidate only the worker that saw them, so the TTL (seconds) is
+    # how stale another worker's copy can get
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "5"))
+    # Seconds from a click bulk until its clicks are searchable: the indices'
+    # refresh_interval (1s by default) plus the refresh itself. A code's
+    # analytics are invalidated this long after its clicks are written
+    ELASTICSEARCH_REFRESH_DELAY: float = float(os.getenv("ELASTICSEARCH_REFRESH_DELAY", "1.5"))
+    
+    # GET /r/{short_code}: 302 sends every click to the server, 301 lets
+    # browsers and proxies reuse the redirect for as long as Cache-Control allows
+    REDIRECT_STATUS_CODE: int = int(os.getenv("REDIRECT_STATUS_CODE", "302"))
+    REDIRECT_CACHE_CONTROL: str = os.getenv("REDIRECT_CACHE_CONTROL", "private, max-age=0")
+    
+    # Distinct user agent strings kept by the memoized classifier
+    UA_CACHE_SIZE: int = int(os.getenv("UA_CACHE_SIZE", "4096"))
+
+    # Offline IP geolocation: range CSV or compiled database (see `python -m
+    # app.cli build-geoip`); empty records every country as "Unknown"
+    GEOIP_DATABASE_PATH: str = os.getenv("GEOIP_DATABASE_PATH", "")
+    GEOIP_CACHE_SIZE: int = int(os.getenv("GEOIP_CACHE_SIZE", "65536"))
+    
+    # Click ingestion pipeline
+    CLICK_QUEUE_SIZE: int = int(os.getenv("CLICK_QUEUE_SIZE", "10000"))
+    CLICK_BATCH_SIZE: int = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+    CLICK_FLUSH_INTERVAL: float = float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0"))
+    CLICK_BACKPRESSURE: str = os.getenv("CLICK_BACKPRESSURE", "drop")  # drop, block or spill
+    CLICK_BLOCK_TIMEOUT: float = float(os.getenv("CLICK_BLOCK_TIMEOUT", "0.5"))
+    CLICK_SPILL_PATH: str = os.getenv("CLICK_SPILL_PATH", "clicks-spill.ndjson")
+    # Maintain click_rollups on ingest and read analytics from them
+    CLICK_ROLLUPS_ENABLED: bool = os.getenv("CLICK_ROLLUPS_ENABLED", "true").lower() == "true"
+    # Journal clicks on local disk instead of queueing them in memory (see
+    # app.services.click_journal); each worker claims a subdirectory
+    CLICK_JOURNAL_DIR: str = os.getenv("CLICK_JOURNAL_DIR", "")
+    CLICK_JOURNAL_SEGMENT_BYTES: int = int(os.getenv("CLICK_JOURNAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+    CLICK_JOURNAL_COMMIT_INTERVAL: float = float(os.getenv("CLICK_JOURNAL_COMMIT_INTERVAL", "0.01"))  # seconds between fsyncs
+    # Make every click wait for the fsync covering it
+    CLICK_JOURNAL_WAIT_FOR_COMMIT: bool = os.getenv("CLICK_JOURNAL_WAIT_FOR_COMMIT", "false").lower() == "true"
+
+    # Unique visitors per link and day as HyperLogLog sketches of visitor IPs
+    # (see app.services.visitor_sketches); standard error 1.04 / sqrt(2 ** precision)
+    VISITOR_SKETCHES_ENABLED: bool = os.getenv("VISITOR_SKETCHES_ENABLED", "true").lower() == "true"
+    VISITOR_SKETCH_PRECISION: int = int(os.getenv("VISITOR_SKETCH_PRECISION", "12"))
+    VISITOR_SKETCH_FLUSH_INTERVAL: float = float(os.getenv("VISITOR_SKETCH_FLUSH_INTERVAL", "10"))  # seconds
+
+    # Hot links are always tracked (GET /api/hot); this also coalesces their
+    # clicks into per-minute counter documents. Off by default: counter
+    # documents keep no ip or user_agent, so replay-clicks cannot re-derive
+    # them and unique visitors rely on the visitor sketches
+    HOT_LINKS_ENABLED: bool = os.getenv("HOT_LINKS_ENABLED", "false").lower() == "true"
+    HOT_LINK_CAPACITY: int = int(os.getenv("HOT_LINK_CAPACITY", "1000"))  # codes tracked per worker
+    HOT_LINK_THRESHOLD: int = int(os.getenv("HOT_LINK_THRESHOLD", "100"))  # clicks per window to count as hot
+    HOT_LINK_DECAY_INTERVAL: float = float(os.getenv("HOT_LINK_DECAY_INTERVAL", "60"))  # seconds per halving
+    
+    # Click index partitioning and retention
+    CLICKS_PARTITION_INTERVAL: str = os.getenv("CLICKS_PARTITION_INTERVAL", "month")  # day or month
+    CLICKS_NUMBER_OF_SHARDS: int = int(os.getenv("CLICKS_NUMBER_OF_SHARDS", "1"))
+    CLICKS_NUMBER_OF_REPLICAS: int = int(os.getenv("CLICKS_NUMBER_OF_REPLICAS", "1"))
+    CLICKS_RETENTION_DAYS: int = int(os.getenv("CLICKS_RETENTION_DAYS", "395"))  # 0 keeps clicks forever
+    CLICKS_MAX_PARTITIONS_PER_QUERY: int = int(os.getenv("CLICKS_MAX_PARTITIONS_PER_QUERY", "60"))
+    
+    # Expose /debug/profiler/* to start, stop and read the sampling profiler
+    PROFILER_ENDPOINTS_ENABLED: bool = os.getenv("PROFILER_ENDPOINTS_ENABLED", "false").lower() == "true"
     
     # CORS settings
     CORS_ORIGINS: list = ["http://localhost:5173"]
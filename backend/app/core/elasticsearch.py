@@ -0,0 +1,214 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from elastic_transport.client_utils import DefaultType
+from elasticsearch import ApiError, AsyncElasticsearch, ConnectionError, Elasticsearch, TransportError, helpers
+from app.core.config import settings
+from app.utils import metrics
+from app.utils.circuit_breaker import CircuitBreaker
+
+ES_REQUEST_SECONDS = metrics.histogram(
+    "es_request_duration_seconds",
+    "Elasticsearch request latency by operation (get, index, search, msearch, count, bulk, ...)",
+    ["operation"]
+)
+ES_REQUEST_ERRORS = metrics.counter(
+    "es_request_errors_total",
+    "Elasticsearch requests that raised, including 404 and 409 responses",
+    ["operation"]
+)
+
+_DOC_OPERATIONS = {"GET": "get", "HEAD": "exists", "DELETE": "delete"}
+
+def es_operation(method: str, path: str) -> str:
+    """
+    Metric label for a request: the first ``_endpoint`` path segment
+
+    Index names cannot start with an underscore, so ``/urls/_doc/abc`` is a
+    document call (get/index/delete), ``/clicks-*/_search`` a search and
+    ``/_bulk`` a bulk request. Paths without one are index admin calls.
+    """
+    for part in path.split("?", 1)[0].split("/"):
+        if part.startswith("_"):
+            if part == "_doc":
+                return _DOC_OPERATIONS.get(method, "index")
+            return part[1:]
+    if path.strip("/") == "":
+        return "info"
+    return "index_exists" if method == "HEAD" else "index_admin"
+
+# Operations that change nothing, so retrying them after a timeout is safe
+READ_OPERATIONS = frozenset(("get", "exists", "mget", "search", "msearch", "count", "info", "index_exists"))
+# Statuses meaning the cluster is overloaded or partly down rather than the request being wrong
+UNAVAILABLE_STATUSES = (429, 502, 503, 504)
+
+class CircuitOpenError(ConnectionError):
+    """Raised without contacting Elasticsearch while the circuit breaker is open"""
+
+def is_unavailable(error: Exception) -> bool:
+    """Whether an error means Elasticsearch is unreachable or overloaded"""
+    if isinstance(error, TransportError):
+        return True
+    return isinstance(error, ApiError) and error.status_code in UNAVAILABLE_STATUSES
+
+def retryable(status: Optional[int]) -> bool:
+    """Whether a bulk item that failed with ``status`` may succeed if sent again"""
+    return status is None or status == 429 or status >= 500
+
+def bulk_items(es, actions: List[Dict[str, Any]]) -> List[Tuple[bool, Dict[str, Any]]]:
+    """Send ``actions`` in one bulk request; ``(ok, item)`` per action, in order"""
+    results = helpers.streaming_bulk(es, actions, chunk_size=max(len(actions), 1), raise_on_error=False)
+    return [(ok, next(iter(result.values()))) for ok, result in results]
+
+def operation_timeout(operation: str) -> float:
+    """Request timeout in seconds for an ``es_operation`` label"""
+    if operation in ("get", "exists", "mget"):
+        return settings.ELASTICSEARCH_GET_TIMEOUT
+    if operation in ("search", "msearch", "count"):
+        return settings.ELASTICSEARCH_SEARCH_TIMEOUT
+    if operation == "bulk":
+        return settings.ELASTICSEARCH_BULK_TIMEOUT
+    return settings.ELASTICSEARCH_REQUEST_TIMEOUT
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so retrying workers don't stampede a recovering node"""
+    return random.uniform(0, min(settings.ELASTICSEARCH_RETRY_BACKOFF_MAX, settings.ELASTICSEARCH_RETRY_BACKOFF * 2 ** attempt))
+
+_circuit_breaker: Optional[CircuitBreaker] = None
+_circuit_breaker_lock = threading.Lock()
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """The breaker shared by every Elasticsearch client in this process"""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        with _circuit_breaker_lock:
+            if _circuit_breaker is None:
+                _circuit_breaker = CircuitBreaker(
+                    "elasticsearch",
+                    failure_threshold=settings.ELASTICSEARCH_BREAKER_FAILURES,
+                    reset_timeout=settings.ELASTICSEARCH_BREAKER_RESET_TIMEOUT
+                )
+                metrics.REGISTRY.register_collector(_circuit_breaker.collect_metrics)
+    return _circuit_breaker
+
+def _timed_client(client, operation: str):
+    """``client`` with the operation's timeout, unless the caller chose one with ``options``"""
+    if not isinstance(client._request_timeout, DefaultType):
+        return client
+    # options() copies the client, which costs more than a cached get
+    timeout = operation_timeout(operation)
+    clients = client.__dict__.setdefault("_timed_clients", {})
+    timed = clients.get(timeout)
+    if timed is None:
+        timed = clients[timeout] = client.options(request_timeout=timeout)
+    return timed
+
+class _Attempts:
+    """
+    Circuit breaker, metrics and retry decisions for the attempts of one
+    request, shared by the sync and asyncio clients
+    """
+
+    __slots__ = ("operation", "breaker", "attempt", "started")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.breaker = get_circuit_breaker()
+        self.attempt = 0
+        self.started = 0.0
+
+    def begin(self):
+        """Start an attempt; raises CircuitOpenError while the breaker is open"""
+        if not self.breaker.allow():
+            ES_REQUEST_ERRORS.labels(self.operation).inc()
+            raise CircuitOpenError("Elasticsearch circuit breaker is open")
+        self.started = time.perf_counter()
+
+    def succeeded(self):
+        ES_REQUEST_SECONDS.labels(self.operation).observe(time.perf_counter() - self.started)
+        self.breaker.record(False)
+
+    def failed(self, error: BaseException) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up and re-raise ``error``"""
+        ES_REQUEST_SECONDS.labels(self.operation).observe(time.perf_counter() - self.started)
+        if not isinstance(error, Exception):
+            # Cancelled (client gone, timeout) or interrupted: no outcome, but
+            # a half-open trial must not keep the breaker waiting for one
+            self.breaker.release()
+            return None
+        ES_REQUEST_ERRORS.labels(self.operation).inc()
+        unavailable = is_unavailable(error)
+        self.breaker.record(unavailable)
+        if not unavailable or self.operation not in READ_OPERATIONS or self.attempt >= settings.ELASTICSEARCH_MAX_RETRIES:
+            return None
+        delay = retry_delay(self.attempt)
+        self.attempt += 1
+        return delay
+
+class InstrumentedElasticsearch(Elasticsearch):
+    """
+    Elasticsearch client with per-operation timeouts, retries and a circuit breaker
+
+    Read operations that fail because the cluster is unreachable or
+    overloaded are retried up to ``ELASTICSEARCH_MAX_RETRIES`` times with
+    jittered backoff; writes are not, as they may have been applied. Every
+    request goes through the shared circuit breaker and is timed in
+    ``es_request_duration_seconds``.
+    """
+
+    def perform_request(self, method, path, **kwargs):
+        attempts = _Attempts(es_operation(method, path))
+        client = _timed_client(self, attempts.operation)
+        while True:
+            attempts.begin()
+            try:
+                response = super(InstrumentedElasticsearch, client).perform_request(method, path, **kwargs)
+            except BaseException as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+            else:
+                attempts.succeeded()
+                return response
+            time.sleep(delay)
+
+class InstrumentedAsyncElasticsearch(AsyncElasticsearch):
+    """asyncio counterpart of ``InstrumentedElasticsearch``"""
+
+    async def perform_request(self, method, path, **kwargs):
+        attempts = _Attempts(es_operation(method, path))
+        client = _timed_client(self, attempts.operation)
+        while True:
+            attempts.begin()
+            try:
+                response = await super(InstrumentedAsyncElasticsearch, client).perform_request(method, path, **kwargs)
+            except BaseException as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+            else:
+                attempts.succeeded()
+                return response
+            await asyncio.sleep(delay)
+
+def _client_options() -> dict:
+    options = {
+        "connections_per_node": settings.ELASTICSEARCH_MAX_CONNECTIONS,
+        # Retries are done above, with backoff and the breaker in the loop
+        "max_retries": 0,
+    }
+    if settings.ELASTICSEARCH_SNIFF:
+        options.update(sniff_on_start=True, sniff_on_node_failure=True, min_delay_between_sniffing=60)
+    if settings.ELASTICSEARCH_API_KEY:
+        options["api_key"] = settings.ELASTICSEARCH_API_KEY
+    return options
+
+def create_client() -> Elasticsearch:
+    """Create a synchronous Elasticsearch client from settings"""
+    return InstrumentedElasticsearch([settings.ELASTICSEARCH_URL], **_client_options())
+
+def create_async_client() -> AsyncElasticsearch:
+    """Create an asyncio Elasticsearch client (aiohttp connection pool) from settings"""
+    return InstrumentedAsyncElasticsearch([settings.ELASTICSEARCH_URL], **_client_options())
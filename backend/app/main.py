@@ -1,10 +1,18 @@
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, request, jsonify, redirect, g, abort
 from flask_cors import CORS
+import atexit
 import os
 import json
+import time
 from datetime import datetime
 from nanoid import generate
 import logging
+from elasticsearch import TransportError
+from app.services.storage import ClickBuffer, create_storage
+from app.utils import metrics
+from app.utils.profiler import get_profiler
+from app.utils.geoip import lookup_country
+from app.utils.user_agent_parser import classify_user_agent
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,31 +26,26 @@ CORS(app, resources={r"/api/*": {"origins": "http://localhost:5173"}})
 FRONTEND_BASE_URL = os.getenv("FRONTEND_BASE_URL", "http://localhost:5173")
 SHORT_URL_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 SHORT_URL_LENGTH = 6
+PROFILER_ENDPOINTS_ENABLED = os.getenv("PROFILER_ENDPOINTS_ENABLED", "false").lower() == "true"
 
-# In-memory storage (replace with Elasticsearch in production)
-urls_db = {}
-clicks_db = []
+# Storage selected by STORAGE_BACKEND (memory, sqlite or elasticsearch)
+storage = create_storage()
+# Clicks are written in batches rather than one transaction per redirect
+clicks = ClickBuffer.from_settings(storage)
+atexit.register(clicks.close)
 
 # Helper functions
 def get_short_url(short_code):
     return f"{FRONTEND_BASE_URL}/{short_code}"
 
 def create_short_url(original_url):
-    # Generate a unique short code
+    # Store URL under a fresh short code, retrying if it is already
+    # taken (very unlikely but possible)
+    created_at = datetime.utcnow().isoformat()
     short_code = generate(alphabet=SHORT_URL_ALPHABET, size=SHORT_URL_LENGTH)
-
-    # Check if short code already exists (very unlikely but possible)
-    while short_code in urls_db:
+    while not storage.put_url(short_code, original_url, created_at):
         short_code = generate(alphabet=SHORT_URL_ALPHABET, size=SHORT_URL_LENGTH)
 
-    # Store URL
-    created_at = datetime.utcnow().isoformat()
-    urls_db[short_code] = {
-        "original_url": original_url,
-        "short_code": short_code,
-        "created_at": created_at
-    }
-
     # Return response
     return {
         "original_url": original_url,
@@ -52,80 +55,64 @@ def create_short_url(original_url):
     }
 
 def record_click(short_code, user_agent, ip):
-    # Parse user agent (simplified)
-    browser = "Unknown"
-    if "Firefox" in user_agent:
-        browser = "Firefox"
-    elif "Chrome" in user_agent and "Edg" not in user_agent:
-        browser = "Chrome"
-    elif "Safari" in user_agent and "Chrome" not in user_agent:
-        browser = "Safari"
-    elif "Edg" in user_agent:
-        browser = "Edge"
-
-    device = "Desktop"
-    if any(m in user_agent for m in ["Android", "iPhone", "Mobile"]):
-        device = "Mobile"
-    elif "iPad" in user_agent:
-        device = "Tablet"
+    # Parse user agent
+    info = classify_user_agent(user_agent)
 
     # Record click
-    clicks_db.append({
+    clicks.add({
         "short_code": short_code,
-        "timestamp": datetime.utcnow().isoformat(),
-        "browser": browser,
-        "device": device,
-        "country": "Unknown",
-        "ip": ip
+        "timestamp": datetime.utcnow(),
+        "browser": info.browser,
+        "device": info.device,
+        "os": info.os,
+        "country": lookup_country(ip),
+        "ip": ip,
+        "user_agent": user_agent
     })
 
 def get_url_analytics(short_code):
-    if short_code not in urls_db:
+    url_data = storage.get_url(short_code)
+    if url_data is None:
         return None
 
-    # Get URL data
-    url_data = urls_db[short_code]
-
-    # Filter clicks for this short code
-    url_clicks = [click for click in clicks_db if click["short_code"] == short_code]
-    total_clicks = len(url_clicks)
-
-    # Aggregate by date (simplified)
-    clicks_by_date = {}
-    for click in url_clicks:
-        date = click["timestamp"].split("T")[0]
-        clicks_by_date[date] = clicks_by_date.get(date, 0) + 1
-
-    # Aggregate by browser
-    clicks_by_browser = {}
-    for click in url_clicks:
-        browser = click["browser"]
-        clicks_by_browser[browser] = clicks_by_browser.get(browser, 0) + 1
-
-    # Aggregate by device
-    clicks_by_device = {}
-    for click in url_clicks:
-        device = click["device"]
-        clicks_by_device[device] = clicks_by_device.get(device, 0) + 1
-
-    # Aggregate by country
-    clicks_by_country = {}
-    for click in url_clicks:
-        country = click["country"]
-        clicks_by_country[country] = clicks_by_country.get(country, 0) + 1
+    # Count this code's clicks by date, browser, device and country,
+    # including those still buffered in front of memory or SQLite
+    if not storage.batches_clicks:
+        clicks.flush()
+    counts = storage.click_counts(short_code, since=datetime.fromisoformat(url_data.created_at))
 
     # Format response
     return {
         "short_code": short_code,
-        "original_url": url_data["original_url"],
-        "total_clicks": total_clicks,
-        "created_at": url_data["created_at"],
-        "clicks_by_date": [{"date": date, "count": count} for date, count in clicks_by_date.items()],
-        "clicks_by_browser": [{"browser": browser, "count": count} for browser, count in clicks_by_browser.items()],
-        "clicks_by_device": [{"device": device, "count": count} for device, count in clicks_by_device.items()],
-        "clicks_by_country": [{"country": country, "count": count} for country, count in clicks_by_country.items()]
+        "original_url": url_data.original_url,
+        "total_clicks": counts["total_clicks"],
+        "unique_visitors": counts.get("unique_visitors"),
+        "created_at": url_data.created_at,
+        "clicks_by_date": [{"date": date, "count": count} for date, count in sorted(counts["date"].items())],
+        "clicks_by_browser": [{"browser": browser, "count": count} for browser, count in counts["browser"].items()],
+        "clicks_by_device": [{"device": device, "count": count} for device, count in counts["device"].items()],
+        "clicks_by_country": [{"country": country, "count": count} for country, count in counts["country"].items()]
     }
 
+# Request latency by route template
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def observe_latency(response):
+    started = g.pop("started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - started)
+    return response
+
+# Elasticsearch storage unreachable, timed out or behind an open circuit breaker
+@app.errorhandler(TransportError)
+def storage_unavailable(error):
+    logger.warning(f"Storage unavailable: {error}")
+    return jsonify({"error": "Storage unavailable"}), 503
+
 # API Routes
 @app.route('/api/shorten', methods=['POST'])
 def shorten_url():
@@ -138,18 +125,16 @@ def shorten_url():
 @app.route('/api/recent', methods=['GET'])
 def get_recent_urls():
     # Get most recent URLs (up to 10)
-    recent = list(urls_db.values())
-    recent.sort(key=lambda x: x["created_at"], reverse=True)
-    recent = recent[:10]
+    recent = storage.recent_urls(10)
 
     # Format response
     result = []
     for url in recent:
         result.append({
-            "original_url": url["original_url"],
-            "short_code": url["short_code"],
-            "short_url": get_short_url(url["short_code"]),
-            "created_at": url["created_at"]
+            "original_url": url.original_url,
+            "short_code": url.short_code,
+            "short_url": get_short_url(url.short_code),
+            "created_at": url.created_at
         })
 
     return jsonify(result)
@@ -162,9 +147,36 @@ def get_analytics(short_code):
 
     return jsonify(analytics)
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route('/api/debug/profiler/start', methods=['POST'])
+def start_profiler():
+    if not PROFILER_ENDPOINTS_ENABLED:
+        abort(404)
+    profiler = get_profiler()
+    profiler.start(interval=request.args.get("interval_ms", 5.0, type=float) / 1000)
+    return jsonify({"running": profiler.running, "interval_ms": profiler.interval * 1000})
+
+@app.route('/api/debug/profiler/stop', methods=['POST'])
+def stop_profiler():
+    if not PROFILER_ENDPOINTS_ENABLED:
+        abort(404)
+    profiler = get_profiler()
+    profiler.stop()
+    return jsonify({"running": profiler.running, "samples": sum(profiler.samples.values())})
+
+@app.route('/api/debug/profiler', methods=['GET'])
+def get_profile():
+    if not PROFILER_ENDPOINTS_ENABLED:
+        abort(404)
+    return get_profiler().collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
 @app.route('/<short_code>', methods=['GET'])
 def redirect_to_url(short_code):
-    if short_code not in urls_db:
+    url_data = storage.get_url(short_code)
+    if url_data is None:
         return "URL not found", 404
 
     # Record click
@@ -173,7 +185,7 @@ def redirect_to_url(short_code):
     record_click(short_code, user_agent, ip)
 
     # Redirect to original URL
-    return redirect(urls_db[short_code]["original_url"])
+    return redirect(url_data.original_url)
 
 @app.route('/', methods=['GET'])
 def home():
@@ -16,6 +16,33 @@ class URLResponse(URLBase):
     class Config:
         orm_mode = True
 
+class BulkURLError(URLBase):
+    """Line emitted by the bulk endpoint for an item that could not be shortened"""
+    error: str
+
+class HotLink(BaseModel):
+    """A currently popular short code from the per-worker heavy-hitter sketch"""
+    short_code: str
+    clicks: int  # estimated clicks in the current window
+    error: int  # clicks may be overestimated by up to this much
+    coalesced: bool  # clicks are being written as per-minute counters
+
+class Click(BaseModel):
+    """A raw click document; hot-link counter documents stand for ``count`` clicks"""
+    short_code: str
+    timestamp: datetime
+    browser: str
+    device: str
+    os: str
+    country: str
+    ip: Optional[str] = None
+    user_agent: Optional[str] = None
+    count: int = 1
+
+class ClickPage(BaseModel):
+    clicks: List[Click]
+    next_cursor: Optional[str] = None  # pass as ``cursor`` for the next page
+
 class ClickData(BaseModel):
     date: str
     count: int
@@ -36,6 +63,9 @@ class URLAnalytics(BaseModel):
     short_code: str
     original_url: str
     total_clicks: int
+    # Distinct visitor IPs over the whole days the window touches, estimated
+    # with HyperLogLog (about 1.6% standard error); None when not tracked
+    unique_visitors: Optional[int] = None
     created_at: datetime
     clicks_by_date: List[ClickData]
     clicks_by_browser: List[BrowserData]
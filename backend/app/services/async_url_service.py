@@ -0,0 +1,368 @@
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple, Union
+from elasticsearch import ApiError, ConflictError, NotFoundError, TransportError
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core.elasticsearch import create_async_client, create_client, is_unavailable
+from app.models.url import URLCreate, URLResponse, URLAnalytics, BulkURLError, HotLink, ClickPage
+from app.services import es_queries
+from app.services.click_export import ClickWriter, ascan_clicks, export_row
+from app.services.click_pipeline import ClickPipeline
+from app.services.code_generator import create_code_generator
+from app.services.dedup import url_hash
+from app.services.migrations import migrate
+from app.services.url_service import URLServiceBase
+from app.utils import metrics
+from app.utils.cache import MISSING
+from app.utils.response_cache import ResponseCache
+
+# ResponseCache tags
+RECENT_TAG = "recent"
+
+def analytics_tag(short_code: str) -> str:
+    return f"analytics:{short_code}"
+
+class AsyncURLService(URLServiceBase):
+    """
+    asyncio counterpart of ``URLService`` built on ``AsyncElasticsearch``
+
+    Every Elasticsearch call is awaited on a pooled aiohttp connection, so
+    a single worker keeps serving other requests while one is waiting on
+    the cluster. Clicks still go through the batched ``ClickPipeline``,
+    whose worker thread owns its own synchronous client.
+    """
+
+    def __init__(self):
+        self.es = create_async_client()
+        # Shared table first, then this worker's cache (just the codes the table lacks)
+        super().__init__()
+        # Code leases, migrations and the click worker run in threads on a sync client
+        self.sync_es = create_client()
+        self.code_generator = create_code_generator(self.sync_es)
+        self.click_pipeline = ClickPipeline.from_settings(self.sync_es)
+        # Serialized /recent and /analytics responses; a code's analytics go
+        # stale once a batch with its clicks is written, /recent on new URLs
+        self.response_cache = ResponseCache(
+            maxsize=settings.RESPONSE_CACHE_SIZE,
+            ttl=settings.RESPONSE_CACHE_TTL,
+            stale_if_error=is_unavailable
+        )
+        self.click_pipeline.on_flush = self._clicks_flushed
+        metrics.REGISTRY.register_collector(self.collect_metrics)
+
+    def collect_metrics(self) -> List[metrics.Sample]:
+        """Cache counters for the metrics endpoint"""
+        responses = self.response_cache
+        return super().collect_metrics() + metrics.cache_samples("response", responses.hits, responses.misses, len(responses.entries))
+
+    async def startup(self):
+        """Start the click pipeline, migrating indices first if configured to"""
+        if settings.ELASTICSEARCH_MIGRATE_ON_STARTUP:
+            await run_in_threadpool(migrate, self.sync_es)
+        self.click_pipeline.start()
+
+    async def shutdown(self):
+        """Flush pending clicks and close both connection pools"""
+        metrics.REGISTRY.unregister_collector(self.collect_metrics)
+        await run_in_threadpool(self.click_pipeline.stop)
+        self.sync_es.close()
+        await self.es.close()
+
+    async def create_short_url(self, url_create: URLCreate) -> URLResponse:
+        """Create a shortened URL"""
+        if self.dedup:
+            key = url_hash(url_create.original_url)
+            existing = await self._find_duplicate(key)
+            if existing:
+                return existing
+
+        # Create timestamp
+        created_at = datetime.now(timezone.utc)
+
+        # Store in Elasticsearch. op_type=create fails instead of overwriting,
+        # so a (rare) clash with an existing code just takes the next one.
+        while True:
+            short_code = await self._next_code()
+            try:
+                await self.es.create(
+                    index=es_queries.URLS_INDEX,
+                    id=short_code,
+                    document=es_queries.url_document(url_create.original_url, short_code, created_at),
+                    refresh=True
+                )
+                break
+            except ConflictError:
+                continue
+
+        if self.dedup:
+            existing = await self._claim_url_hash(key, short_code)
+            if existing:
+                return existing
+
+        url = self._created_url(url_create, short_code, created_at)
+        self.response_cache.invalidate(RECENT_TAG)
+        return url
+
+    async def create_short_urls(self, url_creates: AsyncIterable[URLCreate]) -> AsyncIterator[Union[URLResponse, BulkURLError]]:
+        """
+        Shorten many URLs with bulk requests, yielding results chunk by chunk
+
+        Nothing is refreshed until the input is exhausted, so a whole load
+        costs a single refresh instead of one per URL.
+        """
+        chunk: List[URLCreate] = []
+        async for url_create in url_creates:
+            chunk.append(url_create)
+            if len(chunk) >= settings.BULK_SHORTEN_CHUNK_SIZE:
+                async for result in self._bulk_create(chunk):
+                    yield result
+                chunk = []
+        if chunk:
+            async for result in self._bulk_create(chunk):
+                yield result
+        await self.es.indices.refresh(index=es_queries.URLS_INDEX)
+        self.response_cache.invalidate(RECENT_TAG)
+
+    async def get_url_by_short_code(self, short_code: str) -> Optional[URLResponse]:
+        """Get URL details by short code"""
+        known = self._known_url(short_code)
+        if known is not None:
+            return None if known is MISSING else known
+        return await self._fetch_url(short_code)
+
+    async def get_original_url(self, short_code: str) -> Optional[str]:
+        """The original URL of a code, for redirects; None if it does not exist"""
+        known = self._known_original_url(short_code)
+        if known is not None:
+            return None if known is MISSING else known
+        url = await self._fetch_url(short_code)
+        return url.original_url if url is not None else None
+
+    async def _fetch_url(self, short_code: str) -> Optional[URLResponse]:
+        try:
+            return self._url_from_result(short_code, await self.es.get(index=es_queries.URLS_INDEX, id=short_code))
+        except NotFoundError:
+            return self._url_from_result(short_code, None)
+        except (ApiError, TransportError) as e:
+            return self._stale_url(short_code, e)
+
+    async def get_recent_urls(self, limit: int = 10) -> List[URLResponse]:
+        """Get recent shortened URLs"""
+        return (await self.get_recent_urls_page(limit))[0]
+
+    async def get_recent_urls_page(self, limit: int = 10, cursor: Optional[str] = None) -> Tuple[List[URLResponse], Optional[str]]:
+        """
+        One page of shortened URLs, newest first
+
+        Returns the page and the cursor of the next one (None after the last
+        page). Raises ValueError for a malformed cursor.
+        """
+        search_after = es_queries.decode_cursor(cursor) if cursor else None
+        result = await self.es.search(
+            index=es_queries.URLS_INDEX,
+            **es_queries.recent_urls_query(limit, search_after)
+        )
+        return es_queries.recent_urls_page(result, limit)
+
+    async def record_click(self, short_code: str, browser: str, device: str, country: str, ip: str, os: str = "Unknown", user_agent: Optional[str] = None) -> bool:
+        """
+        Queue a click on a shortened URL for batched indexing
+
+        ``user_agent`` is the raw header, stored so the click can be
+        re-classified later (see ``app.services.click_replay``).
+        """
+        doc = es_queries.click_document(short_code, browser, device, country, ip, os, user_agent)
+        if self.click_pipeline.blocking:
+            # Waiting for queue space must not stall the event loop
+            return await run_in_threadpool(self.click_pipeline.submit, doc)
+        return self.click_pipeline.submit(doc)
+
+    async def get_hot_links(self, limit: int = 10) -> List[HotLink]:
+        """Top short codes by recent clicks, as seen by this worker"""
+        return self._hot_links(limit)
+
+    async def get_url_analytics(
+        self,
+        short_code: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        interval: str = "day",
+        size: int = 10
+    ) -> Optional[URLAnalytics]:
+        """
+        Get analytics for a URL
+
+        Only clicks in ``[start, end)`` are counted, bucketed by ``interval``
+        (hour, day or week) with the top ``size`` values per breakdown.
+        """
+        result = await self.get_url_analytics_modified(short_code, start, end, interval, size)
+        return result[0] if result else None
+
+    async def get_url_analytics_modified(
+        self,
+        short_code: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        interval: str = "day",
+        size: int = 10
+    ) -> Optional[Tuple[URLAnalytics, float]]:
+        """
+        ``get_url_analytics`` plus when its counts last changed, in epoch
+        seconds: the newest click counted, or the URL's creation
+        """
+        # First check if URL exists
+        url = await self.get_url_by_short_code(short_code)
+        if not url:
+            return None
+
+        counts = await self.get_click_counts(short_code, url.created_at, start, end, interval, size, settings.VISITOR_SKETCHES_ENABLED)
+        return self._analytics(url, counts, size), es_queries.modified_at(counts, url.created_at)
+
+    async def get_click_counts(
+        self,
+        short_code: str,
+        since: Optional[datetime] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        interval: str = "day",
+        size: int = 10,
+        with_visitors: bool = False
+    ) -> Dict[str, Any]:
+        """Click totals for a short code, see ``URLService.get_click_counts``"""
+        method, request = es_queries.click_counts_request(short_code, since, start, end, interval, size, with_visitors)
+        result = await getattr(self.es, method)(**request)
+        if with_visitors:
+            # Merging a long window's sketches takes milliseconds; keep it off the event loop
+            return await run_in_threadpool(es_queries.click_counts, method, result, True)
+        return es_queries.click_counts(method, result)
+
+    async def get_clicks_page(
+        self,
+        short_code: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Optional[ClickPage]:
+        """One page of a URL's raw clicks, see ``URLService.get_clicks_page``"""
+        url = await self.get_url_by_short_code(short_code)
+        if not url:
+            return None
+
+        if cursor:
+            pit_id, search_after = es_queries.clicks_page_cursor(cursor)
+        else:
+            pit = await self.es.open_point_in_time(
+                index=es_queries.click_indices(es_queries.click_window_start(url.created_at, start), end),
+                keep_alive=es_queries.CLICKS_PIT_KEEP_ALIVE,
+                ignore_unavailable=True
+            )
+            pit_id, search_after = pit["id"], None
+
+        try:
+            result = await self.es.search(**es_queries.clicks_page_query(short_code, pit_id, limit, start, end, search_after))
+        except NotFoundError:
+            raise ValueError("Cursor has expired")
+        page, finished_pit = es_queries.clicks_page(result, pit_id, limit)
+        if finished_pit is not None:
+            await self.es.close_point_in_time(id=finished_pit)
+        return page
+
+    async def export_clicks(
+        self,
+        writer: ClickWriter,
+        short_code: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        batch_size: int = 1000
+    ) -> AsyncIterator[bytes]:
+        """Raw clicks of one code or all, encoded by ``writer`` one batch at a time"""
+        async for hits in ascan_clicks(self.es, short_code, start, end, batch_size):
+            yield writer.write([export_row(hit["_source"]) for hit in hits])
+        yield writer.close()
+
+    def _clicks_flushed(self, short_codes):
+        # Runs on the click worker thread once per written batch, so a burst
+        # of clicks costs one invalidation per code per batch. The clicks are
+        # only searchable after the next refresh; invalidating now would let
+        # a rebuild without them be cached for the whole TTL
+        for short_code in short_codes:
+            self.response_cache.invalidate(analytics_tag(short_code), delay=settings.ELASTICSEARCH_REFRESH_DELAY)
+
+    async def _next_code(self) -> str:
+        if self.code_generator.blocking:
+            # Counter leases talk to Elasticsearch synchronously
+            return await run_in_threadpool(self.code_generator.next_code)
+        return self.code_generator.next_code()
+
+    async def _next_codes(self, count: int) -> List[str]:
+        if self.code_generator.blocking:
+            return await run_in_threadpool(self.code_generator.next_codes, count)
+        return self.code_generator.next_codes(count)
+
+    async def _bulk_create(self, chunk: List[URLCreate]) -> AsyncIterator[Union[URLResponse, BulkURLError]]:
+        created_at = datetime.now(timezone.utc)
+        while chunk:
+            codes = await self._next_codes(len(chunk))
+            response = await self.es.bulk(operations=es_queries.bulk_create_operations(codes, chunk, created_at))
+            results, chunk = es_queries.parse_bulk_create(codes, chunk, response, created_at)
+            for result in results:
+                yield result
+
+    async def _find_duplicate(self, key: str) -> Optional[URLResponse]:
+        """Existing URL for a URL hash, reading url_hashes unless this worker knows its code"""
+        short_code = self.dedup.cached_code(key)
+        if short_code is None:
+            try:
+                result = await self.es.get(index=es_queries.URL_HASHES_INDEX, id=key)
+            except NotFoundError:
+                return None
+            short_code = result["_source"]["short_code"]
+
+        url = await self.get_url_by_short_code(short_code)
+        if url:
+            self.dedup.remember(key, short_code)
+        return url
+
+    async def _claim_url_hash(self, key: str, short_code: str) -> Optional[URLResponse]:
+        """
+        Point a URL hash at a newly created code
+
+        Returns the existing URL instead if another request shortened the
+        same URL first; the code created by this request is then deleted.
+        """
+        try:
+            await self.es.create(index=es_queries.URL_HASHES_INDEX, id=key, document={"short_code": short_code})
+            self.dedup.remember(key, short_code)
+            return None
+        except ConflictError:
+            pass
+
+        result = await self.es.get(index=es_queries.URL_HASHES_INDEX, id=key)
+        existing_code = result["_source"]["short_code"]
+        existing = await self.get_url_by_short_code(existing_code)
+        if existing:
+            await self.es.delete(index=es_queries.URLS_INDEX, id=short_code, refresh=True)
+            self.dedup.remember(key, existing_code)
+            return existing
+
+        # The hash points at a code that no longer exists: take it over
+        await self.es.index(index=es_queries.URL_HASHES_INDEX, id=key, document={"short_code": short_code})
+        self.dedup.remember(key, short_code)
+        return None
+
+_async_url_service: Optional[AsyncURLService] = None
+
+def get_async_url_service() -> AsyncURLService:
+    """The worker's AsyncURLService, created on first use (normally at startup)"""
+    global _async_url_service
+    if _async_url_service is None:
+        _async_url_service = AsyncURLService()
+    return _async_url_service
+
+async def close_async_url_service():
+    """Shut down and forget the worker's AsyncURLService, if it was created"""
+    global _async_url_service
+    if _async_url_service is not None:
+        service, _async_url_service = _async_url_service, None
+        await service.shutdown()
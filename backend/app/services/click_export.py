@@ -0,0 +1,183 @@
+"""
+Streaming export of raw clicks
+
+Clicks are read through a point in time with ``search_after``, one batch
+at a time, and each batch is encoded and handed on before the next one is
+fetched, so memory stays bounded by the batch size however many clicks
+match. Two formats:
+
+- ``ndjson``: one JSON object per click
+- ``parquet``: one row group per batch; needs the optional ``pyarrow``
+  package
+"""
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, List, Optional
+from app.services import es_queries
+
+# Columns of an exported click, in order
+EXPORT_FIELDS = ("short_code", "timestamp", "browser", "device", "os", "country", "ip", "user_agent", "count")
+
+Hits = List[Dict[str, Any]]
+
+def export_row(source: Dict[str, Any]) -> Dict[str, Any]:
+    """A click document as an export row; counter documents keep their count"""
+    return {
+        "short_code": source["short_code"],
+        "timestamp": source["timestamp"],
+        "browser": source.get("browser", "Unknown"),
+        "device": source.get("device", "Unknown"),
+        "os": source.get("os", "Unknown"),
+        "country": source.get("country", "Unknown"),
+        "ip": source.get("ip"),
+        "user_agent": source.get("user_agent"),
+        "count": source.get("count", 1),
+    }
+
+class ClickWriter:
+    """Encodes batches of export rows into chunks of an output file"""
+
+    media_type = "application/octet-stream"
+    extension = ""
+
+    def write(self, rows: List[Dict[str, Any]]) -> bytes:
+        """Encode one batch, returning the bytes ready to be sent"""
+        raise NotImplementedError
+
+    def close(self) -> bytes:
+        """Bytes that end the file"""
+        return b""
+
+class NDJSONWriter(ClickWriter):
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def write(self, rows: List[Dict[str, Any]]) -> bytes:
+        return "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+
+class ParquetWriter(ClickWriter):
+    """One Parquet row group per batch, emitted as soon as it is written"""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def __init__(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet export needs the pyarrow package (pip install pyarrow)")
+        self._pa = pyarrow
+        self.schema = pyarrow.schema([
+            ("short_code", pyarrow.string()),
+            ("timestamp", pyarrow.timestamp("ms", tz="UTC")),
+            ("browser", pyarrow.string()),
+            ("device", pyarrow.string()),
+            ("os", pyarrow.string()),
+            ("country", pyarrow.string()),
+            ("ip", pyarrow.string()),
+            ("user_agent", pyarrow.string()),
+            ("count", pyarrow.int32()),
+        ])
+        self._sink = io.BytesIO()
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, self.schema, compression="zstd")
+
+    def _take(self) -> bytes:
+        chunk = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return chunk
+
+    def write(self, rows: List[Dict[str, Any]]) -> bytes:
+        columns = {field: [row[field] for row in rows] for field in EXPORT_FIELDS}
+        columns["timestamp"] = [_parse_timestamp(value) for value in columns["timestamp"]]
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+        return self._take()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._take()
+
+def _parse_timestamp(value: Any) -> datetime:
+    # Naive timestamps are UTC, like datetime.utcnow() in record_click
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+FORMATS = {"ndjson": NDJSONWriter, "parquet": ParquetWriter}
+
+def create_writer(format: str) -> ClickWriter:
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format: {format}")
+    return FORMATS[format]()
+
+def scan_clicks(
+    es,
+    short_code: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = 1000
+) -> Iterator[Hits]:
+    """Batches of raw click hits in time order, read through a point in time"""
+    pit_id = es.open_point_in_time(
+        index=es_queries.click_indices(start, end),
+        keep_alive=es_queries.EXPORT_PIT_KEEP_ALIVE,
+        ignore_unavailable=True
+    )["id"]
+    search_after = None
+    try:
+        while True:
+            result = es.search(**es_queries.clicks_scan_query(pit_id, batch_size, short_code, start, end, search_after))
+            pit_id = result.get("pit_id", pit_id)
+            hits = result["hits"]["hits"]
+            if hits:
+                yield hits
+            if len(hits) < batch_size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+async def ascan_clicks(
+    es,
+    short_code: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[Hits]:
+    """``scan_clicks`` on an ``AsyncElasticsearch`` client"""
+    pit = await es.open_point_in_time(
+        index=es_queries.click_indices(start, end),
+        keep_alive=es_queries.EXPORT_PIT_KEEP_ALIVE,
+        ignore_unavailable=True
+    )
+    pit_id, search_after = pit["id"], None
+    try:
+        while True:
+            result = await es.search(**es_queries.clicks_scan_query(pit_id, batch_size, short_code, start, end, search_after))
+            pit_id = result.get("pit_id", pit_id)
+            hits = result["hits"]["hits"]
+            if hits:
+                yield hits
+            if len(hits) < batch_size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        await es.close_point_in_time(id=pit_id)
+
+def export_clicks(
+    es,
+    output: BinaryIO,
+    format: str = "ndjson",
+    short_code: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = 1000
+) -> int:
+    """Write matching clicks to ``output``; returns the number of rows"""
+    writer = create_writer(format)
+    rows = 0
+    for hits in scan_clicks(es, short_code, start, end, batch_size):
+        output.write(writer.write([export_row(hit["_source"]) for hit in hits]))
+        rows += len(hits)
+    output.write(writer.close())
+    return rows
@@ -0,0 +1,419 @@
+"""
+Write-ahead journal of clicks on local disk
+
+With a journal the click pipeline no longer buffers clicks in memory:
+``append`` writes each click to the current segment file and returns, and
+the pipeline worker ships journaled clicks to Elasticsearch in order,
+recording how far it got in a checkpoint file. An Elasticsearch outage
+only makes the journal grow; a crash or restart resumes from the last
+checkpoint.
+
+Records are ``[payload length u32][CRC-32 of payload u32][payload]``, the
+payload a float64 timestamp followed by length-prefixed UTF-8 strings.
+Segments rotate at ``segment_bytes`` and are deleted once shipped.
+
+Durability uses group commit: a committer thread fsyncs every
+``commit_interval`` seconds, covering every record written since the
+last one. With ``wait_for_commit`` each ``append`` also waits for the
+fsync covering its record, so an acknowledged click survives a power
+loss; without it a process crash still loses nothing (records are
+written to the OS immediately) and a power loss at most one interval.
+
+Every record gets an ID derived from the journal and its position. The
+shipper creates click documents with those IDs, so replaying records
+that may already have been sent (after a crash between a bulk request
+and its checkpoint, or after a failed request) cannot duplicate them.
+Only clicks a request actually creates are rolled up, so a resent click
+is never counted twice.
+
+A batch is only acknowledged once every click in it is indexed. Clicks
+Elasticsearch refuses for now (429, 5xx) make the whole batch wait and
+go again; clicks it will never accept are appended to ``rejected.ndjson``
+in the journal directory for inspection.
+"""
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.utils import metrics
+from app.utils.metrics import Sample
+
+SEGMENT_MAGIC = b"URLWAL1\0"
+_RECORD = struct.Struct("<II")  # payload length, CRC-32 of payload
+_TIMESTAMP = struct.Struct("<d")
+_LENGTH = struct.Struct("<H")
+_NONE = 0xFFFF
+
+# Click document fields stored in a record, after the timestamp
+FIELDS = ("short_code", "browser", "device", "os", "country", "ip", "user_agent")
+
+# (segment number, byte offset)
+Position = Tuple[int, int]
+
+JOURNAL_COMMIT_SECONDS = metrics.histogram(
+    "click_journal_commit_duration_seconds",
+    "Latency of click journal fsyncs",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+def encode(doc: Dict[str, Any]) -> bytes:
+    """A click document as a journal record"""
+    timestamp = doc["timestamp"]
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        timestamp = timestamp.timestamp()
+    parts = [_TIMESTAMP.pack(timestamp)]
+    for field in FIELDS:
+        value = doc.get(field)
+        if value is None:
+            parts.append(_LENGTH.pack(_NONE))
+            continue
+        data = str(value).encode("utf-8")[:_NONE - 1]
+        parts.append(_LENGTH.pack(len(data)))
+        parts.append(data)
+    payload = b"".join(parts)
+    return _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode(payload: bytes) -> Dict[str, Any]:
+    """The click document of a record payload; timestamps come back naive UTC"""
+    timestamp, = _TIMESTAMP.unpack_from(payload, 0)
+    doc: Dict[str, Any] = {"timestamp": datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)}
+    offset = _TIMESTAMP.size
+    for field in FIELDS:
+        length, = _LENGTH.unpack_from(payload, offset)
+        offset += _LENGTH.size
+        if length == _NONE:
+            doc[field] = None
+            continue
+        doc[field] = payload[offset:offset + length].decode("utf-8", "replace")
+        offset += length
+    return doc
+
+class JournalBatch:
+    """Records read from the checkpoint on, with their IDs and where they end"""
+
+    __slots__ = ("ids", "docs", "start", "end")
+
+    def __init__(self, ids: List[str], docs: List[Dict[str, Any]], start: Position, end: Position):
+        self.ids = ids
+        self.docs = docs
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+class ClickJournal:
+    """
+    Segmented append-only click journal in one directory
+
+    The directory is locked for the lifetime of the journal, so each
+    worker process needs its own; ``claim`` picks the first free one.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 commit_interval: float = 0.01, wait_for_commit: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_interval = commit_interval
+        self.wait_for_commit = wait_for_commit
+        # Raises BlockingIOError if another process holds the directory
+        self._lock_file = open(os.path.join(directory, "lock"), "a+")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise
+        self.journal_id = self._load_id()
+
+        # Metrics
+        self.appended = 0
+        self.shipped = 0
+        self.corrupt = 0
+        self.truncated = 0
+        self.commits = 0
+
+        segments = self._segments()
+        if segments:
+            self._recover(segments[-1])
+        state = self._load_checkpoint()
+        self.checkpoint: Position = tuple(state["checkpoint"]) if state else ((segments[0] if segments else 0), len(SEGMENT_MAGIC))
+        # End of the batch being sent when the process stopped
+        self.inflight: Optional[Position] = tuple(state["inflight"]) if state and state.get("inflight") else None
+        if segments:
+            # Only fsynced records are shipped, so this is a safety net
+            self.checkpoint = min(self.checkpoint, (segments[-1], os.path.getsize(self._path(segments[-1]))))
+
+        self._lock = threading.Lock()
+        self._synced_changed = threading.Condition(threading.Lock())
+        self._retired: List[int] = []
+        if segments:
+            self._segment = segments[-1]
+            self._fd = os.open(self._path(self._segment), os.O_WRONLY | os.O_APPEND)
+            self._offset = os.fstat(self._fd).st_size
+        else:
+            self._open_segment(self.checkpoint[0])
+        self.written: Position = (self._segment, self._offset)
+        self.synced: Position = self.written
+
+        self._closed = threading.Event()
+        self._committer = threading.Thread(target=self._commit_loop, name="click-journal-commit", daemon=True)
+        self._committer.start()
+
+    @classmethod
+    def claim(cls, root: str, **options) -> "ClickJournal":
+        """A journal in the first numbered subdirectory of ``root`` no other process holds"""
+        index = 0
+        while True:
+            try:
+                return cls(os.path.join(root, str(index)), **options)
+            except BlockingIOError:
+                index += 1
+
+    @classmethod
+    def from_settings(cls) -> "ClickJournal":
+        return cls.claim(
+            settings.CLICK_JOURNAL_DIR,
+            segment_bytes=settings.CLICK_JOURNAL_SEGMENT_BYTES,
+            commit_interval=settings.CLICK_JOURNAL_COMMIT_INTERVAL,
+            wait_for_commit=settings.CLICK_JOURNAL_WAIT_FOR_COMMIT
+        )
+
+    # Files
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:012d}.wal")
+
+    def _segments(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".wal"))
+
+    def _load_id(self) -> str:
+        path = os.path.join(self.directory, "journal.id")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read().strip()
+        journal_id = uuid.uuid4().hex[:16]
+        _write_atomic(path, journal_id)
+        return journal_id
+
+    def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.directory, "checkpoint")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        return {"checkpoint": (state["segment"], state["offset"]), "inflight": state.get("inflight")}
+
+    def _save_checkpoint(self):
+        state = {"segment": self.checkpoint[0], "offset": self.checkpoint[1]}
+        if self.inflight is not None:
+            state["inflight"] = list(self.inflight)
+        _write_atomic(os.path.join(self.directory, "checkpoint"), json.dumps(state))
+
+    def _open_segment(self, segment: int):
+        fd = os.open(self._path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(fd, SEGMENT_MAGIC)
+        _fsync_directory(self.directory)
+        self._segment, self._fd, self._offset = segment, fd, len(SEGMENT_MAGIC)
+
+    def _recover(self, segment: int):
+        """Cut a torn or corrupt tail off the newest segment"""
+        path = self._path(segment)
+        with open(path, "rb") as f:
+            valid = len(SEGMENT_MAGIC) if f.read(len(SEGMENT_MAGIC)) == SEGMENT_MAGIC else 0
+            while valid:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                length, crc = _RECORD.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid += _RECORD.size + length
+            size = f.seek(0, os.SEEK_END)
+        if size > valid:
+            print(f"Click journal: truncating {size - valid} bytes of a torn write in {path}")
+            with open(path, "r+b") as f:
+                if not valid:
+                    f.write(SEGMENT_MAGIC)
+                    valid = len(SEGMENT_MAGIC)
+                f.truncate(valid)
+            self.truncated += size - valid
+
+    # Writing
+
+    def append(self, doc: Dict[str, Any]):
+        """Journal a click; with ``wait_for_commit``, return once it is on disk"""
+        record = encode(doc)
+        with self._lock:
+            os.write(self._fd, record)
+            self._offset += len(record)
+            self.written = position = (self._segment, self._offset)
+            self.appended += 1
+            if self._offset >= self.segment_bytes:
+                # The committer fsyncs and closes the old file
+                self._retired.append(self._fd)
+                self._open_segment(self._segment + 1)
+                self.written = (self._segment, self._offset)
+        if self.wait_for_commit:
+            with self._synced_changed:
+                while self.synced < position and not self._closed.is_set():
+                    self._synced_changed.wait(self.commit_interval * 10)
+
+    def commit(self):
+        """fsync everything written so far"""
+        with self._lock:
+            target, fd = self.written, self._fd
+            retired, self._retired = self._retired, []
+        if target <= self.synced and not retired:
+            return
+        with JOURNAL_COMMIT_SECONDS.time():
+            for old in retired:
+                os.fsync(old)
+                os.close(old)
+            os.fdatasync(fd)
+        self.commits += 1
+        with self._synced_changed:
+            self.synced = target
+            self._synced_changed.notify_all()
+
+    def _commit_loop(self):
+        while not self._closed.wait(self.commit_interval):
+            try:
+                self.commit()
+            except OSError as e:
+                print(f"Click journal fsync failed: {e}")
+
+    # Shipping
+
+    def read(self, limit: int) -> JournalBatch:
+        """
+        Up to ``limit`` records from the checkpoint on
+
+        Only records covered by an fsync are read. A record lost to a power
+        failure before its fsync is overwritten by the next click, which
+        gets the same ID; had the lost one been shipped, Elasticsearch would
+        refuse the new one as a duplicate.
+        """
+        synced = self.synced
+        if self.inflight is not None and self.inflight > self.checkpoint:
+            synced = min(synced, self.inflight)
+        segment, offset = self.checkpoint
+        ids: List[str] = []
+        docs: List[Dict[str, Any]] = []
+        while len(docs) < limit and (segment, offset) < synced:
+            path = self._path(segment)
+            if not os.path.exists(path):
+                segment, offset = segment + 1, len(SEGMENT_MAGIC)
+                continue
+            end = synced[1] if segment == synced[0] else os.path.getsize(path)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while len(docs) < limit and offset < end:
+                    header = f.read(_RECORD.size)
+                    length, crc = _RECORD.unpack(header) if len(header) == _RECORD.size else (0, None)
+                    payload = f.read(length)
+                    if crc is None or len(payload) < length or zlib.crc32(payload) != crc:
+                        self.corrupt += 1
+                        print(f"Click journal: corrupt record at {path}:{offset}, skipping the rest of the segment")
+                        offset = end
+                        break
+                    ids.append(f"{self.journal_id}-{segment}-{offset}")
+                    docs.append(decode(payload))
+                    offset += _RECORD.size + length
+            if offset >= end and segment < synced[0]:
+                segment, offset = segment + 1, len(SEGMENT_MAGIC)
+        batch = JournalBatch(ids, docs, self.checkpoint, (segment, offset))
+        if not docs and batch.end > batch.start:
+            # Nothing but corrupt records or empty segments
+            self.acknowledge(batch)
+        return batch
+
+    def begin(self, batch: JournalBatch):
+        """
+        Record where a batch about to be sent ends
+
+        Until it is acknowledged ``read`` returns exactly this batch again,
+        also after a restart, so documents derived from several of its
+        records (coalesced hot-link clicks) come out the same every time.
+        """
+        if self.inflight != batch.end:
+            self.inflight = batch.end
+            self._save_checkpoint()
+
+    def acknowledge(self, batch: JournalBatch):
+        """Move the checkpoint past a shipped batch and drop finished segments"""
+        self.checkpoint = batch.end
+        self.inflight = None
+        self._save_checkpoint()
+        self.shipped += len(batch)
+        for segment in self._segments():
+            if segment >= batch.end[0]:
+                break
+            os.remove(self._path(segment))
+
+    def reject(self, docs: List[Dict[str, Any]]):
+        """Set aside clicks Elasticsearch refused for good, so the batch can be acknowledged"""
+        with open(os.path.join(self.directory, "rejected.ndjson"), "a", encoding="utf-8") as f:
+            for doc in docs:
+                f.write(json.dumps(doc, default=str))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def lag_bytes(self) -> int:
+        """Journaled bytes not yet shipped"""
+        segment, offset = self.checkpoint
+        lag = -offset
+        for number in self._segments():
+            if number >= segment:
+                try:
+                    lag += os.path.getsize(self._path(number))
+                except OSError:
+                    pass
+        return max(lag, 0)
+
+    def collect_metrics(self) -> List[Sample]:
+        return [
+            ("click_journal_lag_bytes", "gauge", "Journaled click bytes not yet shipped", {}, self.lag_bytes()),
+            ("click_journal_records_total", "counter", "Journal records by outcome", {"outcome": "appended"}, self.appended),
+            ("click_journal_records_total", "counter", "Journal records by outcome", {"outcome": "shipped"}, self.shipped),
+            ("click_journal_records_total", "counter", "Journal records by outcome", {"outcome": "corrupt"}, self.corrupt),
+        ]
+
+    def close(self):
+        """Stop the committer after a final fsync and release the directory"""
+        self._closed.set()
+        self._committer.join()
+        self.commit()
+        with self._lock:
+            os.close(self._fd)
+        with self._synced_changed:
+            self._synced_changed.notify_all()
+        self._lock_file.close()
+
+def _write_atomic(path: str, content: str):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(content)
+        # Without this a power loss can leave the renamed file empty
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    _fsync_directory(os.path.dirname(path))
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
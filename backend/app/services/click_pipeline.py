@@ -0,0 +1,481 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+from app.core.config import settings
+from app.core.elasticsearch import bulk_items, retryable
+from app.services import es_queries
+from app.services import rollups as click_rollups
+from app.services.click_journal import ClickJournal, JournalBatch
+from app.services.hot_links import HotLinkAggregator
+from app.services.visitor_sketches import VisitorSketches
+from app.utils import metrics
+from app.utils.metrics import Sample
+
+logger = logging.getLogger(__name__)
+
+CLICK_FLUSH_SECONDS = metrics.histogram("click_flush_duration_seconds", "Latency of click bulk requests")
+
+# Written clicks kept for another rollup attempt at most
+MAX_UNROLLED = 100000
+
+BACKPRESSURE_DROP = "drop"
+BACKPRESSURE_BLOCK = "block"
+BACKPRESSURE_SPILL = "spill"
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class ClickPipeline:
+    """
+    Bounded in-memory queue of click documents drained by a background worker
+
+    Clicks are sent to their time partition with the bulk helper whenever
+    ``batch_size`` documents are buffered or ``flush_interval`` seconds have
+    passed, whichever comes first. When the queue is full (ES is slow or
+    down) the ``backpressure`` policy decides what happens to new clicks:
+
+    - ``drop``:  discard the click and count it
+    - ``block``: wait up to ``block_timeout`` seconds for room, then drop
+    - ``spill``: append the click to an NDJSON file on disk; spilled clicks
+      are replayed once bulk requests succeed again (a crash mid-replay
+      sends the interrupted file again, so some of its clicks may be
+      indexed twice rather than lost)
+
+    With ``rollups`` enabled every written batch is followed by one
+    scripted upsert per distinct rollup key among the clicks it created,
+    after which those clicks are flagged ``rolled_up``; updates whose
+    outcome is unknown are retried on the next round (see
+    ``app.services.rollups``).
+
+    With a ``hot_links`` aggregator every click is counted towards the top
+    codes, and if it is coalescing, clicks on currently hot codes skip the
+    queue and are flushed as per-minute pre-summed documents instead (see
+    ``app.services.hot_links``); with a journal they are summed per shipped
+    batch instead.
+
+    With a ``journal`` the in-memory queue and backpressure policy are not
+    used: clicks are appended to the journal and the worker ships them from
+    there, retrying until Elasticsearch accepts them (see
+    ``app.services.click_journal``).
+
+    With ``sketches`` every accepted click's IP is also counted in the
+    unique visitor sketch of its link and day, which the worker merges into
+    Elasticsearch periodically (see ``app.services.visitor_sketches``).
+
+    ``on_flush``, if set, is called from the worker thread with the short
+    codes of every successfully written batch.
+    """
+
+    def __init__(
+        self,
+        es,
+        max_queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        backpressure: str = BACKPRESSURE_DROP,
+        block_timeout: float = 0.5,
+        spill_path: str = "clicks-spill.ndjson",
+        rollups: bool = False,
+        hot_links: Optional[HotLinkAggregator] = None,
+        journal: Optional[ClickJournal] = None,
+        sketches: Optional[VisitorSketches] = None
+    ):
+        if backpressure not in (BACKPRESSURE_DROP, BACKPRESSURE_BLOCK, BACKPRESSURE_SPILL):
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        self.es = es
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.rollups = rollups
+        self.hot_links = hot_links
+        self.journal = journal
+        self.sketches = sketches
+        self.on_flush: Optional[Callable[[Set[str]], None]] = None
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        # Written clicks whose rollup update or flagging is to be retried
+        self._unrolled: List[Dict[str, Any]] = []
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+        # Metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.flushed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @classmethod
+    def from_settings(cls, es) -> "ClickPipeline":
+        """Build a pipeline configured from the CLICK_* settings"""
+        return cls(
+            es,
+            max_queue_size=settings.CLICK_QUEUE_SIZE,
+            batch_size=settings.CLICK_BATCH_SIZE,
+            flush_interval=settings.CLICK_FLUSH_INTERVAL,
+            backpressure=settings.CLICK_BACKPRESSURE,
+            block_timeout=settings.CLICK_BLOCK_TIMEOUT,
+            spill_path=settings.CLICK_SPILL_PATH,
+            rollups=settings.CLICK_ROLLUPS_ENABLED,
+            # Always tracked for /api/hot; HOT_LINKS_ENABLED only turns coalescing on
+            hot_links=HotLinkAggregator.from_settings(),
+            journal=ClickJournal.from_settings() if settings.CLICK_JOURNAL_DIR else None,
+            sketches=VisitorSketches.from_settings(es) if settings.VISITOR_SKETCHES_ENABLED else None
+        )
+
+    @property
+    def blocking(self) -> bool:
+        """Whether ``submit`` may block the caller"""
+        if self.journal is not None:
+            return self.journal.wait_for_commit
+        return self.backpressure == BACKPRESSURE_BLOCK
+
+    def start(self):
+        """Start the background flush worker"""
+        if self._worker and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, name="click-pipeline", daemon=True)
+        self._worker.start()
+        metrics.REGISTRY.register_collector(self.collect_metrics)
+        if self.journal is not None:
+            metrics.REGISTRY.register_collector(self.journal.collect_metrics)
+        if self.sketches is not None:
+            metrics.REGISTRY.register_collector(self.sketches.collect_metrics)
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker after flushing whatever is still queued"""
+        self._stop.set()
+        if self._worker:
+            self._worker.join(timeout)
+            self._worker = None
+        metrics.REGISTRY.unregister_collector(self.collect_metrics)
+        if self.journal is not None:
+            metrics.REGISTRY.unregister_collector(self.journal.collect_metrics)
+        if self.sketches is not None:
+            metrics.REGISTRY.unregister_collector(self.sketches.collect_metrics)
+
+    def submit(self, doc: Dict[str, Any]) -> bool:
+        """
+        Queue a click document for indexing
+
+        Returns:
+            True if the click was queued, coalesced or spilled, False if it
+            was dropped
+        """
+        accepted = self._enqueue(doc)
+        if accepted and self.sketches is not None:
+            self.sketches.add(doc)
+        return accepted
+
+    def _enqueue(self, doc: Dict[str, Any]) -> bool:
+        if self.journal is not None:
+            try:
+                # Journaled clicks on hot links are coalesced when shipped
+                self.journal.append(doc)
+                self.enqueued += 1
+                return True
+            except OSError as e:
+                # Disk full or similar: fall back to the in-memory queue
+                logger.warning("Click journal append failed: %s", e)
+        if self.hot_links is not None and self.hot_links.absorb(doc):
+            return True
+        try:
+            if self.backpressure == BACKPRESSURE_BLOCK:
+                self._queue.put(doc, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(doc)
+            self.enqueued += 1
+            return True
+        except queue.Full:
+            if self.backpressure == BACKPRESSURE_SPILL:
+                self._spill([doc])
+                return True
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Synchronously flush everything currently queued, including hot-link counters and visitor sketches"""
+        if self.hot_links is not None:
+            self._flush_counters(self.hot_links.drain(everything=True))
+        if self.sketches is not None:
+            self.sketches.flush()
+        if self.journal is not None:
+            # Only fsynced clicks are shipped
+            self.journal.commit()
+            batch = self.journal.read(self.batch_size)
+            while batch and self._ship(batch):
+                batch = self.journal.read(self.batch_size)
+        batch = self._drain(self.batch_size)
+        while batch:
+            self._flush(batch)
+            batch = self._drain(self.batch_size)
+        self._retry_rollups()
+
+    def metrics(self) -> dict:
+        """Return queue depth and flush statistics"""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "journal_lag_bytes": self.journal.lag_bytes() if self.journal is not None else 0,
+            "queue_capacity": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "coalesced": self.hot_links.absorbed if self.hot_links is not None else 0,
+            "pending_coalesced": self.hot_links.pending() if self.hot_links is not None else 0,
+            "pending_rollups": len(self._unrolled),
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "flush_count": self.flush_count,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": self.total_flush_latency / self.flush_count if self.flush_count else 0.0,
+        }
+
+    def collect_metrics(self) -> List[Sample]:
+        """Queue depth and click counters for the metrics endpoint"""
+        current = self.metrics()
+        samples = [
+            ("click_queue_depth", "gauge", "Clicks waiting to be indexed", {}, current["queue_depth"]),
+            ("click_queue_capacity", "gauge", "Maximum clicks the queue holds", {}, current["queue_capacity"]),
+            ("click_pending_coalesced", "gauge", "Hot-link clicks counted but not yet flushed", {}, current["pending_coalesced"]),
+            ("click_pending_rollups", "gauge", "Written clicks whose rollup update is being retried", {}, current["pending_rollups"]),
+        ]
+        for outcome in ("enqueued", "coalesced", "dropped", "spilled", "flushed", "failed", "rejected"):
+            samples.append(("clicks_total", "counter", "Clicks by pipeline outcome", {"outcome": outcome}, current[outcome]))
+        return samples
+
+    def _run(self):
+        if self.journal is not None:
+            self._run_journal()
+            return
+        while not self._stop.is_set():
+            batch = self._collect()
+            if self.hot_links is not None:
+                self._flush_counters(self.hot_links.drain())
+            if self.sketches is not None and self.sketches.due():
+                self.sketches.flush()
+            if batch:
+                self._flush(batch)
+            elif self.backpressure == BACKPRESSURE_SPILL:
+                self._replay_spill()
+            self._retry_rollups()
+        # Final drain on shutdown
+        self.flush()
+
+    def _run_journal(self):
+        """Ship journaled clicks, backing off while Elasticsearch refuses them"""
+        backoff = self.flush_interval
+        while not self._stop.is_set():
+            if self.hot_links is not None:
+                self._flush_counters(self.hot_links.drain())
+            if self.sketches is not None and self.sketches.due():
+                self.sketches.flush()
+            # Clicks queued in memory after a failed journal append
+            batch = self._drain(self.batch_size)
+            if batch:
+                self._flush(batch)
+            self._retry_rollups()
+            journaled = self.journal.read(self.batch_size)
+            if not journaled:
+                self._stop.wait(self.flush_interval)
+            elif self._ship(journaled):
+                backoff = self.flush_interval
+            else:
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+        # Final drain on shutdown, then a last fsync
+        self.flush()
+        self.journal.close()
+
+    def _ship(self, batch: JournalBatch) -> bool:
+        """Send a journal batch and move the checkpoint past it if that worked"""
+        docs, ids = batch.docs, batch.ids
+        if self.hot_links is not None:
+            docs, ids = self.hot_links.coalesce(docs, ids)
+        # A retry, even after a restart, must re-read exactly this batch
+        self.journal.begin(batch)
+        if not self._flush(docs, ids):
+            return False
+        self.journal.acknowledge(batch)
+        return True
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        """Block until a batch is full or the flush interval expires"""
+        deadline = time.monotonic() + self.flush_interval
+        batch: List[Dict[str, Any]] = []
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_counters(self, docs: List[Dict[str, Any]]):
+        for start in range(0, len(docs), self.batch_size):
+            self._flush(docs[start:start + self.batch_size])
+
+    def _actions(self, batch: List[Dict[str, Any]], ids: Optional[List[str]], rollup_batch: Optional[str]):
+        """
+        Bulk actions for a batch; with ``ids`` clicks are created under those
+        IDs, so sending a batch again cannot duplicate them
+        """
+        for i, doc in enumerate(batch):
+            if rollup_batch is not None:
+                doc = {**doc, "rollup_batch": rollup_batch}
+            action = {"_index": es_queries.click_partition(doc["timestamp"]), "_source": doc}
+            if ids is not None:
+                action["_op_type"] = "create"
+                action["_id"] = ids[i]
+            yield action
+
+    def _flush(self, batch: List[Dict[str, Any]], ids: Optional[List[str]] = None, replay: bool = False) -> bool:
+        """
+        Send a batch in one bulk request
+
+        Returns False if the request failed, or, for journaled clicks
+        (``ids``), if some of them were refused for now (429 or 5xx) and
+        the batch has to be sent again. Clicks Elasticsearch will never
+        accept (mapping errors and the like) are set aside in the journal's
+        ``rejected.ndjson`` instead of blocking it. Only clicks created by
+        this request are rolled up: one that already existed was rolled up
+        when it was created, or is still in the un-rolled tail. Spilled
+        clicks being replayed (``replay``) that spill again are not counted
+        as spilled twice.
+        """
+        actions = list(self._actions(batch, ids, click_rollups.new_batch() if self.rollups else None))
+        start = time.perf_counter()
+        try:
+            results = bulk_items(self.es, actions)
+        except Exception as e:
+            logger.warning("Click bulk flush failed: %s", e)
+            if ids is not None:
+                # Still in the journal; the caller retries
+                return False
+            if self.backpressure == BACKPRESSURE_SPILL:
+                self._spill(batch, count=not replay)
+            else:
+                self.failed += len(batch)
+            return False
+        finally:
+            latency = time.perf_counter() - start
+            CLICK_FLUSH_SECONDS.observe(latency)
+            self.flush_count += 1
+            self.last_flush_latency = latency
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+
+        created: List[Dict[str, Any]] = []
+        retry: List[Dict[str, Any]] = []
+        rejected: List[Dict[str, Any]] = []
+        for action, (ok, item) in zip(actions, results):
+            if ok:
+                created.append({"_index": item["_index"], "_id": item["_id"], "_source": action["_source"]})
+            elif item.get("status") == 409 and ids is not None:
+                # Created by an earlier attempt
+                continue
+            elif retryable(item.get("status")):
+                retry.append(action["_source"])
+            else:
+                logger.error("Click rejected by Elasticsearch: %s", item.get("error"))
+                rejected.append(dict(action["_source"], error=item.get("error")))
+        self.flushed += len(created)
+        if created and self.rollups:
+            self._unrolled.extend(click_rollups.roll_up(self.es, created))
+        if ids is not None:
+            if retry:
+                return False
+            if rejected:
+                self.journal.reject(rejected)
+            self.rejected += len(rejected)
+        elif retry and self.backpressure == BACKPRESSURE_SPILL:
+            self._spill(retry, count=not replay)
+            self.failed += len(rejected)
+        else:
+            self.failed += len(retry) + len(rejected)
+        if self.on_flush is not None:
+            self.on_flush({doc["short_code"] for doc in batch})
+        return True
+
+    def _retry_rollups(self):
+        if not self._unrolled:
+            return
+        clicks, self._unrolled = self._unrolled, []
+        left = click_rollups.roll_up(self.es, clicks)
+        if len(left) > MAX_UNROLLED:
+            # They stay in the un-rolled tail for compact-rollups
+            logger.error("Giving up on the rollup update of %d clicks", len(left) - MAX_UNROLLED)
+            left = left[-MAX_UNROLLED:]
+        self._unrolled.extend(left)
+
+    def _spill(self, docs: List[Dict[str, Any]], count: bool = True):
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for doc in docs:
+                    f.write(json.dumps(doc, default=_json_default))
+                    f.write("\n")
+        if count:
+            self.spilled += len(docs)
+
+    def _replay_spill(self):
+        """
+        Re-send spilled clicks once the queue is idle
+
+        The spill file is moved aside first so new spills go to a fresh
+        one. A replay file left by a crash is sent before anything else
+        and never overwritten.
+        """
+        replay_path = f"{self.spill_path}.replay"
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.spill_path):
+                return
+            with self._spill_lock:
+                os.replace(self.spill_path, replay_path)
+
+        batch: List[Dict[str, Any]] = []
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    # Torn by a crash while spilling
+                    logger.warning("Skipping unreadable spilled click: %.100s", line)
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, replay=True)
+                    batch = []
+        if batch:
+            self._flush(batch, replay=True)
+        os.remove(replay_path)
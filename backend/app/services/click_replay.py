@@ -0,0 +1,202 @@
+"""
+Re-derive click dimensions from the raw events after a parser change
+
+Every raw click in the selection is classified again, with browser,
+device and os coming from its stored ``user_agent`` and country from its
+``ip``. Clicks whose dimensions changed are updated in place, chunks of
+them in parallel. Rolled-up clicks also move their counts from the old
+rollup keys to the new ones, so analytics served from the rollups change
+with them.
+
+Moving rollup counts is made safe to retry: the update of a rolled-up
+click also records its old rollup dimensions and a batch token in
+``replay_pending``. The rollups are adjusted only for clicks whose update
+succeeded, with that token (see ``app.services.rollups``), and the
+marker is removed once every adjustment involving the click went
+through. A later run finishes clicks that still carry a marker, with the
+same token, before looking at them again, so an adjustment is never
+applied twice.
+
+What cannot be re-derived is left alone: clicks written before the raw
+user agent was stored keep their browser, device and os, and countries
+are only recomputed when a GeoIP database is configured (otherwise every
+click would become "Unknown"). Hot-link counter documents carry neither
+field and are skipped.
+"""
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.core.elasticsearch import bulk_items
+from app.services import rollups
+from app.services.click_export import scan_clicks
+from app.utils.geoip import get_database, lookup_country
+from app.utils.user_agent_parser import classify_user_agent
+
+# Click fields that are part of a rollup key
+ROLLUP_FIELDS = ("browser", "device", "country")
+
+# (click hit, dimensions to change)
+Change = Tuple[Dict[str, Any], Dict[str, str]]
+
+def rederive(source: Dict[str, Any], countries: bool = True) -> Dict[str, str]:
+    """The dimensions of a click document that differ once re-derived"""
+    changes = {}
+    user_agent = source.get("user_agent")
+    if user_agent is not None:
+        info = classify_user_agent(user_agent)
+        for field, value in (("browser", info.browser), ("device", info.device), ("os", info.os)):
+            if source.get(field, "Unknown") != value:
+                changes[field] = value
+    ip = source.get("ip")
+    if countries and ip:
+        country = lookup_country(ip)
+        if source.get("country", "Unknown") != country:
+            changes["country"] = country
+    return changes
+
+class ClickReplay:
+    """One replay run over the clicks of a code and/or time range"""
+
+    def __init__(
+        self,
+        es,
+        short_code: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        batch_size: int = 1000
+    ):
+        self.es = es
+        self.short_code = short_code
+        self.start = start
+        self.end = end
+        self.batch_size = batch_size
+        self.countries = get_database() is not None
+
+        # Progress
+        self.scanned = 0
+        self.changed = 0
+        self.changed_fields: Counter = Counter()
+        self.resumed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _changes(self) -> Iterator[List[Change]]:
+        """
+        Per batch, the clicks that need updating: those whose dimensions
+        changed and those an earlier run left a ``replay_pending`` marker on
+        """
+        for hits in scan_clicks(self.es, self.short_code, self.start, self.end, self.batch_size):
+            self.scanned += len(hits)
+            batch = []
+            for hit in hits:
+                if hit["_source"].get("replay_pending"):
+                    # Further changes wait until its rollup move is finished
+                    batch.append((hit, {}))
+                    continue
+                changes = rederive(hit["_source"], self.countries)
+                if changes:
+                    batch.append((hit, changes))
+                    self.changed += 1
+                    self.changed_fields.update(changes.keys())
+            yield batch
+
+    def _apply(self, chunk: List[Change]):
+        """Update a chunk of clicks, then move the rollup counts of the rolled-up ones"""
+        batch = rollups.new_batch()
+        updates: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        # (hit, replay_pending marker, click after the update)
+        moves: List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]] = []
+        for hit, changes in chunk:
+            source = hit["_source"]
+            if source.get("replay_pending"):
+                moves.append((hit, source["replay_pending"], source))
+                continue
+            doc: Dict[str, Any] = dict(changes)
+            if source.get("rolled_up") and any(field in changes for field in ROLLUP_FIELDS):
+                doc["replay_pending"] = {"from": {field: source.get(field, "Unknown") for field in ROLLUP_FIELDS}, "batch": batch}
+            updates.append((hit, doc))
+
+        failed = 0
+        try:
+            results = bulk_items(self.es, [
+                {"_op_type": "update", "_index": hit["_index"], "_id": hit["_id"], "doc": doc} for hit, doc in updates
+            ])
+        except Exception as e:
+            print(f"Replay update failed: {e}")
+            results = [(False, {"error": str(e)})] * len(updates)
+        for (hit, doc), (ok, item) in zip(updates, results):
+            if not ok:
+                failed += 1
+                print(f"Replay update failed: {item.get('error')}")
+            elif "replay_pending" in doc:
+                moves.append((hit, doc["replay_pending"], {**hit["_source"], **doc}))
+        failed += self._move(moves)
+        with self._lock:
+            self.failed += failed
+
+    def _move(self, moves: List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]]) -> int:
+        """Adjust the rollups for updated clicks and clear their markers; returns how many are left pending"""
+        if not moves:
+            return 0
+        by_batch: Dict[str, List[Tuple[Dict[str, Any], Dict[str, Any]]]] = defaultdict(list)
+        for hit, marker, after in moves:
+            by_batch[marker["batch"]].append(({**after, **marker["from"]}, after))
+        actions: List[Dict[str, Any]] = []
+        for batch, pairs in by_batch.items():
+            actions.extend(rollups.adjustment_actions([before for before, _ in pairs], [after for _, after in pairs], batch))
+        try:
+            results = bulk_items(self.es, actions)
+        except Exception as e:
+            print(f"Replay rollup adjustment failed: {e}")
+            results = [(False, {"status": None})] * len(actions)
+        unfinished = set()
+        for action, (ok, item) in zip(actions, results):
+            # A rollup that is gone has nothing left to move
+            if not ok and item.get("status") != 404:
+                print(f"Replay rollup adjustment failed: {item.get('error')}")
+                unfinished.add((action["script"]["params"]["batch"], action["_id"]))
+
+        done = []
+        for hit, marker, after in moves:
+            before = {**after, **marker["from"]}
+            keys = {rollups.rollup_id(rollups.rollup_key(before)), rollups.rollup_id(rollups.rollup_key(after))}
+            if not any((marker["batch"], key) in unfinished for key in keys):
+                done.append(hit)
+        try:
+            results = bulk_items(self.es, [
+                {"_op_type": "update", "_index": hit["_index"], "_id": hit["_id"], "doc": {"replay_pending": None}} for hit in done
+            ])
+        except Exception as e:
+            print(f"Clearing replay markers failed: {e}")
+            results = [(False, {})] * len(done)
+        cleared = sum(1 for ok, _ in results if ok)
+        with self._lock:
+            self.resumed += sum(1 for hit, _, _ in moves if hit["_source"].get("replay_pending"))
+        return len(moves) - cleared
+
+    def _chunks(self, chunk_size: int) -> Iterator[List[Change]]:
+        for batch in self._changes():
+            for start in range(0, len(batch), chunk_size):
+                yield batch[start:start + chunk_size]
+
+    def run(self, thread_count: int = 4, chunk_size: int = 500) -> "ClickReplay":
+        """Apply every change, ``thread_count`` chunks of ``chunk_size`` clicks at a time"""
+        with ThreadPoolExecutor(thread_count) as pool:
+            running = set()
+            for chunk in self._chunks(chunk_size):
+                if len(running) >= thread_count * 2:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                running.add(pool.submit(self._apply, chunk))
+            for future in running:
+                future.result()
+        return self
+
+    def dry_run(self) -> "ClickReplay":
+        """Count what would change without writing anything"""
+        for _ in self._changes():
+            pass
+        return self
@@ -0,0 +1,172 @@
+"""
+Short code generation strategies
+
+``NanoidCodeGenerator`` draws random codes (the original behaviour).
+``BlockCounterCodeGenerator`` leases ranges of sequential IDs from a
+persistent counter in Elasticsearch and base62-encodes them, so codes never
+collide with each other and no existence lookup is needed. IDs can be passed
+through a keyed bijective permutation first so consecutive codes are not
+guessable.
+"""
+import hashlib
+import threading
+from typing import List
+from nanoid import generate
+from app.core.config import settings
+from app.services import es_queries
+
+class CodeGenerator:
+    """Base class for short code strategies"""
+
+    # Whether next_code may block on I/O (async callers run it in a thread)
+    blocking = False
+
+    def next_code(self) -> str:
+        raise NotImplementedError
+
+    def next_codes(self, count: int) -> List[str]:
+        return [self.next_code() for _ in range(count)]
+
+class NanoidCodeGenerator(CodeGenerator):
+    """Random codes of a fixed length"""
+
+    def __init__(self, alphabet: str, length: int):
+        self.alphabet = alphabet
+        self.length = length
+
+    def next_code(self) -> str:
+        return generate(alphabet=self.alphabet, size=self.length)
+
+def encode(number: int, alphabet: str, width: int) -> str:
+    """Encode a non-negative integer in base len(alphabet), left-padded to width"""
+    base = len(alphabet)
+    chars = []
+    while number:
+        number, digit = divmod(number, base)
+        chars.append(alphabet[digit])
+    return "".join(reversed(chars)).rjust(width, alphabet[0])
+
+class FeistelPermutation:
+    """
+    Keyed bijection on [0, domain)
+
+    A balanced Feistel network over the smallest even number of bits that
+    covers the domain, with cycle walking to stay inside it.
+    """
+
+    def __init__(self, key: bytes, domain: int, rounds: int = 4):
+        self.key = key
+        self.domain = domain
+        self.rounds = rounds
+        bits = max(domain - 1, 1).bit_length()
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+
+    def _round(self, value: int, i: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(8, "big") + bytes([i]),
+            key=self.key,
+            digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def _permute(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for i in range(self.rounds):
+            left, right = right, left ^ self._round(right, i)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value: int) -> int:
+        value = self._permute(value)
+        while value >= self.domain:
+            value = self._permute(value)
+        return value
+
+class BlockCounterCodeGenerator(CodeGenerator):
+    """
+    Sequential codes from blocks leased off a shared counter
+
+    Each lease atomically adds ``block_size`` to the counter document, so
+    every worker owns a disjoint ID range and only talks to Elasticsearch
+    once per block. IDs below alphabet**length become codes of ``length``
+    characters; the code grows by one character each time that space is
+    exhausted.
+    """
+
+    blocking = True
+
+    def __init__(self, es, alphabet: str, length: int, block_size: int = 1000, scramble_key: str = ""):
+        self.es = es
+        self.alphabet = alphabet
+        self.length = length
+        self.block_size = block_size
+        self.scramble_key = scramble_key.encode("utf-8")
+        self._permutations = {}
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _lease(self, count: int) -> int:
+        """Reserve ``count`` IDs and return the first one"""
+        result = self.es.update(
+            index=es_queries.COUNTERS_INDEX,
+            id=es_queries.SHORT_CODE_COUNTER,
+            script={
+                "source": "ctx._source.value += params.count",
+                "lang": "painless",
+                "params": {"count": count}
+            },
+            upsert={"value": count},
+            retry_on_conflict=10,
+            source=True
+        )
+        end = result["get"]["_source"]["value"]
+        return end - count
+
+    def _encode(self, number: int) -> str:
+        base = len(self.alphabet)
+        width = self.length
+        while number >= base ** width:
+            width += 1
+        if self.scramble_key:
+            permutation = self._permutations.get(width)
+            if permutation is None:
+                permutation = self._permutations[width] = FeistelPermutation(self.scramble_key, base ** width)
+            number = permutation(number)
+        return encode(number, self.alphabet, width)
+
+    def next_code(self) -> str:
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self._lease(self.block_size)
+                self._end = self._next + self.block_size
+            number = self._next
+            self._next += 1
+        return self._encode(number)
+
+    def next_codes(self, count: int) -> List[str]:
+        with self._lock:
+            numbers = list(range(self._next, self._end))[:count]
+            self._next += len(numbers)
+            missing = count - len(numbers)
+            if missing:
+                # Lease whatever is left plus a fresh block for later calls
+                start = self._lease(missing + self.block_size)
+                numbers.extend(range(start, start + missing))
+                self._next = start + missing
+                self._end = start + missing + self.block_size
+        return [self._encode(number) for number in numbers]
+
+def create_code_generator(es) -> CodeGenerator:
+    """Build the code generator selected by SHORT_CODE_STRATEGY"""
+    if settings.SHORT_CODE_STRATEGY == "counter":
+        return BlockCounterCodeGenerator(
+            es,
+            alphabet=settings.SHORT_URL_ALPHABET,
+            length=settings.SHORT_URL_LENGTH,
+            block_size=settings.SHORT_CODE_BLOCK_SIZE,
+            scramble_key=settings.SHORT_CODE_SCRAMBLE_KEY
+        )
+    if settings.SHORT_CODE_STRATEGY == "nanoid":
+        return NanoidCodeGenerator(settings.SHORT_URL_ALPHABET, settings.SHORT_URL_LENGTH)
+    raise ValueError(f"Unknown SHORT_CODE_STRATEGY: {settings.SHORT_CODE_STRATEGY}")
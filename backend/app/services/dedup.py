@@ -0,0 +1,35 @@
+"""
+Reuse of existing short codes for already-shortened URLs
+
+Every shortened URL gets a document in ``url_hashes`` whose ID is the
+SHA-256 of ``original_url`` and which points at its short code. Claiming
+that ID with ``op_type=create`` is what makes deduplication safe across
+workers. The in-process LRU only saves the read of ``url_hashes`` for
+URLs this worker has seen; on a miss the index is always read, since
+another worker may have shortened the URL.
+"""
+import hashlib
+from typing import Optional
+from app.core.config import settings
+from app.utils.cache import LRUCache
+
+def url_hash(original_url: str) -> str:
+    """Document ID of a URL in the url_hashes index"""
+    return hashlib.sha256(original_url.encode("utf-8")).hexdigest()
+
+class URLDeduplicator:
+    """Per-process hash -> short code lookups in front of the url_hashes index"""
+
+    def __init__(self, cache_size: int = 100000):
+        self.codes = LRUCache(maxsize=cache_size, ttl=float("inf"))
+
+    @classmethod
+    def from_settings(cls) -> "URLDeduplicator":
+        return cls(cache_size=settings.DEDUP_CACHE_SIZE)
+
+    def cached_code(self, key: str) -> Optional[str]:
+        """Short code for a URL hash if this process has seen it recently"""
+        return self.codes.get(key)
+
+    def remember(self, key: str, short_code: str):
+        self.codes.put(key, short_code)
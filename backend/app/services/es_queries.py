@@ -0,0 +1,767 @@
+"""
+Elasticsearch index definitions, request bodies and response parsers
+
+Shared by the synchronous ``URLService`` and the ``AsyncURLService`` so both
+clients issue exactly the same queries and build the same models.
+"""
+import base64
+import json
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import ApiError
+from elasticsearch.exceptions import HTTP_EXCEPTIONS
+from app.core.config import settings
+from app.models.url import URLCreate, URLResponse, BulkURLError, Click, ClickPage, ClickData, BrowserData, DeviceData, CountryData
+from app.utils.hyperloglog import HyperLogLog
+
+URLS_INDEX = "urls"
+ROLLUPS_INDEX = "click_rollups"
+COUNTERS_INDEX = "counters"
+URL_HASHES_INDEX = "url_hashes"
+VISITOR_SKETCHES_INDEX = "visitor_sketches"
+SHORT_CODE_COUNTER = "short_code"
+
+# Clicks are written to time partitions (clicks-2024.05 or clicks-2024.05.17)
+# created from the clicks index template. CLICKS_ALIAS spans every partition
+# plus the pre-partitioning "clicks" index, if it exists.
+CLICKS_PARTITION_PREFIX = "clicks-"
+CLICKS_ALIAS = "clicks_all"
+LEGACY_CLICKS_INDEX = "clicks"
+CLICKS_TEMPLATE = "clicks"
+CLICKS_ILM_POLICY = "clicks-retention"
+
+# Breakdowns reported by URLAnalytics
+DIMENSIONS = ("browser", "device", "country")
+
+URLS_MAPPINGS = {
+    "properties": {
+        "original_url": {"type": "keyword"},
+        "short_code": {"type": "keyword"},
+        "created_at": {"type": "date"}
+    }
+}
+
+CLICKS_MAPPINGS = {
+    "properties": {
+        "short_code": {"type": "keyword"},
+        "timestamp": {"type": "date"},
+        "browser": {"type": "keyword"},
+        "device": {"type": "keyword"},
+        "os": {"type": "keyword"},
+        "country": {"type": "keyword"},
+        "ip": {"type": "ip"},
+        # Raw User-Agent header, kept so clicks can be re-classified after
+        # parser changes (python -m app.cli replay-clicks); not searchable
+        "user_agent": {"type": "keyword", "index": False, "doc_values": False},
+        # Clicks a document stands for; only set on hot-link counter
+        # documents, analytics treat a missing count as 1
+        "count": {"type": "integer"},
+        # Set once the click has been counted in click_rollups
+        "rolled_up": {"type": "boolean"},
+        # Token of the rollup update counting this click (see app.services.rollups)
+        "rollup_batch": {"type": "keyword", "index": False, "doc_values": False},
+        # Rollup move of a replay in progress (see app.services.click_replay)
+        "replay_pending": {"type": "object", "enabled": False}
+    }
+}
+
+# One document per (short_code, day, browser, device, country)
+ROLLUPS_MAPPINGS = {
+    "properties": {
+        "short_code": {"type": "keyword"},
+        "day": {"type": "date", "format": "yyyy-MM-dd"},
+        "browser": {"type": "keyword"},
+        "device": {"type": "keyword"},
+        "country": {"type": "keyword"},
+        "count": {"type": "long"},
+        # rollup_batch tokens of the latest updates, so retries are not counted twice
+        "batches": {"type": "keyword", "index": False, "doc_values": False}
+    }
+}
+
+COUNTERS_MAPPINGS = {
+    "properties": {
+        "value": {"type": "long"}
+    }
+}
+
+# Document ID is the SHA-256 of original_url
+URL_HASHES_MAPPINGS = {
+    "properties": {
+        "short_code": {"type": "keyword"}
+    }
+}
+
+# One HyperLogLog sketch of visitor IPs per (short_code, day), see
+# app.services.visitor_sketches
+VISITOR_SKETCHES_MAPPINGS = {
+    "properties": {
+        "short_code": {"type": "keyword"},
+        "day": {"type": "date", "format": "yyyy-MM-dd"},
+        "sketch": {"type": "binary"}
+    }
+}
+
+# Index name -> mappings, created on startup if missing
+INDICES = {
+    URLS_INDEX: URLS_MAPPINGS,
+    ROLLUPS_INDEX: ROLLUPS_MAPPINGS,
+    COUNTERS_INDEX: COUNTERS_MAPPINGS,
+    URL_HASHES_INDEX: URL_HASHES_MAPPINGS,
+    VISITOR_SKETCHES_INDEX: VISITOR_SKETCHES_MAPPINGS,
+}
+
+def clicks_ilm_policy() -> Dict[str, Any]:
+    """Lifecycle policy deleting click partitions after the retention period"""
+    return {
+        "phases": {
+            "hot": {"min_age": "0ms", "actions": {}},
+            "delete": {
+                "min_age": f"{settings.CLICKS_RETENTION_DAYS}d",
+                "actions": {"delete": {}}
+            }
+        }
+    }
+
+def clicks_index_template() -> Dict[str, Any]:
+    """Template applied to every click partition"""
+    index_settings = {
+        "number_of_shards": settings.CLICKS_NUMBER_OF_SHARDS,
+        "number_of_replicas": settings.CLICKS_NUMBER_OF_REPLICAS,
+    }
+    if settings.CLICKS_RETENTION_DAYS > 0:
+        index_settings["index.lifecycle.name"] = CLICKS_ILM_POLICY
+    return {
+        "index_patterns": [f"{CLICKS_PARTITION_PREFIX}*"],
+        "template": {
+            "settings": index_settings,
+            "mappings": CLICKS_MAPPINGS,
+            "aliases": {CLICKS_ALIAS: {}}
+        }
+    }
+
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def click_day(timestamp: Any) -> str:
+    """Return the yyyy-MM-dd day of a click timestamp (datetime or ISO string)"""
+    if isinstance(timestamp, datetime):
+        return _as_utc(timestamp).strftime("%Y-%m-%d")
+    if isinstance(timestamp, date):
+        return timestamp.strftime("%Y-%m-%d")
+    return str(timestamp)[:10]
+
+def click_partition(timestamp: Any) -> str:
+    """Name of the partition a click with this timestamp is written to"""
+    year, month, day = click_day(timestamp).split("-")
+    if settings.CLICKS_PARTITION_INTERVAL == "day":
+        return f"{CLICKS_PARTITION_PREFIX}{year}.{month}.{day}"
+    return f"{CLICKS_PARTITION_PREFIX}{year}.{month}"
+
+def click_indices(start: Optional[datetime] = None, end: Optional[datetime] = None) -> str:
+    """
+    Comma-separated click partitions overlapping [start, end]
+
+    Falls back to the alias when the range is open or would fan out to more
+    than CLICKS_MAX_PARTITIONS_PER_QUERY partitions. The legacy index is
+    always included; search with ``ignore_unavailable`` so missing
+    partitions are skipped.
+    """
+    if start is None:
+        return CLICKS_ALIAS
+    first = datetime.strptime(click_day(start), "%Y-%m-%d").date()
+    last = datetime.strptime(click_day(end or datetime.utcnow()), "%Y-%m-%d").date()
+
+    names: List[str] = []
+    day = first
+    while day <= last:
+        name = click_partition(day)
+        if not names or names[-1] != name:
+            names.append(name)
+            if len(names) > settings.CLICKS_MAX_PARTITIONS_PER_QUERY:
+                return CLICKS_ALIAS
+        day += timedelta(days=1)
+    return ",".join([LEGACY_CLICKS_INDEX] + names)
+
+def short_url_for(short_code: str) -> str:
+    """Build the public short URL for a code"""
+    return f"{settings.FRONTEND_BASE_URL}/{short_code}"
+
+def url_from_source(doc: Dict[str, Any]) -> URLResponse:
+    """Build a URLResponse from a document in the urls index"""
+    return URLResponse(
+        original_url=doc["original_url"],
+        short_code=doc["short_code"],
+        short_url=short_url_for(doc["short_code"]),
+        created_at=doc["created_at"]
+    )
+
+def url_document(original_url: str, short_code: str, created_at: datetime) -> Dict[str, Any]:
+    return {
+        "original_url": original_url,
+        "short_code": short_code,
+        "created_at": created_at
+    }
+
+def bulk_create_operations(codes: List[str], items: List[URLCreate], created_at: datetime) -> List[Dict[str, Any]]:
+    """Bulk ``create`` operations storing each item under its code"""
+    operations: List[Dict[str, Any]] = []
+    for short_code, item in zip(codes, items):
+        operations.append({"create": {"_index": URLS_INDEX, "_id": short_code}})
+        operations.append(url_document(item.original_url, short_code, created_at))
+    return operations
+
+def parse_bulk_create(
+    codes: List[str],
+    items: List[URLCreate],
+    response: Dict[str, Any],
+    created_at: datetime
+) -> Tuple[List[Union[URLResponse, BulkURLError]], List[URLCreate]]:
+    """
+    Split a bulk create response into results and items to retry
+
+    Items whose code was already taken (409) are returned for another
+    attempt with fresh codes; any other failure becomes a BulkURLError.
+    """
+    results: List[Union[URLResponse, BulkURLError]] = []
+    retry: List[URLCreate] = []
+    for short_code, item, outcome in zip(codes, items, response["items"]):
+        outcome = outcome["create"]
+        if outcome["status"] == 409:
+            retry.append(item)
+        elif outcome["status"] >= 300:
+            error = outcome.get("error", {})
+            results.append(BulkURLError(original_url=item.original_url, error=error.get("reason", str(error))))
+        else:
+            results.append(URLResponse(
+                original_url=item.original_url,
+                short_code=short_code,
+                short_url=short_url_for(short_code),
+                created_at=created_at
+            ))
+    return results, retry
+
+def encode_cursor(value: Any) -> str:
+    """Opaque URL-safe cursor for a JSON-serializable ``search_after`` state"""
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Any:
+    """Inverse of ``encode_cursor``; raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def recent_urls_query(limit: int, search_after: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """
+    ``search`` arguments for the newest URLs first, one page of ``limit``
+
+    short_code breaks ties between URLs created in the same millisecond so
+    ``search_after`` never skips or repeats one.
+    """
+    body = {
+        "query": {"match_all": {}},
+        "sort": [{"created_at": {"order": "desc"}}, {"short_code": {"order": "desc"}}],
+        "size": limit
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+URLS_PIT_KEEP_ALIVE = "5m"
+
+def urls_scan_query(pit_id: str, size: int, search_after: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """``search`` arguments for one batch of a full scan of the urls index, in index order"""
+    body = {
+        "query": {"match_all": {}},
+        "source": ["original_url", "created_at"],
+        "sort": ["_shard_doc"],
+        "size": size,
+        "pit": {"id": pit_id, "keep_alive": URLS_PIT_KEEP_ALIVE},
+        "track_total_hits": False
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+def next_cursor(hits: List[Dict[str, Any]], limit: int, **state: Any) -> Optional[str]:
+    """Cursor for the page after ``hits``, or None if this was the last page"""
+    if len(hits) < limit:
+        return None
+    if state:
+        return encode_cursor(dict(state, after=hits[-1]["sort"]))
+    return encode_cursor(hits[-1]["sort"])
+
+def recent_urls_page(result: Dict[str, Any], limit: int) -> Tuple[List[URLResponse], Optional[str]]:
+    """URLs of a ``recent_urls_query`` response and the cursor of the next page"""
+    hits = result["hits"]["hits"]
+    return [url_from_source(hit["_source"]) for hit in hits], next_cursor(hits, limit)
+
+def clicks_filter(short_code: str) -> Dict[str, Any]:
+    return {"term": {"short_code": short_code}}
+
+# How long an export cursor's point in time is kept open between pages
+CLICKS_PIT_KEEP_ALIVE = "2m"
+
+def clicks_page_query(
+    short_code: str,
+    pit_id: str,
+    limit: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    search_after: Optional[List[Any]] = None
+) -> Dict[str, Any]:
+    """
+    ``search`` arguments for one page of raw click documents in time order,
+    read from a point in time
+
+    The point in time adds its own ``_shard_doc`` tiebreaker to the sort, so
+    clicks with equal timestamps are neither skipped nor repeated.
+    """
+    body = {
+        "query": _filtered(clicks_filter(short_code), time_range("timestamp", start, end)),
+        "sort": [{"timestamp": {"order": "asc"}}],
+        "size": limit,
+        "pit": {"id": pit_id, "keep_alive": CLICKS_PIT_KEEP_ALIVE},
+        "track_total_hits": False
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+def clicks_page_cursor(cursor: str) -> Tuple[str, Optional[List[Any]]]:
+    """Point in time and search_after of a clicks page cursor; raises ValueError for a malformed one"""
+    state = decode_cursor(cursor)
+    if not isinstance(state, dict) or "pit" not in state:
+        raise ValueError("Invalid cursor")
+    return state["pit"], state.get("after")
+
+def clicks_page(result: Dict[str, Any], pit_id: str, limit: int) -> Tuple[ClickPage, Optional[str]]:
+    """
+    The ClickPage of a ``clicks_page_query`` response, and the point in time
+    to close if it was the last page (None otherwise)
+    """
+    pit_id = result.get("pit_id", pit_id)
+    hits = result["hits"]["hits"]
+    cursor = next_cursor(hits, limit, pit=pit_id)
+    page = ClickPage(clicks=[click_from_source(hit["_source"]) for hit in hits], next_cursor=cursor)
+    return page, pit_id if cursor is None else None
+
+EXPORT_PIT_KEEP_ALIVE = "5m"
+
+def clicks_scan_query(
+    pit_id: str,
+    size: int,
+    short_code: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    search_after: Optional[List[Any]] = None
+) -> Dict[str, Any]:
+    """``search`` arguments for one batch of a scan over raw clicks, of one code or all, in time order"""
+    body = {
+        "query": _filtered(clicks_filter(short_code) if short_code else {"match_all": {}}, time_range("timestamp", start, end)),
+        "sort": [{"timestamp": {"order": "asc"}}],
+        "size": size,
+        "pit": {"id": pit_id, "keep_alive": EXPORT_PIT_KEEP_ALIVE},
+        "track_total_hits": False
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+def click_document(
+    short_code: str,
+    browser: str,
+    device: str,
+    country: str,
+    ip: str,
+    os: str = "Unknown",
+    user_agent: Optional[str] = None
+) -> Dict[str, Any]:
+    """A click as queued for indexing, timestamped now"""
+    return {
+        "short_code": short_code,
+        "timestamp": datetime.utcnow(),
+        "browser": browser,
+        "device": device,
+        "os": os,
+        "country": country,
+        "ip": ip,
+        "user_agent": user_agent
+    }
+
+def click_from_source(doc: Dict[str, Any]) -> Click:
+    return Click(
+        short_code=doc["short_code"],
+        timestamp=doc["timestamp"],
+        browser=doc.get("browser", "Unknown"),
+        device=doc.get("device", "Unknown"),
+        os=doc.get("os", "Unknown"),
+        country=doc.get("country", "Unknown"),
+        ip=doc.get("ip"),
+        user_agent=doc.get("user_agent"),
+        count=doc.get("count", 1)
+    )
+
+# Histogram bucket labels per interval; week buckets are labelled with
+# their Monday
+INTERVALS = {
+    "hour": "yyyy-MM-dd'T'HH:mm",
+    "day": "yyyy-MM-dd",
+    "week": "yyyy-MM-dd",
+}
+
+def _iso(value: datetime) -> str:
+    return _as_utc(value).isoformat()
+
+def time_range(field: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Range filter for ``start <= field < end``, or None if both are open"""
+    bounds = {}
+    if start is not None:
+        bounds["gte"] = _iso(start)
+    if end is not None:
+        bounds["lt"] = _iso(end)
+    return {"range": {field: bounds}} if bounds else None
+
+def day_range(start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """``time_range`` over the yyyy-MM-dd ``day`` field of the rollup index"""
+    bounds = {}
+    if start is not None:
+        bounds["gte"] = click_day(start)
+    if end is not None:
+        bounds["lt"] = click_day(end)
+    return {"range": {"day": dict(bounds, format="yyyy-MM-dd")}} if bounds else None
+
+def _filtered(query: Dict[str, Any], *filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    filters = [f for f in filters if f is not None]
+    if not filters:
+        return query
+    return {"bool": {"filter": [query] + filters}}
+
+def rollups_cover(start: Optional[datetime] = None, end: Optional[datetime] = None, interval: str = "day") -> bool:
+    """
+    Whether the daily rollups can answer a window exactly
+
+    They can for day and week buckets over whole days; hourly buckets and
+    windows that start or end mid-day need the raw clicks.
+    """
+    if interval == "hour":
+        return False
+    return all(value is None or _as_utc(value).time() == time.min for value in (start, end))
+
+def click_window_start(since: Optional[datetime], start: Optional[datetime]) -> Optional[datetime]:
+    """The later of a link's creation time and the requested window start"""
+    if since is None or start is None:
+        return start or since
+    return max(_as_utc(since), _as_utc(start))
+
+# Matches raw clicks already counted in the rollup index
+ROLLED_UP_FILTER = {"term": {"rolled_up": True}}
+
+# Clicks in a bucket: raw clicks count once, counter and rollup documents
+# count as their ``count`` field
+CLICKS_SUM = {"sum": {"field": "count", "missing": 1}}
+
+def _analytics_aggs(date_field: str, interval: str = "day", size: int = 10) -> Dict[str, Any]:
+    aggs = {
+        "total_clicks": CLICKS_SUM,
+        # latest_timestamp for raw clicks, latest_day for rollups
+        f"latest_{date_field}": {"max": {"field": date_field}},
+        "clicks_by_date": {
+            "date_histogram": {
+                "field": date_field,
+                "calendar_interval": interval,
+                "format": INTERVALS[interval]
+            },
+            "aggs": {"clicks": CLICKS_SUM}
+        }
+    }
+    for field in DIMENSIONS:
+        aggs[f"clicks_by_{field}"] = {
+            "terms": {"field": field, "size": size, "order": {"clicks": "desc"}},
+            "aggs": {"clicks": CLICKS_SUM}
+        }
+    return aggs
+
+def analytics_query(
+    short_code: str,
+    unrolled_only: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "day",
+    size: int = 10
+) -> Dict[str, Any]:
+    """
+    Single search returning the total and every per-dimension breakdown
+
+    Only clicks in ``[start, end)`` are counted, bucketed by ``interval``
+    with the top ``size`` values per dimension. With ``unrolled_only`` only
+    clicks not yet counted in the rollup index are aggregated.
+    """
+    query = _filtered(clicks_filter(short_code), time_range("timestamp", start, end))
+    if unrolled_only:
+        query = {
+            "bool": {
+                "filter": [query],
+                "must_not": [ROLLED_UP_FILTER]
+            }
+        }
+    return {
+        "size": 0,
+        "query": query,
+        "aggs": _analytics_aggs("timestamp", interval, size)
+    }
+
+def rollup_analytics_query(
+    short_code: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "day",
+    size: int = 10
+) -> Dict[str, Any]:
+    """Same breakdowns as ``analytics_query``, summed from the rollup index"""
+    return {
+        "size": 0,
+        "query": _filtered(clicks_filter(short_code), day_range(start, end)),
+        "aggs": _analytics_aggs("day", interval, size)
+    }
+
+def analytics_msearch(
+    short_code: str,
+    since: Optional[datetime] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "day",
+    size: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    msearch body reading the rollups plus the un-rolled tail of raw clicks
+
+    The window must satisfy ``rollups_cover``. ``since`` (the link's
+    creation time) and the window limit the tail to partitions that can
+    contain its clicks.
+    """
+    return [
+        {"index": ROLLUPS_INDEX},
+        rollup_analytics_query(short_code, start, end, interval, size),
+        {"index": click_indices(click_window_start(since, start), end), "ignore_unavailable": True},
+        analytics_query(short_code, True, start, end, interval, size),
+    ]
+
+def raw_analytics_msearch(
+    short_code: str,
+    since: Optional[datetime] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "day",
+    size: int = 10
+) -> List[Dict[str, Any]]:
+    """msearch lines of a plain ``analytics_query`` over the raw clicks"""
+    return [
+        {"index": click_indices(click_window_start(since, start), end), "ignore_unavailable": True},
+        analytics_query(short_code, False, start, end, interval, size),
+    ]
+
+# Sketches merged per analytics request at most; ten years of days
+MAX_SKETCH_DAYS = 3660
+
+def visitor_sketch_id(short_code: str, day: str) -> str:
+    return f"{short_code}@{day}"
+
+def visitor_sketch_document(short_code: str, day: str, sketch: HyperLogLog) -> Dict[str, Any]:
+    return {"short_code": short_code, "day": day, "sketch": base64.b64encode(sketch.to_bytes()).decode("ascii")}
+
+def visitor_sketch_from_source(source: Dict[str, Any]) -> HyperLogLog:
+    return HyperLogLog.from_bytes(base64.b64decode(source["sketch"]))
+
+def visitor_sketches_query(short_code: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    The sketches of every day overlapping ``[start, end)``
+
+    Unlike ``day_range`` a window ending mid-day keeps its last day, so
+    partial days at either end count all of that day's visitors.
+    """
+    bounds = {}
+    if start is not None:
+        bounds["gte"] = click_day(start)
+    if end is not None:
+        bounds["lt" if _as_utc(end).time() == time.min else "lte"] = click_day(end)
+    day_filter = {"range": {"day": dict(bounds, format="yyyy-MM-dd")}} if bounds else None
+    return {
+        "size": MAX_SKETCH_DAYS,
+        "query": _filtered(clicks_filter(short_code), day_filter),
+        "_source": ["sketch"]
+    }
+
+def visitor_sketches_msearch(short_code: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """msearch lines of a ``visitor_sketches_query``, to send along with the click searches"""
+    return [{"index": VISITOR_SKETCHES_INDEX, "ignore_unavailable": True}, visitor_sketches_query(short_code, start, end)]
+
+def unique_visitors(result: Dict[str, Any]) -> int:
+    """Estimated distinct visitors across the sketches of a ``visitor_sketches_query`` response"""
+    merged: Optional[HyperLogLog] = None
+    for hit in result["hits"]["hits"]:
+        sketch = visitor_sketch_from_source(hit["_source"])
+        if merged is None:
+            merged = sketch
+        else:
+            merged.merge(sketch)
+    return merged.count() if merged is not None else 0
+
+def analytics_counts(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract plain counters from an ``analytics_query`` or ``rollup_analytics_query`` response
+
+    A search that matched no index has no aggregations; it counts nothing.
+    """
+    aggs = result.get("aggregations", {})
+    counts = {
+        "total_clicks": int(aggs.get("total_clicks", {}).get("value") or 0),
+        "date": Counter({
+            bucket["key_as_string"]: int(bucket["clicks"]["value"])
+            for bucket in aggs.get("clicks_by_date", {}).get("buckets", [])
+        }),
+    }
+    for field in DIMENSIONS:
+        counts[field] = Counter({
+            bucket["key"]: int(bucket["clicks"]["value"])
+            for bucket in aggs.get(f"clicks_by_{field}", {}).get("buckets", [])
+        })
+    # When the counts last changed, in epoch seconds: the newest raw click,
+    # or for rollups, which only keep the day, the end of the newest day
+    latest = [
+        aggs[name]["value"] / 1000 + offset
+        for name, offset in (("latest_timestamp", 0), ("latest_day", 86400))
+        if aggs.get(name, {}).get("value") is not None
+    ]
+    counts["last_click_at"] = max(latest) if latest else None
+    return counts
+
+def merge_counts(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Add two ``analytics_counts`` results together"""
+    merged = {"total_clicks": a["total_clicks"] + b["total_clicks"]}
+    for key in ("date",) + DIMENSIONS:
+        # update() rather than + so empty histogram days are kept
+        merged[key] = Counter(a[key])
+        merged[key].update(b[key])
+    latest = [counts["last_click_at"] for counts in (a, b) if counts.get("last_click_at") is not None]
+    merged["last_click_at"] = max(latest) if latest else None
+    return merged
+
+def epoch_seconds(value: datetime) -> float:
+    """A datetime as epoch seconds; naive ones are taken as UTC"""
+    return _as_utc(value).replace(tzinfo=timezone.utc).timestamp()
+
+def modified_at(counts: Dict[str, Any], created_at: datetime) -> float:
+    """When a URL's ``analytics_counts`` last changed, in epoch seconds; its creation if it has no clicks"""
+    created = epoch_seconds(created_at)
+    last_click_at = counts.get("last_click_at")
+    return max(created, last_click_at) if last_click_at is not None else created
+
+def counts_to_fields(counts: Dict[str, Any], size: int = 10) -> Dict[str, Any]:
+    """Turn ``analytics_counts`` into URLAnalytics fields"""
+    return {
+        "total_clicks": counts["total_clicks"],
+        "clicks_by_date": [
+            ClickData(date=day, count=count)
+            for day, count in sorted(counts["date"].items())
+        ],
+        "clicks_by_browser": [
+            BrowserData(browser=key, count=count)
+            for key, count in counts["browser"].most_common(size)
+        ],
+        "clicks_by_device": [
+            DeviceData(device=key, count=count)
+            for key, count in counts["device"].most_common(size)
+        ],
+        "clicks_by_country": [
+            CountryData(country=key, count=count)
+            for key, count in counts["country"].most_common(size)
+        ],
+    }
+
+def click_counts_request(
+    short_code: str,
+    since: Optional[datetime] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "day",
+    size: int = 10,
+    with_visitors: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    The request behind a code's click totals, as the client method to call
+    ("search" or "msearch") and its arguments; parse the response with
+    ``click_counts``
+
+    ``since`` (the link's creation time) and the ``[start, end)`` window
+    limit the read to click partitions that can contain its clicks.
+    """
+    if settings.CLICK_ROLLUPS_ENABLED and rollups_cover(start, end, interval):
+        # Rollups plus the un-rolled tail of raw clicks in one round trip
+        searches = analytics_msearch(short_code, since, start, end, interval, size)
+    elif with_visitors:
+        searches = raw_analytics_msearch(short_code, since, start, end, interval, size)
+    else:
+        # Total and every breakdown come back from one search request
+        return "search", {
+            "index": click_indices(click_window_start(since, start), end),
+            "ignore_unavailable": True,
+            **analytics_query(short_code, False, start, end, interval, size)
+        }
+
+    if with_visitors:
+        # The day sketches come back in the same round trip
+        searches += visitor_sketches_msearch(short_code, start, end)
+    return "msearch", {"searches": searches}
+
+def click_counts(method: str, result: Dict[str, Any], with_visitors: bool = False) -> Dict[str, Any]:
+    """``analytics_counts`` of the response to a ``click_counts_request``"""
+    if method == "search":
+        return analytics_counts(result)
+    return analytics_msearch_counts(result, with_visitors)
+
+def msearch_responses(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    The responses of an msearch, in order
+
+    Raises the error of the first search that failed, as the client would
+    have for that search on its own, instead of reading a partial result.
+    """
+    responses = result["responses"]
+    for response in responses:
+        if "error" in response:
+            status = response.get("status", 500)
+            meta = getattr(result, "meta", None)
+            if meta is not None:
+                meta = ApiResponseMeta(status, meta.http_version, meta.headers, meta.duration, meta.node)
+            else:
+                meta = ApiResponseMeta(status, "1.1", HttpHeaders(), 0.0, NodeConfig("http", "localhost", 9200))
+            error = response["error"]
+            message = error.get("reason") or error.get("type", "error") if isinstance(error, dict) else str(error)
+            raise HTTP_EXCEPTIONS.get(status, ApiError)(message=message, meta=meta, body=response)
+    return responses
+
+def analytics_msearch_counts(result: Dict[str, Any], with_visitors: bool = False) -> Dict[str, Any]:
+    """
+    Merged ``analytics_counts`` of an msearch response
+
+    With ``with_visitors`` the last response is that of a
+    ``visitor_sketches_msearch``, and its estimate is added as
+    ``unique_visitors``.
+    """
+    responses = msearch_responses(result)
+    if with_visitors:
+        *responses, sketches = responses
+    counts = analytics_counts(responses[0])
+    for response in responses[1:]:
+        counts = merge_counts(counts, analytics_counts(response))
+    if with_visitors:
+        counts["unique_visitors"] = unique_visitors(sketches)
+    return counts
@@ -0,0 +1,159 @@
+"""
+Hot-link detection and click coalescing
+
+Every click offered to ``HotLinkAggregator`` updates a per-worker
+Space-Saving sketch of short codes, which ``top`` reads for /api/hot.
+
+With ``coalescing`` on, once a code has at least ``threshold`` clicks in
+the current window its clicks are no longer indexed one by one: they are
+counted in memory per (short_code, minute, browser, device, os, country)
+and each counter is flushed as a single click document with a ``count``
+field after its minute has passed. Analytics sum ``count`` (missing = 1)
+so these documents weigh the same as the clicks they replace. The
+per-click IP and user agent are not kept, so replay-clicks leaves counter
+documents as they are and unique visitors come only from the visitor
+sketches; this is why HOT_LINKS_ENABLED, which turns coalescing on, is
+off by default.
+
+With a click journal nothing is held in memory: every click is journaled
+first and ``coalesce`` sums the clicks of codes with at least
+``threshold`` clicks in a shipped batch instead, so a crash loses none.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from app.core.config import settings
+from app.utils.heavy_hitters import SpaceSaving
+
+CounterKey = Tuple[str, datetime, str, str, str, str]
+
+def _minute(timestamp: datetime) -> datetime:
+    return timestamp.replace(second=0, microsecond=0)
+
+def _counter_key(doc: Dict[str, Any]) -> CounterKey:
+    return (
+        doc["short_code"],
+        _minute(doc["timestamp"]),
+        doc.get("browser", "Unknown"),
+        doc.get("device", "Unknown"),
+        doc.get("os", "Unknown"),
+        doc.get("country", "Unknown"),
+    )
+
+def _counter_doc(key: CounterKey, count: int) -> Dict[str, Any]:
+    short_code, minute, browser, device, os, country = key
+    return {
+        "short_code": short_code,
+        "timestamp": minute,
+        "browser": browser,
+        "device": device,
+        "os": os,
+        "country": country,
+        "count": count,
+    }
+
+class HotLinkAggregator:
+    def __init__(self, capacity: int = 1000, threshold: int = 100, decay_interval: float = 60.0, coalescing: bool = True):
+        self.sketch = SpaceSaving(capacity)
+        self.threshold = threshold
+        self.coalescing = coalescing
+        self.decay_interval = decay_interval
+        self._counters: "Counter[CounterKey]" = Counter()
+        self._lock = threading.Lock()
+        self._next_decay = time.monotonic() + decay_interval
+
+        # Metrics
+        self.absorbed = 0
+        self.emitted = 0
+
+    @classmethod
+    def from_settings(cls) -> "HotLinkAggregator":
+        return cls(
+            capacity=settings.HOT_LINK_CAPACITY,
+            threshold=settings.HOT_LINK_THRESHOLD,
+            decay_interval=settings.HOT_LINK_DECAY_INTERVAL,
+            coalescing=settings.HOT_LINKS_ENABLED
+        )
+
+    def _decay(self):
+        if time.monotonic() >= self._next_decay:
+            self._next_decay = time.monotonic() + self.decay_interval
+            self.sketch.decay()
+
+    def absorb(self, doc: Dict[str, Any]) -> bool:
+        """
+        Offer a click to the sketch
+
+        Returns:
+            True if the click's code is hot and the click was counted here,
+            False if it should be indexed as usual
+        """
+        self._decay()
+        if self.sketch.offer(doc["short_code"]) < self.threshold or not self.coalescing:
+            return False
+        key = _counter_key(doc)
+        with self._lock:
+            self._counters[key] += 1
+        self.absorbed += 1
+        return True
+
+    def drain(self, now: datetime = None, everything: bool = False) -> List[Dict[str, Any]]:
+        """Pre-summed click documents for every counter whose minute has ended"""
+        current = _minute(now or datetime.utcnow())
+        with self._lock:
+            due = [key for key in self._counters if everything or key[1] < current]
+            counts = [(key, self._counters.pop(key)) for key in due]
+        docs = [_counter_doc(key, count) for key, count in counts]
+        self.emitted += len(docs)
+        return docs
+
+    def coalesce(self, docs: List[Dict[str, Any]], ids: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Sum the clicks of codes with at least ``threshold`` clicks in a
+        journal batch into counter documents
+
+        Returns the documents and IDs to index. Counter documents take the
+        ID of their first click, so the same batch always produces the
+        same documents and sending it again cannot count a click twice.
+        """
+        per_code = Counter(doc["short_code"] for doc in docs)
+        # Keeps ``top`` meaningful; the sketch does not decide anything here
+        self._decay()
+        for short_code, count in per_code.items():
+            self.sketch.offer(short_code, count)
+        if not self.coalescing:
+            return docs, ids
+        out_docs: List[Dict[str, Any]] = []
+        out_ids: List[str] = []
+        groups: Dict[CounterKey, List[Any]] = {}
+        for doc, doc_id in zip(docs, ids):
+            if per_code[doc["short_code"]] < self.threshold:
+                out_docs.append(doc)
+                out_ids.append(doc_id)
+                continue
+            key = _counter_key(doc)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [doc_id, 1]
+            else:
+                group[1] += 1
+        for key, (first_id, count) in groups.items():
+            out_docs.append(_counter_doc(key, count))
+            out_ids.append(first_id)
+        self.absorbed += sum(count for _, count in groups.values())
+        self.emitted += len(groups)
+        return out_docs, out_ids
+
+    def pending(self) -> int:
+        """Clicks counted but not yet drained"""
+        with self._lock:
+            return sum(self._counters.values())
+
+    def top(self, n: int = 10) -> List[Dict[str, Any]]:
+        """The current top ``n`` codes with their estimated click counts"""
+        return [
+            {"short_code": short_code, "clicks": count, "error": error, "coalesced": self.coalescing and count - error >= self.threshold}
+            for short_code, count, error in self.sketch.top(n)
+        ]
@@ -0,0 +1,344 @@
+"""
+Shared, memory-mapped short code to URL table for multi-process serving
+
+A loader process (``python -m app.cli build-link-table``) scans the urls
+index and writes an immutable open-addressing hash table. Every worker
+maps the same file read-only, so the table costs one copy in the page
+cache however many workers there are, and a freshly started worker
+resolves every code in the table without a single Elasticsearch request.
+
+Layout after the header, each section 8-byte aligned:
+
+- ``slot_codes``: ``slot_count`` fixed-width slots holding a code's UTF-8
+  bytes, zero padded to ``width``
+- ``slot_links``: per slot, 1 + the link's index (0 marks an empty slot)
+- ``offsets``: ``2 * link_count + 1`` positions in the strings blob; link
+  ``i`` has its URL at ``offsets[2i]:offsets[2i+1]`` and its creation
+  time at ``offsets[2i+1]:offsets[2i+2]``
+- the strings blob
+
+Slots are found by CRC-32 of the code with linear probing, at a load
+factor of at most one half. The loader replaces the file atomically;
+workers notice a new file within ``LINK_TABLE_CHECK_INTERVAL`` and re-map
+it, while requests still reading the old mapping keep it alive.
+"""
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.models.url import URLResponse
+from app.services import es_queries
+from app.utils import metrics
+
+MAGIC = b"URLLNK1\0"
+# magic, byte order (0 little / 1 big), code width, slot count, link count, blob length, built at
+_HEADER = struct.Struct("<8sBB2xIIQd")
+
+# (short_code, original_url, created_at)
+Link = Tuple[str, str, str]
+
+class LinkTable:
+    """
+    Immutable short code -> (original URL, created at) hash table
+
+    ``data`` holds the slot codes at ``codes_at`` and the strings blob at
+    ``blob_at``; slicing it (bytes or an mmap) yields bytes directly, which
+    is much cheaper per lookup than slicing memoryviews.
+    """
+
+    def __init__(self, width: int, data, codes_at: int, blob_at: int, blob_size: int,
+                 slot_links, offsets, built_at: float):
+        self.width = width
+        self.data = data
+        self.codes_at = codes_at
+        self.blob_at = blob_at
+        self.blob_size = blob_size
+        self.slot_links = slot_links
+        self.offsets = offsets
+        self.built_at = built_at
+        self._mask = len(slot_links) - 1
+
+    @classmethod
+    def build(cls, links: Iterable[Link], built_at: Optional[float] = None) -> "LinkTable":
+        """Build a table in memory; later duplicates of a code are ignored"""
+        codes: List[bytes] = []
+        offsets = array("I", [0])
+        blob = bytearray()
+        seen = set()
+        for short_code, original_url, created_at in links:
+            code = short_code.encode("utf-8")
+            if code in seen:
+                continue
+            seen.add(code)
+            codes.append(code)
+            blob += original_url.encode("utf-8")
+            offsets.append(len(blob))
+            blob += str(created_at).encode("utf-8")
+            offsets.append(len(blob))
+            if len(blob) > 0xFFFFFFFF:
+                raise ValueError("Link table strings exceed 4 GiB")
+
+        width = max((len(code) for code in codes), default=1)
+        if width > 255:
+            raise ValueError("Short codes longer than 255 bytes cannot be stored")
+        slot_count = 2
+        while slot_count < 2 * len(codes):
+            slot_count *= 2
+        mask = slot_count - 1
+        slot_codes = bytearray(slot_count * width)
+        slot_links = array("I", bytes(4 * slot_count))
+        for index, code in enumerate(codes):
+            slot = zlib.crc32(code) & mask
+            while slot_links[slot]:
+                slot = (slot + 1) & mask
+            slot_codes[slot * width:slot * width + len(code)] = code
+            slot_links[slot] = index + 1
+        return cls(width, bytes(slot_codes + blob), 0, len(slot_codes), len(blob), slot_links, offsets,
+                   time.time() if built_at is None else built_at)
+
+    @classmethod
+    def open(cls, path: str) -> "LinkTable":
+        """Memory-map a table written by ``write``"""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, width, slot_count, link_count, blob_size, built_at = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a link table")
+        native = byteorder == (0 if sys.byteorder == "little" else 1)
+
+        view = memoryview(buffer)
+
+        def column(offset: int, typecode: str, count: int):
+            data = view[offset:offset + array(typecode).itemsize * count]
+            if native:
+                return data.cast(typecode)
+            # Built on a machine of the other byte order: copy and swap once
+            values = array(typecode, data.tobytes())
+            values.byteswap()
+            return values
+
+        codes_at = _HEADER.size
+        links_at = _align(codes_at + slot_count * width)
+        offsets_at = _align(links_at + 4 * slot_count)
+        blob_at = _align(offsets_at + 4 * (2 * link_count + 1))
+        if blob_at + blob_size > len(buffer):
+            raise ValueError("Truncated link table")
+        return cls(width, buffer, codes_at, blob_at, blob_size,
+                   column(links_at, "I", slot_count), column(offsets_at, "I", 2 * link_count + 1), built_at)
+
+    def write(self, path: str):
+        """Write the table to ``path`` atomically, so readers never see a partial file"""
+        slot_codes = self.data[self.codes_at:self.codes_at + len(self.slot_links) * self.width]
+        blob = self.data[self.blob_at:self.blob_at + self.blob_size]
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, 0 if sys.byteorder == "little" else 1, self.width,
+                                 len(self.slot_links), len(self), self.blob_size, self.built_at))
+            for section in (slot_codes, self.slot_links, self.offsets, blob):
+                f.write(section)
+                _pad(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) // 2
+
+    def _find(self, short_code: str) -> int:
+        """Index of the code's link, or -1"""
+        try:
+            code = short_code.encode("utf-8")
+        except UnicodeEncodeError:
+            return -1
+        width = self.width
+        if len(code) > width:
+            return -1
+        data, slot_links, mask = self.data, self.slot_links, self._mask
+        slot = zlib.crc32(code) & mask
+        code = code.ljust(width, b"\0")
+        codes_at = self.codes_at
+        while True:
+            link = slot_links[slot]
+            if not link:
+                return -1
+            start = codes_at + slot * width
+            if data[start:start + width] == code:
+                return link - 1
+            slot = (slot + 1) & mask
+
+    def get(self, short_code: str) -> Optional[Tuple[str, str]]:
+        """(original URL, created at) for a code, or None"""
+        index = self._find(short_code)
+        if index < 0:
+            return None
+        offsets, data, blob_at = self.offsets, self.data, self.blob_at
+        start, middle, end = offsets[2 * index], offsets[2 * index + 1], offsets[2 * index + 2]
+        return data[blob_at + start:blob_at + middle].decode("utf-8"), data[blob_at + middle:blob_at + end].decode("utf-8")
+
+    def original_url(self, short_code: str) -> Optional[str]:
+        """Just the original URL for a code, or None; all a redirect needs"""
+        # ``_find`` inlined: this runs for every redirect the table serves
+        try:
+            code = short_code.encode("utf-8")
+        except UnicodeEncodeError:
+            return None
+        width = self.width
+        if len(code) > width:
+            return None
+        data, slot_links, mask, codes_at = self.data, self.slot_links, self._mask, self.codes_at
+        slot = zlib.crc32(code) & mask
+        code = code.ljust(width, b"\0")
+        while True:
+            link = slot_links[slot]
+            if not link:
+                return None
+            start = codes_at + slot * width
+            if data[start:start + width] == code:
+                offsets, blob_at = self.offsets, self.blob_at
+                index = 2 * link - 2
+                return data[blob_at + offsets[index]:blob_at + offsets[index + 1]].decode("utf-8")
+            slot = (slot + 1) & mask
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def _pad(f):
+    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+
+def scan_links(es, batch_size: int = 5000) -> Iterator[Link]:
+    """Every link in the urls index, read through a point in time"""
+    pit_id = es.open_point_in_time(index=es_queries.URLS_INDEX, keep_alive=es_queries.URLS_PIT_KEEP_ALIVE)["id"]
+    search_after = None
+    try:
+        while True:
+            result = es.search(**es_queries.urls_scan_query(pit_id, batch_size, search_after))
+            hits = result["hits"]["hits"]
+            for hit in hits:
+                yield hit["_id"], hit["_source"]["original_url"], str(hit["_source"]["created_at"])
+            if len(hits) < batch_size:
+                return
+            pit_id = result.get("pit_id", pit_id)
+            search_after = hits[-1]["sort"]
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+def build_link_table(es, path: str, batch_size: int = 5000) -> LinkTable:
+    """Snapshot the urls index into the table file at ``path``"""
+    table = LinkTable.build(scan_links(es, batch_size))
+    table.write(path)
+    return table
+
+class SharedLinkTable:
+    """
+    The table at a path, re-mapped when the loader replaces the file
+
+    Checks the file's identity at most every ``check_interval`` seconds,
+    so a lookup is usually just the hash probe. The last ``resolved_size``
+    original URLs looked up are also kept decoded, which makes a hot code's
+    redirect a dict hit; links never change, so they only go with the table.
+    """
+
+    def __init__(self, path: str, check_interval: float = 10.0, resolved_size: int = 4096):
+        self.path = path
+        self.check_interval = check_interval
+        self.resolved_size = resolved_size
+        self.table: Optional[LinkTable] = None
+        self._resolved: Dict[str, str] = {}
+        self._identity = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def current(self) -> Optional[LinkTable]:
+        """The newest table, or None until one has been written"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.check_interval:
+                    self._reload()
+                    self._checked_at = time.monotonic()
+        return self.table
+
+    def _reload(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._identity:
+            return
+        try:
+            self.table = LinkTable.open(self.path)
+            self._resolved = {}
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error loading link table: {e}")
+            return
+        self._identity = identity
+        self.reloads += 1
+
+    def get_original_url(self, short_code: str) -> Optional[str]:
+        """
+        The original URL for a code if the table has it
+
+        The redirect fast path uses this rather than ``get_url``: a hit is
+        a dict lookup or one probe and decode, with no model to build.
+        """
+        table = self.current()
+        resolved = self._resolved
+        original_url = resolved.get(short_code)
+        if original_url is None:
+            original_url = table.original_url(short_code) if table is not None else None
+            if original_url is None:
+                self.misses += 1
+                return None
+            if len(resolved) >= self.resolved_size:
+                resolved.clear()
+            resolved[short_code] = original_url
+        self.hits += 1
+        return original_url
+
+    def get_url(self, short_code: str) -> Optional[URLResponse]:
+        """The URL for a code if the table has it"""
+        table = self.current()
+        link = table.get(short_code) if table is not None else None
+        if link is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        original_url, created_at = link
+        return URLResponse(
+            original_url=original_url,
+            short_code=short_code,
+            short_url=es_queries.short_url_for(short_code),
+            created_at=created_at
+        )
+
+    def collect_metrics(self) -> List[metrics.Sample]:
+        table = self.table
+        samples = metrics.cache_samples("link_table", self.hits, self.misses, len(table) if table is not None else 0)
+        samples.append(("link_table_reloads_total", "counter", "Times a new link table file was mapped", {}, self.reloads))
+        if table is not None:
+            samples.append(("link_table_built_timestamp_seconds", "gauge", "When the mapped link table was built", {}, table.built_at))
+        return samples
+
+_link_table: Optional[SharedLinkTable] = None
+_link_table_lock = threading.Lock()
+
+def get_link_table() -> Optional[SharedLinkTable]:
+    """The table at LINK_TABLE_PATH, shared by the services of this process; None if not configured"""
+    global _link_table
+    if _link_table is None and settings.LINK_TABLE_PATH:
+        with _link_table_lock:
+            if _link_table is None:
+                _link_table = SharedLinkTable(settings.LINK_TABLE_PATH, settings.LINK_TABLE_CHECK_INTERVAL)
+                metrics.REGISTRY.register_collector(_link_table.collect_metrics)
+    return _link_table
@@ -0,0 +1,186 @@
+"""
+Compact in-memory URL and click storage
+
+Used by the Flask app for local, edge and test deployments. A click is a
+row across typed ``array`` columns instead of a dict: the timestamp as a
+float, the day as a 16-bit day number, IPv4 addresses as integers, and
+browser, device, OS and country as small integer IDs into per-column
+dictionaries. That is about 30 bytes per click instead of several
+hundred. Rows are grouped per short code, so analytics only read the
+clicks of the code asked about.
+"""
+import socket
+import threading
+import time
+from array import array
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+_SECONDS_PER_DAY = 86400
+# IP column values at or above this are IDs into the encoder of other addresses
+_IP_ENCODED = 1 << 32
+
+class DictionaryEncoder:
+    """Assigns dense integer IDs to distinct string values"""
+
+    __slots__ = ("values", "ids")
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def decode(self, value_id: int) -> str:
+        return self.values[value_id]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+class StoredURL:
+    __slots__ = ("short_code", "original_url", "created_at")
+
+    def __init__(self, short_code: str, original_url: str, created_at: str):
+        self.short_code = short_code
+        self.original_url = original_url
+        self.created_at = created_at
+
+class ClickLog:
+    """Column-oriented clicks of one short code"""
+
+    __slots__ = ("timestamps", "days", "browsers", "devices", "oses", "countries", "ips")
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.days = array("H")
+        self.browsers = array("H")
+        self.devices = array("H")
+        self.oses = array("H")
+        self.countries = array("H")
+        self.ips = array("Q")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+class MemoryStore:
+    """
+    URLs and their clicks, held in process memory
+
+    ``recent_size`` bounds the ring buffer of newest short codes served by
+    ``recent_urls``.
+    """
+
+    DIMENSIONS = ("browser", "device", "os", "country")
+
+    def __init__(self, recent_size: int = 100):
+        self.urls: Dict[str, StoredURL] = {}
+        self.clicks: Dict[str, ClickLog] = {}
+        self.recent = deque(maxlen=recent_size)
+        # "ip" only holds addresses that are not IPv4 (IPv6, or anything unparsable)
+        self.encoders = {dimension: DictionaryEncoder() for dimension in self.DIMENSIONS + ("ip",)}
+        self._lock = threading.Lock()
+
+    def __contains__(self, short_code: str) -> bool:
+        return short_code in self.urls
+
+    def add_url(self, short_code: str, original_url: str, created_at: str) -> Optional[StoredURL]:
+        """Store a new URL; returns None if the short code is already taken"""
+        url = StoredURL(short_code, original_url, created_at)
+        with self._lock:
+            if short_code in self.urls:
+                return None
+            self.urls[short_code] = url
+            self.recent.append(short_code)
+        return url
+
+    def get_url(self, short_code: str) -> Optional[StoredURL]:
+        return self.urls.get(short_code)
+
+    def recent_urls(self, limit: int = 10) -> List[StoredURL]:
+        """Newest URLs first, without looking at older ones"""
+        with self._lock:
+            codes = list(self.recent)
+        recent = []
+        for short_code in reversed(codes):
+            if len(recent) == limit:
+                break
+            url = self.urls.get(short_code)
+            if url is not None:
+                recent.append(url)
+        return recent
+
+    def add_click(self, short_code: str, browser: str, device: str, os: str, country: str, ip: str,
+                  timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.time()
+        encoders = self.encoders
+        with self._lock:
+            log = self.clicks.get(short_code)
+            if log is None:
+                log = self.clicks[short_code] = ClickLog()
+            log.timestamps.append(timestamp)
+            log.days.append(int(timestamp // _SECONDS_PER_DAY))
+            log.browsers.append(encoders["browser"].encode(browser))
+            log.devices.append(encoders["device"].encode(device))
+            log.oses.append(encoders["os"].encode(os))
+            log.countries.append(encoders["country"].encode(country))
+            log.ips.append(self._encode_ip(ip or ""))
+
+    def _encode_ip(self, ip: str) -> int:
+        try:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except OSError:
+            return _IP_ENCODED + self.encoders["ip"].encode(ip)
+
+    def _decode_ip(self, value: int) -> str:
+        if value >= _IP_ENCODED:
+            return self.encoders["ip"].decode(value - _IP_ENCODED)
+        return socket.inet_ntoa(value.to_bytes(4, "big"))
+
+    def click_count(self, short_code: str) -> int:
+        log = self.clicks.get(short_code)
+        return len(log) if log is not None else 0
+
+    def click_counts(self, short_code: str) -> Dict[str, Counter]:
+        """
+        Clicks of one short code counted per day and per dimension value
+
+        Returns:
+            {"date": Counter of YYYY-MM-DD, "browser": Counter, "device": ...};
+            dates are in chronological order
+        """
+        log = self.clicks.get(short_code)
+        if log is None:
+            return {name: Counter() for name in ("date",) + self.DIMENSIONS}
+        # Columns only ever grow, so counting them while clicks are appended is safe
+        counts = {"date": Counter({_day_string(day): count for day, count in sorted(Counter(log.days).items())})}
+        for dimension, column in (("browser", log.browsers), ("device", log.devices), ("os", log.oses), ("country", log.countries)):
+            decode = self.encoders[dimension].decode
+            counts[dimension] = Counter({decode(value_id): count for value_id, count in Counter(column).items()})
+        return counts
+
+    def iter_clicks(self, short_code: str) -> Iterator[dict]:
+        """Click rows of one short code as dicts, oldest first"""
+        log = self.clicks.get(short_code)
+        if log is None:
+            return
+        encoders = self.encoders
+        for i in range(len(log)):
+            yield {
+                "short_code": short_code,
+                "timestamp": datetime.fromtimestamp(log.timestamps[i], timezone.utc).replace(tzinfo=None).isoformat(),
+                "browser": encoders["browser"].decode(log.browsers[i]),
+                "device": encoders["device"].decode(log.devices[i]),
+                "os": encoders["os"].decode(log.oses[i]),
+                "country": encoders["country"].decode(log.countries[i]),
+                "ip": self._decode_ip(log.ips[i]),
+            }
+
+def _day_string(day: int) -> str:
+    return datetime.fromtimestamp(day * _SECONDS_PER_DAY, timezone.utc).strftime("%Y-%m-%d")
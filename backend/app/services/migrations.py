@@ -0,0 +1,33 @@
+"""
+Elasticsearch index bootstrap
+
+Run once per cluster (and again after upgrades that change mappings,
+templates or policies) with ``python -m app.cli migrate``, rather than by
+every worker on startup. Set ELASTICSEARCH_MIGRATE_ON_STARTUP to have the
+services run it themselves, e.g. for a single local process.
+"""
+from app.core.config import settings
+from app.services import es_queries
+
+def migrate(es):
+    """Create missing indices and put the click template, policy and alias"""
+    print("Create required Elasticsearch indices if they don't exist")
+    for index, mappings in es_queries.INDICES.items():
+        if not es.indices.exists(index=index):
+            es.indices.create(index=index, mappings=mappings)
+        else:
+            # Indices created before a field was added get it too
+            es.indices.put_mapping(index=index, properties=mappings["properties"])
+
+    # Click partitions are created on first write from the template
+    if settings.CLICKS_RETENTION_DAYS > 0:
+        es.ilm.put_lifecycle(name=es_queries.CLICKS_ILM_POLICY, policy=es_queries.clicks_ilm_policy())
+    es.indices.put_index_template(name=es_queries.CLICKS_TEMPLATE, **es_queries.clicks_index_template())
+    # Partitions created before a field was added to the template get it too
+    es.indices.put_mapping(
+        index=f"{es_queries.CLICKS_PARTITION_PREFIX}*",
+        properties=es_queries.CLICKS_MAPPINGS["properties"],
+        allow_no_indices=True
+    )
+    if es.indices.exists(index=es_queries.LEGACY_CLICKS_INDEX):
+        es.indices.put_alias(index=es_queries.LEGACY_CLICKS_INDEX, name=es_queries.CLICKS_ALIAS)
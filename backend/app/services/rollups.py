@@ -0,0 +1,205 @@
+"""
+Incremental click rollups
+
+Each click is counted in a ``click_rollups`` document keyed by
+(short_code, day, browser, device, country). After the click pipeline has
+written a batch of raw clicks, ``roll_up`` adds one scripted upsert per
+distinct key in it, so a batch of N clicks on a popular link costs one
+rollup update instead of N, and then flags the clicks ``rolled_up``.
+Anything not flagged (clicks indexed before rollups existed, by another
+writer, or whose rollup update failed) is the un-rolled tail that
+analytics still aggregate from the raw index until ``compact`` folds it in.
+
+Clicks are only flagged once the rollup update for their key succeeded,
+so a failure can never hide a click from analytics. Every rollup update
+carries the ``rollup_batch`` token stored on its raw clicks, and rollup
+documents remember the last ``RECENT_BATCHES`` tokens applied to them, so
+retrying an update whose outcome is unknown does not count it twice.
+Until such a retry, or after a crash between an update and the flagging
+of its clicks, the clicks are counted in both places; ``compact`` fixes the
+latter as long as their token is still remembered.
+"""
+import hashlib
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from elasticsearch import helpers
+from app.core.elasticsearch import bulk_items, retryable
+from app.services import es_queries
+
+RollupKey = Tuple[str, str, str, str, str]
+
+# Batch tokens remembered per rollup document
+RECENT_BATCHES = 32
+
+# Adds params.count unless the batch was applied already; negative
+# adjustments delete a rollup once nothing is left in it
+ADD_SCRIPT = (
+    "if (ctx._source.batches == null) { ctx._source.batches = []; } "
+    "if (ctx._source.batches.contains(params.batch)) { ctx.op = 'noop'; } else { "
+    "ctx._source.batches.add(params.batch); "
+    "if (ctx._source.batches.size() > params.keep) { ctx._source.batches.remove(0); } "
+    "ctx._source.count += params.count; "
+    "if (ctx._source.count <= 0) { ctx.op = 'delete'; } }"
+)
+
+def new_batch() -> str:
+    """A fresh ``rollup_batch`` token"""
+    return uuid.uuid4().hex[:16]
+
+def rollup_key(doc: Dict[str, Any]) -> RollupKey:
+    return (
+        doc["short_code"],
+        es_queries.click_day(doc["timestamp"]),
+        doc.get("browser") or "Unknown",
+        doc.get("device") or "Unknown",
+        doc.get("country") or "Unknown",
+    )
+
+def rollup_id(key: RollupKey) -> str:
+    """Stable document ID for a rollup key"""
+    return hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()
+
+def summarize(docs: Iterable[Dict[str, Any]]) -> Counter:
+    """Count clicks per rollup key; pre-summed documents count as their ``count``"""
+    counts: Counter = Counter()
+    for doc in docs:
+        counts[rollup_key(doc)] += doc.get("count", 1)
+    return counts
+
+def _add_action(key: RollupKey, count: int, batch: str) -> Dict[str, Any]:
+    action = {
+        "_op_type": "update",
+        "_index": es_queries.ROLLUPS_INDEX,
+        "_id": rollup_id(key),
+        "retry_on_conflict": 5,
+        "script": {
+            "source": ADD_SCRIPT,
+            "lang": "painless",
+            "params": {"count": count, "batch": batch, "keep": RECENT_BATCHES}
+        }
+    }
+    if count > 0:
+        short_code, day, browser, device, country = key
+        action["upsert"] = {
+            "short_code": short_code,
+            "day": day,
+            "browser": browser,
+            "device": device,
+            "country": country,
+            "count": count,
+            "batches": [batch]
+        }
+    return action
+
+def rollup_actions(counts: Counter, batch: str) -> Iterator[Dict[str, Any]]:
+    """Bulk scripted-upsert actions adding ``counts`` to the rollup index as ``batch``"""
+    for key, count in counts.items():
+        yield _add_action(key, count, batch)
+
+def adjustment_actions(before: Iterable[Dict[str, Any]], after: Iterable[Dict[str, Any]], batch: str) -> Iterator[Dict[str, Any]]:
+    """
+    Bulk actions moving rolled-up clicks from their old keys to their new ones
+
+    ``before`` and ``after`` are the same click documents before and after
+    their dimensions were changed (see ``app.services.click_replay``).
+    """
+    deltas: Counter = Counter(summarize(after))
+    deltas.subtract(summarize(before))
+    for key, count in deltas.items():
+        if count:
+            yield _add_action(key, count, batch)
+
+def roll_up(es, clicks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Count raw clicks in the rollups, then flag them ``rolled_up``
+
+    ``clicks`` are ``{"_index", "_id", "_source"}`` hits of clicks that are
+    not flagged yet; each ``_source`` has a ``rollup_batch`` token. Clicks
+    whose rollup update Elasticsearch refused for good stay in the tail.
+
+    Returns:
+        The clicks to pass in again later because the outcome of their
+        rollup update or flagging is not known or was refused for now
+    """
+    by_batch: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for click in clicks:
+        by_batch[click["_source"].get("rollup_batch") or ""].append(click)
+    actions: List[Dict[str, Any]] = []
+    updates: List[Tuple[str, RollupKey]] = []
+    for batch, members in by_batch.items():
+        if not batch:
+            # Written before batch tokens existed
+            batch = new_batch()
+            for click in members:
+                click["_source"]["rollup_batch"] = batch
+        for key, count in summarize(click["_source"] for click in members).items():
+            actions.append(_add_action(key, count, batch))
+            updates.append((batch, key))
+
+    try:
+        results = bulk_items(es, actions)
+    except Exception as e:
+        print(f"Click rollup update failed: {e}")
+        return clicks
+    counted, unknown = set(), set()
+    for update, (ok, item) in zip(updates, results):
+        if ok:
+            counted.add(update)
+        elif retryable(item.get("status")):
+            unknown.add(update)
+        else:
+            print(f"Click rollup update refused: {item.get('error')}")
+
+    retry = [click for click in clicks if (click["_source"]["rollup_batch"], rollup_key(click["_source"])) in unknown]
+    flag = [click for click in clicks if (click["_source"]["rollup_batch"], rollup_key(click["_source"])) in counted]
+    if not flag:
+        return retry
+    flag_actions = [
+        {"_op_type": "update", "_index": click["_index"], "_id": click["_id"], "doc": {"rolled_up": True}}
+        for click in flag
+    ]
+    try:
+        results = bulk_items(es, flag_actions)
+    except Exception as e:
+        print(f"Flagging rolled-up clicks failed: {e}")
+        return retry + flag
+    for click, (ok, item) in zip(flag, results):
+        # Clicks deleted by retention meanwhile need nothing more
+        if not ok and item.get("status") != 404:
+            retry.append(click)
+    return retry
+
+def compact(es, batch_size: int = 1000) -> int:
+    """
+    Fold un-rolled raw clicks into the rollup index
+
+    Clicks are rolled up under the ``rollup_batch`` they were written
+    with, so clicks whose rollup update already went through are only
+    flagged. Returns the number of clicks compacted.
+    """
+    query = {"bool": {"must_not": [es_queries.ROLLED_UP_FILTER]}}
+    compacted = 0
+    batch: List[Dict[str, Any]] = []
+    hits = helpers.scan(
+        es,
+        index=es_queries.CLICKS_ALIAS,
+        query={"query": query},
+        size=batch_size,
+        ignore_unavailable=True
+    )
+    for hit in hits:
+        batch.append(hit)
+        if len(batch) >= batch_size:
+            compacted += _compact_batch(es, batch)
+            batch = []
+    if batch:
+        compacted += _compact_batch(es, batch)
+    return compacted
+
+def _compact_batch(es, hits: List[Dict[str, Any]]) -> int:
+    left = roll_up(es, [{"_index": hit["_index"], "_id": hit["_id"], "_source": hit["_source"]} for hit in hits])
+    if left:
+        # Another run picks them up
+        print(f"Compaction: {len(left)} clicks left un-rolled for now")
+    return len(hits) - len(left)
@@ -0,0 +1,124 @@
+"""
+Durable single-file storage on SQLite
+
+For small deployments and CI that should keep their data without an
+Elasticsearch cluster. The database runs in WAL mode, so readers never
+wait for the writer, and with ``synchronous=NORMAL`` a commit does not
+fsync. Each thread gets its own connection. Statements are module
+constants, so each connection's statement cache prepares them once.
+"""
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from app.services.memory_store import StoredURL
+from app.services.storage import StorageBackend, empty_counts
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    short_code TEXT PRIMARY KEY,
+    original_url TEXT NOT NULL,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS urls_created_at ON urls (created_at);
+
+CREATE TABLE IF NOT EXISTS clicks (
+    id INTEGER PRIMARY KEY,
+    short_code TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    browser TEXT NOT NULL,
+    device TEXT NOT NULL,
+    os TEXT NOT NULL,
+    country TEXT NOT NULL,
+    ip TEXT
+);
+CREATE INDEX IF NOT EXISTS clicks_short_code_timestamp ON clicks (short_code, timestamp);
+-- Clicks are only ever read by short code; older databases had this one too
+DROP INDEX IF EXISTS clicks_timestamp;
+"""
+
+INSERT_URL = "INSERT INTO urls (short_code, original_url, created_at) VALUES (?, ?, ?)"
+SELECT_URL = "SELECT short_code, original_url, created_at FROM urls WHERE short_code = ?"
+SELECT_RECENT_URLS = "SELECT short_code, original_url, created_at FROM urls ORDER BY created_at DESC LIMIT ?"
+INSERT_CLICK = (
+    "INSERT INTO clicks (short_code, timestamp, browser, device, os, country, ip) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+# One pass over the code's index range, grouped finely enough to derive every breakdown
+SELECT_CLICK_COUNTS = (
+    "SELECT date(timestamp, 'unixepoch'), browser, device, os, country, COUNT(*) "
+    "FROM clicks WHERE short_code = ? "
+    "GROUP BY 1, 2, 3, 4, 5"
+)
+
+class SQLiteStorage(StorageBackend):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def put_url(self, short_code: str, original_url: str, created_at: str) -> bool:
+        connection = self._connection()
+        try:
+            with connection:
+                connection.execute(INSERT_URL, (short_code, original_url, created_at))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def get_url(self, short_code: str) -> Optional[StoredURL]:
+        row = self._connection().execute(SELECT_URL, (short_code,)).fetchone()
+        return StoredURL(*row) if row else None
+
+    def recent_urls(self, limit: int = 10) -> List[StoredURL]:
+        return [StoredURL(*row) for row in self._connection().execute(SELECT_RECENT_URLS, (limit,))]
+
+    def append_clicks(self, clicks: Iterable[Dict[str, Any]]):
+        """Insert clicks in one transaction"""
+        rows = [
+            (
+                click["short_code"],
+                click["timestamp"].replace(tzinfo=timezone.utc).timestamp(),
+                click["browser"],
+                click["device"],
+                click.get("os", "Unknown"),
+                click["country"],
+                click["ip"],
+            )
+            for click in clicks
+        ]
+        connection = self._connection()
+        with connection:
+            connection.executemany(INSERT_CLICK, rows)
+
+    def click_counts(self, short_code: str, since: Optional[datetime] = None) -> Dict[str, Any]:
+        counts = empty_counts()
+        for day, browser, device, os, country, count in self._connection().execute(SELECT_CLICK_COUNTS, (short_code,)):
+            counts["total_clicks"] += count
+            counts["date"][day] += count
+            counts["browser"][browser] += count
+            counts["device"][device] += count
+            counts["os"][os] += count
+            counts["country"][country] += count
+        return counts
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
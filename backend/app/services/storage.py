@@ -0,0 +1,216 @@
+"""
+Storage backends for URLs and clicks
+
+``StorageBackend`` is the small set of operations the Flask app needs:
+store and fetch a URL, list the newest ones, append clicks and count them
+per short code. Implementations:
+
+- ``memory``: ``MemoryStore``, process-local and lost on restart
+- ``sqlite``: ``SQLiteStorage``, a durable single-file database
+- ``elasticsearch``: ``URLService``'s indices, click pipeline and rollups
+
+``ClickBuffer`` batches clicks in front of the memory and SQLite backends
+so a redirect does not pay for its own write (one SQLite transaction per
+click, say). The Elasticsearch backend queues them in its click pipeline,
+which batches on its own, so they go straight through.
+
+Click counts use the ``es_queries.analytics_counts`` form, so
+``es_queries.counts_to_fields`` turns any backend's counts into
+URLAnalytics fields.
+"""
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from elasticsearch import ConflictError
+from app.core.config import settings
+from app.services import es_queries
+from app.services.memory_store import MemoryStore, StoredURL
+from app.services.url_service import get_url_service
+
+class StorageBackend:
+    """Base class for URL and click storage"""
+
+    # Whether append_clicks queues and batches by itself
+    batches_clicks = False
+
+    def put_url(self, short_code: str, original_url: str, created_at: str) -> bool:
+        """Store a new URL; False if the short code is already taken"""
+        raise NotImplementedError
+
+    def get_url(self, short_code: str) -> Optional[StoredURL]:
+        raise NotImplementedError
+
+    def recent_urls(self, limit: int = 10) -> List[StoredURL]:
+        """Newest URLs first"""
+        raise NotImplementedError
+
+    def append_clicks(self, clicks: Iterable[Dict[str, Any]]):
+        """
+        Store click documents
+
+        Each click has short_code, timestamp (a naive UTC datetime),
+        browser, device, os, country, ip and the raw user_agent, which
+        only the Elasticsearch backend keeps.
+        """
+        raise NotImplementedError
+
+    def click_counts(self, short_code: str, since: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Clicks of a short code as total_clicks plus date, browser, device
+        and country Counters, and unique_visitors if the backend tracks them
+
+        ``since`` is a lower bound on click times that backends may use to
+        skip data; it does not filter the result.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+def empty_counts() -> Dict[str, Any]:
+    return {"total_clicks": 0, "date": Counter(), "browser": Counter(), "device": Counter(), "os": Counter(), "country": Counter()}
+
+class MemoryStorage(StorageBackend):
+    def __init__(self, store: Optional[MemoryStore] = None):
+        self.store = store if store is not None else MemoryStore()
+
+    def put_url(self, short_code: str, original_url: str, created_at: str) -> bool:
+        return self.store.add_url(short_code, original_url, created_at) is not None
+
+    def get_url(self, short_code: str) -> Optional[StoredURL]:
+        return self.store.get_url(short_code)
+
+    def recent_urls(self, limit: int = 10) -> List[StoredURL]:
+        return self.store.recent_urls(limit)
+
+    def append_clicks(self, clicks: Iterable[Dict[str, Any]]):
+        for click in clicks:
+            self.store.add_click(
+                click["short_code"],
+                browser=click["browser"],
+                device=click["device"],
+                os=click.get("os", "Unknown"),
+                country=click["country"],
+                ip=click["ip"],
+                timestamp=click["timestamp"].replace(tzinfo=timezone.utc).timestamp()
+            )
+
+    def click_counts(self, short_code: str, since: Optional[datetime] = None) -> Dict[str, Any]:
+        counts = self.store.click_counts(short_code)
+        counts["total_clicks"] = self.store.click_count(short_code)
+        return counts
+
+class ElasticsearchStorage(StorageBackend):
+    """Adapter over ``URLService``, keeping its cache, click pipeline and rollups"""
+
+    batches_clicks = True
+
+    def __init__(self, service=None):
+        self.service = service if service is not None else get_url_service()
+
+    def put_url(self, short_code: str, original_url: str, created_at: str) -> bool:
+        try:
+            self.service.es.create(
+                index=es_queries.URLS_INDEX,
+                id=short_code,
+                document=es_queries.url_document(original_url, short_code, created_at),
+                refresh=True
+            )
+            return True
+        except ConflictError:
+            return False
+
+    def get_url(self, short_code: str) -> Optional[StoredURL]:
+        url = self.service.get_url_by_short_code(short_code)
+        return _stored_url(url) if url else None
+
+    def recent_urls(self, limit: int = 10) -> List[StoredURL]:
+        return [_stored_url(url) for url in self.service.get_recent_urls(limit)]
+
+    def append_clicks(self, clicks: Iterable[Dict[str, Any]]):
+        for click in clicks:
+            self.service.click_pipeline.submit(click)
+
+    def click_counts(self, short_code: str, since: Optional[datetime] = None) -> Dict[str, Any]:
+        return self.service.get_click_counts(short_code, since=since, with_visitors=settings.VISITOR_SKETCHES_ENABLED)
+
+    def close(self):
+        self.service.click_pipeline.stop()
+
+class ClickBuffer:
+    """
+    Collects clicks and appends them to ``storage`` in batches of
+    ``batch_size``, or every ``flush_interval`` seconds when traffic is low
+
+    Buffered clicks are lost if the process dies before they are flushed.
+    A backend that ``batches_clicks`` gets each click right away instead.
+    """
+
+    def __init__(self, storage: StorageBackend, batch_size: int = 500, flush_interval: float = 1.0):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._clicks: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        # Serializes appends so batches reach storage in order
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if not storage.batches_clicks:
+            self._thread = threading.Thread(target=self._run, name="click-buffer", daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def from_settings(cls, storage: StorageBackend) -> "ClickBuffer":
+        return cls(storage, batch_size=settings.CLICK_BATCH_SIZE, flush_interval=settings.CLICK_FLUSH_INTERVAL)
+
+    def add(self, click: Dict[str, Any]):
+        if self._thread is None:
+            self.storage.append_clicks((click,))
+            return
+        with self._lock:
+            self._clicks.append(click)
+            full = len(self._clicks) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Append every buffered click"""
+        with self._flush_lock:
+            with self._lock:
+                clicks, self._clicks = self._clicks, []
+            if not clicks:
+                return
+            try:
+                self.storage.append_clicks(clicks)
+            except Exception as e:
+                print(f"Error storing {len(clicks)} clicks: {e}")
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+def _stored_url(url) -> StoredURL:
+    created_at = url.created_at
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return StoredURL(url.short_code, url.original_url, created_at.isoformat())
+
+def create_storage(backend: Optional[str] = None) -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND"""
+    backend = backend or settings.STORAGE_BACKEND
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        from app.services.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(settings.SQLITE_PATH)
+    if backend == "elasticsearch":
+        return ElasticsearchStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -1,302 +1,356 @@
+import threading
 import time
-from datetime import datetime
-from typing import List, Optional
-from nanoid import generate
-from elasticsearch import Elasticsearch
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from elasticsearch import ApiError, ConflictError, NotFoundError, TransportError
 from app.core.config import settings
-from app.models.url import URLCreate, URLResponse, URLAnalytics, ClickData, BrowserData, DeviceData, CountryData
+from app.core.elasticsearch import create_client
+from app.models.url import URLCreate, URLResponse, URLAnalytics, BulkURLError, HotLink, ClickPage
+from app.services import es_queries
+from app.services.click_pipeline import ClickPipeline
+from app.services.code_generator import create_code_generator
+from app.services.dedup import URLDeduplicator, url_hash
+from app.services.link_table import get_link_table
+from app.services.migrations import migrate
+from app.utils import metrics
+from app.utils.cache import LRUCache, MISSING
+
+class URLServiceBase:
+    """
+    Caches and response handling shared by ``URLService`` and
+    ``AsyncURLService``; subclasses only add the Elasticsearch calls
+    """
 
-class URLService:
     def __init__(self):
-        self.es = Elasticsearch([settings.ELASTICSEARCH_URL], api_key=settings.ELASTICSEARCH_API_KEY)
-        self._create_indices_if_not_exist()
-    
-    def _create_indices_if_not_exist(self):
-        print("Create required Elasticsearch indices if they don't exist")
-        # URLs index
-        if not self.es.indices.exists(index="urls"):
-            self.es.indices.create(
-                index="urls",
-                body={
-                    "mappings": {
-                        "properties": {
-                            "original_url": {"type": "keyword"},
-                            "short_code": {"type": "keyword"},
-                            "created_at": {"type": "date"}
-                        }
-                    }
-                }
-            )
-        
-        # Clicks index
-        if not self.es.indices.exists(index="clicks"):
-            self.es.indices.create(
-                index="clicks",
-                body={
-                    "mappings": {
-                        "properties": {
-                            "short_code": {"type": "keyword"},
-                            "timestamp": {"type": "date"},
-                            "browser": {"type": "keyword"},
-                            "device": {"type": "keyword"},
-                            "country": {"type": "keyword"},
-                            "ip": {"type": "ip"}
-                        }
-                    }
-                }
-            )
-    
-    def create_short_url(self, url_create: URLCreate) -> URLResponse:
-        print("Create a shortened URL")
-        # Generate a unique short code
-        short_code = generate(alphabet=settings.SHORT_URL_ALPHABET, size=settings.SHORT_URL_LENGTH)
-        
-        # Check if short code already exists (very unlikely but possible)
-        while self._short_code_exists(short_code):
-            short_code = generate(alphabet=settings.SHORT_URL_ALPHABET, size=settings.SHORT_URL_LENGTH)
-        
-        # Create timestamp
-        created_at = datetime.now(datetime.timezone.utc)
-
-        # Store in Elasticsearch
-        self.es.index(
-            index="urls",
-            id=short_code,
-            body={
-                "original_url": url_create.original_url,
-                "short_code": short_code,
-                "created_at": created_at
-            },
-            refresh=True
+        # Short code -> URLResponse; mappings never change once created. With
+        # a shared link table this only holds the codes the table lacks
+        self.link_table = get_link_table()
+        self.url_cache = LRUCache(
+            maxsize=settings.LINK_TABLE_DELTA_SIZE if self.link_table else settings.URL_CACHE_SIZE,
+            ttl=settings.URL_CACHE_TTL,
+            negative_ttl=settings.URL_CACHE_NEGATIVE_TTL
         )
-        
-        # Generate the full short URL
-        short_url = f"{settings.FRONTEND_BASE_URL}/{short_code}"
-        
-        return URLResponse(
+        self.stale_served = 0
+        self.dedup = URLDeduplicator.from_settings() if settings.DEDUP_ENABLED else None
+
+    def collect_metrics(self) -> List[metrics.Sample]:
+        """Cache counters for the metrics endpoint"""
+        samples = metrics.cache_samples("url", self.url_cache.hits, self.url_cache.misses, len(self.url_cache))
+        if self.dedup:
+            codes = self.dedup.codes
+            samples += metrics.cache_samples("dedup", codes.hits, codes.misses, len(codes))
+        samples.append(("url_cache_stale_served_total", "counter", "Expired URLs served while Elasticsearch was unavailable", {}, self.stale_served))
+        return samples
+
+    def _known_url(self, short_code: str) -> Any:
+        """The URL from the link table or cache, MISSING if known not to exist, None if unknown"""
+        if self.link_table is not None:
+            url = self.link_table.get_url(short_code)
+            if url is not None:
+                return url
+        return self.url_cache.get(short_code)
+
+    def _known_original_url(self, short_code: str) -> Any:
+        """Like ``_known_url``, but just the original URL, without building a URLResponse"""
+        if self.link_table is not None:
+            original_url = self.link_table.get_original_url(short_code)
+            if original_url is not None:
+                return original_url
+        url = self.url_cache.get(short_code)
+        return url if url is None or url is MISSING else url.original_url
+
+    def _url_from_result(self, short_code: str, result: Optional[Dict[str, Any]]) -> Optional[URLResponse]:
+        """Cache and return the URL of a get response (None if it was not found)"""
+        if result is not None and result["found"]:
+            url = es_queries.url_from_source(result["_source"])
+            self.url_cache.put(short_code, url)
+            return url
+        self.url_cache.put_missing(short_code)
+        return None
+
+    def _stale_url(self, short_code: str, error: Exception) -> Optional[URLResponse]:
+        """
+        Degraded cluster or open circuit breaker: an expired entry beats an
+        error, but a timeout must not pass for "not found"
+        """
+        stale = self.url_cache.get_stale(short_code)
+        if stale is None:
+            raise error
+        self.stale_served += 1
+        return None if stale is MISSING else stale
+
+    def _created_url(self, url_create: URLCreate, short_code: str, created_at: datetime) -> URLResponse:
+        url = URLResponse(
             original_url=url_create.original_url,
             short_code=short_code,
-            short_url=short_url,
+            short_url=es_queries.short_url_for(short_code),
             created_at=created_at
         )
-    
+
+        # Warm the cache so the first redirect doesn't hit Elasticsearch
+        self.url_cache.put(short_code, url)
+        return url
+
+    def _hot_links(self, limit: int) -> List[HotLink]:
+        """Top short codes by recent clicks, as seen by this worker"""
+        hot_links = self.click_pipeline.hot_links
+        if hot_links is None:
+            return []
+        return [HotLink(**link) for link in hot_links.top(limit)]
+
+    def _analytics(self, url: URLResponse, counts: Dict[str, Any], size: int) -> URLAnalytics:
+        fields = es_queries.counts_to_fields(counts, size)
+        fields["unique_visitors"] = counts.get("unique_visitors")
+        return URLAnalytics(
+            short_code=url.short_code,
+            original_url=url.original_url,
+            created_at=url.created_at,
+            **fields
+        )
+
+class URLService(URLServiceBase):
+    def __init__(self):
+        self.es = create_client()
+        super().__init__()
+        if settings.ELASTICSEARCH_MIGRATE_ON_STARTUP:
+            migrate(self.es)
+        self.code_generator = create_code_generator(self.es)
+        self.click_pipeline = ClickPipeline.from_settings(self.es)
+        self.click_pipeline.start()
+        metrics.REGISTRY.register_collector(self.collect_metrics)
+
+    def create_short_url(self, url_create: URLCreate) -> URLResponse:
+        print("Create a shortened URL")
+        if self.dedup:
+            key = url_hash(url_create.original_url)
+            existing = self._find_duplicate(key)
+            if existing:
+                return existing
+
+        # Create timestamp
+        created_at = datetime.now(timezone.utc)
+
+        # Store in Elasticsearch. op_type=create fails instead of overwriting,
+        # so a (rare) clash with an existing code just takes the next one.
+        while True:
+            short_code = self.code_generator.next_code()
+            try:
+                self.es.create(
+                    index=es_queries.URLS_INDEX,
+                    id=short_code,
+                    document=es_queries.url_document(url_create.original_url, short_code, created_at),
+                    refresh=True
+                )
+                break
+            except ConflictError:
+                continue
+
+        if self.dedup:
+            existing = self._claim_url_hash(key, short_code)
+            if existing:
+                return existing
+
+        return self._created_url(url_create, short_code, created_at)
+
+    def create_short_urls(self, url_creates: Iterable[URLCreate]) -> Iterator[Union[URLResponse, BulkURLError]]:
+        """
+        Shorten many URLs with bulk requests, yielding results chunk by chunk
+
+        Nothing is refreshed until the input is exhausted, so a whole load
+        costs a single refresh instead of one per URL.
+        """
+        chunk: List[URLCreate] = []
+        for url_create in url_creates:
+            chunk.append(url_create)
+            if len(chunk) >= settings.BULK_SHORTEN_CHUNK_SIZE:
+                yield from self._bulk_create(chunk)
+                chunk = []
+        if chunk:
+            yield from self._bulk_create(chunk)
+        self.es.indices.refresh(index=es_queries.URLS_INDEX)
+
     def get_url_by_short_code(self, short_code: str) -> Optional[URLResponse]:
         """Get URL details by short code"""
+        known = self._known_url(short_code)
+        if known is not None:
+            return None if known is MISSING else known
+
         try:
-            result = self.es.get(index="urls", id=short_code)
-            if result["found"]:
-                doc = result["_source"]
-                short_url = f"{settings.FRONTEND_BASE_URL}/{short_code}"
-                
-                return URLResponse(
-                    original_url=doc["original_url"],
-                    short_code=doc["short_code"],
-                    short_url=short_url,
-                    created_at=doc["created_at"]
-                )
-            return None
-        except:
-            return None
-    
+            return self._url_from_result(short_code, self.es.get(index=es_queries.URLS_INDEX, id=short_code))
+        except NotFoundError:
+            return self._url_from_result(short_code, None)
+        except (ApiError, TransportError) as e:
+            return self._stale_url(short_code, e)
+
     def get_recent_urls(self, limit: int = 10) -> List[URLResponse]:
         """Get recent shortened URLs"""
+        return self.get_recent_urls_page(limit)[0]
+
+    def get_recent_urls_page(self, limit: int = 10, cursor: Optional[str] = None) -> Tuple[List[URLResponse], Optional[str]]:
+        """
+        One page of shortened URLs, newest first
+
+        Returns the page and the cursor of the next one (None after the last
+        page). Raises ValueError for a malformed cursor.
+        """
+        search_after = es_queries.decode_cursor(cursor) if cursor else None
         result = self.es.search(
-            index="urls",
-            body={
-                "query": {"match_all": {}},
-                "sort": [{"created_at": {"order": "desc"}}],
-                "size": limit
-            }
-        )
-        
-        urls = []
-        for hit in result["hits"]["hits"]:
-            doc = hit["_source"]
-            short_code = doc["short_code"]
-            short_url = f"{settings.FRONTEND_BASE_URL}/{short_code}"
-            
-            urls.append(
-                URLResponse(
-                    original_url=doc["original_url"],
-                    short_code=short_code,
-                    short_url=short_url,
-                    created_at=doc["created_at"]
-                )
-            )
-        
-        return urls
-    
-    def record_click(self, short_code: str, browser: str, device: str, country: str, ip: str):
-        """Record a click on a shortened URL"""
-        self.es.index(
-            index="clicks",
-            body={
-                "short_code": short_code,
-                "timestamp": datetime.utcnow(),
-                "browser": browser,
-                "device": device,
-                "country": country,
-                "ip": ip
-            },
-            refresh=True
+            index=es_queries.URLS_INDEX,
+            **es_queries.recent_urls_query(limit, search_after)
         )
-    
-    def get_url_analytics(self, short_code: str) -> Optional[URLAnalytics]:
-        """Get analytics for a URL"""
+        return es_queries.recent_urls_page(result, limit)
+
+    def record_click(self, short_code: str, browser: str, device: str, country: str, ip: str, os: str = "Unknown", user_agent: Optional[str] = None) -> bool:
+        """
+        Queue a click on a shortened URL for batched indexing
+
+        ``user_agent`` is the raw header, stored so the click can be
+        re-classified later (see ``app.services.click_replay``).
+        """
+        return self.click_pipeline.submit(es_queries.click_document(short_code, browser, device, country, ip, os, user_agent))
+
+    def get_hot_links(self, limit: int = 10) -> List[HotLink]:
+        """Top short codes by recent clicks, as seen by this worker"""
+        return self._hot_links(limit)
+
+    def get_url_analytics(
+        self,
+        short_code: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        interval: str = "day",
+        size: int = 10
+    ) -> Optional[URLAnalytics]:
+        """
+        Get analytics for a URL
+
+        Only clicks in ``[start, end)`` are counted, bucketed by ``interval``
+        (hour, day or week) with the top ``size`` values per breakdown.
+        """
         # First check if URL exists
         url = self.get_url_by_short_code(short_code)
         if not url:
             return None
-        
-        # Get total clicks
-        total_clicks = self._get_total_clicks(short_code)
-        
-        # Get clicks by date
-        clicks_by_date = self._get_clicks_by_date(short_code)
-        
-        # Get clicks by browser
-        clicks_by_browser = self._get_clicks_by_browser(short_code)
-        
-        # Get clicks by device
-        clicks_by_device = self._get_clicks_by_device(short_code)
-        
-        # Get clicks by country
-        clicks_by_country = self._get_clicks_by_country(short_code)
-        
-        return URLAnalytics(
-            short_code=short_code,
-            original_url=url.original_url,
-            total_clicks=total_clicks,
-            created_at=url.created_at,
-            clicks_by_date=clicks_by_date,
-            clicks_by_browser=clicks_by_browser,
-            clicks_by_device=clicks_by_device,
-            clicks_by_country=clicks_by_country
-        )
-    
-    def _short_code_exists(self, short_code: str) -> bool:
-        """Check if a short code already exists"""
+
+        counts = self.get_click_counts(short_code, url.created_at, start, end, interval, size, settings.VISITOR_SKETCHES_ENABLED)
+        return self._analytics(url, counts, size)
+
+    def get_click_counts(
+        self,
+        short_code: str,
+        since: Optional[datetime] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        interval: str = "day",
+        size: int = 10,
+        with_visitors: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Click totals for a short code in the ``es_queries.analytics_counts`` form
+
+        ``since`` (the link's creation time) and the ``[start, end)`` window
+        limit the read to click partitions that can contain its clicks.
+        """
+        method, request = es_queries.click_counts_request(short_code, since, start, end, interval, size, with_visitors)
+        result = getattr(self.es, method)(**request)
+        return es_queries.click_counts(method, result, with_visitors)
+
+    def get_clicks_page(
+        self,
+        short_code: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Optional[ClickPage]:
+        """
+        One page of a URL's raw clicks in ``[start, end)``, oldest first
+
+        The first page opens a point in time over the click partitions so
+        later pages see the same snapshot; it is closed after the last page.
+        Raises ValueError for a malformed or expired cursor.
+        """
+        url = self.get_url_by_short_code(short_code)
+        if not url:
+            return None
+
+        if cursor:
+            pit_id, search_after = es_queries.clicks_page_cursor(cursor)
+        else:
+            pit_id = self.es.open_point_in_time(
+                index=es_queries.click_indices(es_queries.click_window_start(url.created_at, start), end),
+                keep_alive=es_queries.CLICKS_PIT_KEEP_ALIVE,
+                ignore_unavailable=True
+            )["id"]
+            search_after = None
+
         try:
-            result = self.es.get(index="urls", id=short_code, _source=False)
-            return result["found"]
-        except:
-            return False
-    
-    def _get_total_clicks(self, short_code: str) -> int:
-        """Get total clicks for a URL"""
-        result = self.es.count(
-            index="clicks",
-            body={"query": {"term": {"short_code": short_code}}}
-        )
-        return result["count"]
-    
-    def _get_clicks_by_date(self, short_code: str) -> List[ClickData]:
-        """Get clicks by date for a URL"""
-        result = self.es.search(
-            index="clicks",
-            body={
-                "size": 0,
-                "query": {"term": {"short_code": short_code}},
-                "aggs": {
-                    "clicks_by_date": {
-                        "date_histogram": {
-                            "field": "timestamp",
-                            "calendar_interval": "day",
-                            "format": "yyyy-MM-dd"
-                        }
-                    }
-                }
-            }
-        )
-        
-        clicks_by_date = []
-        for bucket in result["aggregations"]["clicks_by_date"]["buckets"]:
-            clicks_by_date.append(
-                ClickData(
-                    date=bucket["key_as_string"],
-                    count=bucket["doc_count"]
-                )
-            )
-        
-        return clicks_by_date
-    
-    def _get_clicks_by_browser(self, short_code: str) -> List[BrowserData]:
-        """Get clicks by browser for a URL"""
-        result = self.es.search(
-            index="clicks",
-            body={
-                "size": 0,
-                "query": {"term": {"short_code": short_code}},
-                "aggs": {
-                    "clicks_by_browser": {
-                        "terms": {"field": "browser", "size": 10}
-                    }
-                }
-            }
-        )
-        
-        clicks_by_browser = []
-        for bucket in result["aggregations"]["clicks_by_browser"]["buckets"]:
-            clicks_by_browser.append(
-                BrowserData(
-                    browser=bucket["key"],
-                    count=bucket["doc_count"]
-                )
-            )
-        
-        return clicks_by_browser
-    
-    def _get_clicks_by_device(self, short_code: str) -> List[DeviceData]:
-        """Get clicks by device for a URL"""
-        result = self.es.search(
-            index="clicks",
-            body={
-                "size": 0,
-                "query": {"term": {"short_code": short_code}},
-                "aggs": {
-                    "clicks_by_device": {
-                        "terms": {"field": "device", "size": 10}
-                    }
-                }
-            }
-        )
-        
-        clicks_by_device = []
-        for bucket in result["aggregations"]["clicks_by_device"]["buckets"]:
-            clicks_by_device.append(
-                DeviceData(
-                    device=bucket["key"],
-                    count=bucket["doc_count"]
-                )
-            )
-        
-        return clicks_by_device
-    
-    def _get_clicks_by_country(self, short_code: str) -> List[CountryData]:
-        """Get clicks by country for a URL"""
-        result = self.es.search(
-            index="clicks",
-            body={
-                "size": 0,
-                "query": {"term": {"short_code": short_code}},
-                "aggs": {
-                    "clicks_by_country": {
-                        "terms": {"field": "country", "size": 10}
-                    }
-                }
-            }
-        )
-        
-        clicks_by_country = []
-        for bucket in result["aggregations"]["clicks_by_country"]["buckets"]:
-            clicks_by_country.append(
-                CountryData(
-                    country=bucket["key"],
-                    count=bucket["doc_count"]
-                )
-            )
-        
-        return clicks_by_country
+            result = self.es.search(**es_queries.clicks_page_query(short_code, pit_id, limit, start, end, search_after))
+        except NotFoundError:
+            raise ValueError("Cursor has expired")
+        page, finished_pit = es_queries.clicks_page(result, pit_id, limit)
+        if finished_pit is not None:
+            self.es.close_point_in_time(id=finished_pit)
+        return page
+
+    def _bulk_create(self, chunk: List[URLCreate]) -> Iterator[Union[URLResponse, BulkURLError]]:
+        created_at = datetime.now(timezone.utc)
+        while chunk:
+            codes = self.code_generator.next_codes(len(chunk))
+            response = self.es.bulk(operations=es_queries.bulk_create_operations(codes, chunk, created_at))
+            results, chunk = es_queries.parse_bulk_create(codes, chunk, response, created_at)
+            yield from results
+
+    def _find_duplicate(self, key: str) -> Optional[URLResponse]:
+        """Existing URL for a URL hash, reading url_hashes unless this worker knows its code"""
+        short_code = self.dedup.cached_code(key)
+        if short_code is None:
+            try:
+                result = self.es.get(index=es_queries.URL_HASHES_INDEX, id=key)
+            except NotFoundError:
+                return None
+            short_code = result["_source"]["short_code"]
+
+        url = self.get_url_by_short_code(short_code)
+        if url:
+            self.dedup.remember(key, short_code)
+        return url
+
+    def _claim_url_hash(self, key: str, short_code: str) -> Optional[URLResponse]:
+        """
+        Point a URL hash at a newly created code
+
+        Returns the existing URL instead if another request shortened the
+        same URL first; the code created by this request is then deleted.
+        """
+        try:
+            self.es.create(index=es_queries.URL_HASHES_INDEX, id=key, document={"short_code": short_code})
+            self.dedup.remember(key, short_code)
+            return None
+        except ConflictError:
+            pass
+
+        result = self.es.get(index=es_queries.URL_HASHES_INDEX, id=key)
+        existing_code = result["_source"]["short_code"]
+        existing = self.get_url_by_short_code(existing_code)
+        if existing:
+            self.es.delete(index=es_queries.URLS_INDEX, id=short_code, refresh=True)
+            self.dedup.remember(key, existing_code)
+            return existing
+
+        # The hash points at a code that no longer exists: take it over
+        self.es.index(index=es_queries.URL_HASHES_INDEX, id=key, document={"short_code": short_code})
+        self.dedup.remember(key, short_code)
+        return None
+
+_url_service: Optional[URLService] = None
+_url_service_lock = threading.Lock()
 
-# Create a singleton instance
-url_service = URLService()
+def get_url_service() -> URLService:
+    """The process-wide URLService, created on first use"""
+    global _url_service
+    if _url_service is None:
+        with _url_service_lock:
+            if _url_service is None:
+                _url_service = URLService()
+    return _url_service
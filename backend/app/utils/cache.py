@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+# Sentinel stored for keys that are known not to exist (negative caching)
+MISSING = object()
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU cache with per-entry TTL
+
+    Entries are evicted least-recently-used first once ``maxsize`` is reached.
+    Negative results can be cached with ``put_missing`` and use their own
+    (usually shorter) TTL so newly created keys become visible quickly.
+    Expired entries stay until they are replaced or evicted, so
+    ``get_stale`` can still return them while the source is unavailable.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0, negative_ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Look up a key
+
+        Returns:
+            The cached value, ``MISSING`` for a cached negative result,
+            or ``None`` if the key is not cached (or has expired)
+        """
+        if self.maxsize <= 0:
+            self.misses += 1
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key: Hashable) -> Any:
+        """Like ``get``, but also returns expired entries; not counted as a hit or miss"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[0] if entry is not None else None
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value for a key"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def put_missing(self, key: Hashable):
+        """Remember that a key does not exist"""
+        self.put(key, MISSING, ttl=self.negative_ttl)
+
+    def invalidate(self, key: Hashable):
+        """Drop a single key"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Return hit/miss/eviction counters"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
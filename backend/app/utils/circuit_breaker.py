@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import List
+from app.utils.metrics import Sample
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    ``allow`` refuses every call for ``reset_timeout`` seconds, so callers
+    fail fast instead of queueing on a dead dependency. Then a single trial
+    call is let through (half open): success closes the circuit, failure
+    opens it for another ``reset_timeout``. A trial that never reports, or
+    is given back with ``release``, is replaced by the next call after
+    ``reset_timeout`` or right away respectively.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; every allowed call must be followed by ``record`` or ``release``"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            # Open for long enough, or the half-open trial is overdue
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._opened_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """Give back an allowed call that ended without an outcome, e.g. because it was cancelled"""
+        if self.state != HALF_OPEN:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # The next call becomes the trial
+                self._opened_at = float("-inf")
+
+    def record(self, failed: bool):
+        """Report the outcome of an allowed call"""
+        if not failed and self.state == CLOSED and not self._failures:
+            return
+        with self._lock:
+            if not failed:
+                self._failures = 0
+                self.state = CLOSED
+                return
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                    print(f"Circuit breaker {self.name} opened after {self._failures} failures")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def collect_metrics(self) -> List[Sample]:
+        labels = {"breaker": self.name}
+        samples = [
+            ("circuit_breaker_state", "gauge", "1 for the current state of each circuit breaker",
+             dict(labels, state=state), 1 if self.state == state else 0)
+            for state in (CLOSED, OPEN, HALF_OPEN)
+        ]
+        samples.append(("circuit_breaker_opened_total", "counter", "Times the circuit opened", labels, self.opened))
+        samples.append(("circuit_breaker_rejected_total", "counter", "Calls refused while the circuit was open", labels, self.rejected))
+        return samples
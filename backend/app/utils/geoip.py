@@ -0,0 +1,333 @@
+"""
+Offline IP to country lookups
+
+Ranges come from a CSV of ``start,end,country`` rows (IP strings, or
+integers as in IP2Location-style files), or from the compiled form of one
+written by ``compile_database``. Either way they end up as sorted,
+array-backed columns searched with ``bisect``, so a lookup is a binary
+search over machine integers and never touches the network. IPv4
+addresses whose 1024-address block lies inside a single range are
+answered from a per-block country table without searching at all; for the
+rest, a table of where each leading 16-bit prefix starts narrows the
+search to the few ranges sharing it.
+
+Compiled databases are memory-mapped rather than read: opening one only
+maps the file and checks its header, and every worker that opens the same
+file shares its pages.
+"""
+import bisect
+import csv
+import mmap
+import socket
+import struct
+import sys
+import threading
+from array import array
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.utils import metrics
+
+UNKNOWN = "Unknown"
+
+MAGIC = b"URLGEO2\0"
+# magic, byte order (0 little / 1 big), countries blob length, IPv4 ranges, IPv6 ranges
+_HEADER = struct.Struct("<8sB3xIII")
+
+_MASK64 = (1 << 64) - 1
+_V4_MAPPED = 0xFFFF << 32
+
+# Leading address bits used to bucket each family's ranges
+_PREFIX_BITS = 16
+_V4_SHIFT = 32 - _PREFIX_BITS
+_V6_SHIFT = 128 - _PREFIX_BITS
+_V6_HIGH_SHIFT = 64 - _PREFIX_BITS
+_PREFIX_COUNT = 1 << _PREFIX_BITS
+
+# IPv4 blocks of 1024 addresses answered straight from a country table
+# (8 MB); besides country ids its entries say the block needs the bisect,
+# or that no range touches it
+_DIRECT_BITS = 22
+_DIRECT_SHIFT = 32 - _DIRECT_BITS
+_MIXED = 0xFFFF
+_UNCOVERED = 0xFFFE
+
+# Bound once: lookups run per click
+_inet_aton = socket.inet_aton
+_inet_pton = socket.inet_pton
+_AF_INET6 = socket.AF_INET6
+_unpack_v6 = struct.Struct(">QQ").unpack
+_from_bytes = int.from_bytes
+
+class _WideColumn:
+    """Read-only sequence of 128-bit integers stored as high and low 64-bit halves"""
+
+    __slots__ = ("hi", "lo")
+
+    def __init__(self, hi, lo):
+        self.hi = hi
+        self.lo = lo
+
+    def __len__(self) -> int:
+        return len(self.hi)
+
+    def __getitem__(self, i: int) -> int:
+        return (self.hi[i] << 64) | self.lo[i]
+
+def _parse_address(value: str) -> Tuple[int, int]:
+    """(version, integer) for an IP string or integer string"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number <= 0xFFFFFFFF else 6), number
+    if ":" in value:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, value), "big")
+    return 4, int.from_bytes(socket.inet_aton(value), "big")
+
+def read_ranges(rows: Iterable[List[str]]) -> Iterator[Tuple[int, int, int, str]]:
+    """(version, start, end, country) for every usable CSV row; headers and junk are skipped"""
+    for row in rows:
+        if len(row) < 3:
+            continue
+        try:
+            start_version, start = _parse_address(row[0])
+            end_version, end = _parse_address(row[1])
+        except (OSError, ValueError):
+            continue
+        country = row[2].strip()
+        if not country or country == "-" or country == "ZZ":
+            continue
+        if start_version != end_version:
+            # Integer IPv6 rows whose start falls below 2**32
+            start_version = 6
+        if start_version == 6 and start & ~0xFFFFFFFF == _V4_MAPPED and end & ~0xFFFFFFFF == _V4_MAPPED:
+            # ::ffff:a.b.c.d ranges are IPv4 ranges in IPv6 files
+            start_version, start, end = 4, start & 0xFFFFFFFF, end & 0xFFFFFFFF
+        yield start_version, start, end, country
+
+class GeoIPDatabase:
+    """
+    Sorted IP ranges with their country codes
+
+    Each address family keeps parallel ``starts``/``ends``/``country``
+    columns; ``country`` indexes into ``countries``, ``prefixes[p]`` is
+    the first range starting at or after leading bits ``p``, and
+    ``v4_direct[b]`` is the country id of the one range covering all of
+    IPv4 block ``b`` (or ``_MIXED``/``_UNCOVERED``). Ranges must not
+    overlap.
+    """
+
+    def __init__(self, countries: List[str], v4_starts, v4_ends, v4_country, v4_prefixes, v4_direct,
+                 v6_starts, v6_ends, v6_country, v6_prefixes, source=None):
+        self.countries = countries
+        self.v4_starts = v4_starts
+        self.v4_ends = v4_ends
+        self.v4_country = v4_country
+        self.v4_prefixes = v4_prefixes
+        self.v4_direct = v4_direct
+        self.v6_starts = v6_starts
+        self.v6_ends = v6_ends
+        self.v6_country = v6_country
+        self.v6_prefixes = v6_prefixes
+        self._source = source
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int, int, str]]) -> "GeoIPDatabase":
+        countries: List[str] = []
+        country_ids = {}
+        v4, v6 = [], []
+        for version, start, end, country in ranges:
+            if country not in country_ids:
+                country_ids[country] = len(countries)
+                countries.append(country)
+            (v4 if version == 4 else v6).append((start, end, country_ids[country]))
+        v4.sort()
+        v6.sort()
+        return cls(
+            countries,
+            array("I", (r[0] for r in v4)), array("I", (r[1] for r in v4)), array("H", (r[2] for r in v4)),
+            _prefix_table([r[0] >> _V4_SHIFT for r in v4]), _direct_table(v4),
+            _WideColumn(array("Q", (r[0] >> 64 for r in v6)), array("Q", (r[0] & _MASK64 for r in v6))),
+            _WideColumn(array("Q", (r[1] >> 64 for r in v6)), array("Q", (r[1] & _MASK64 for r in v6))),
+            array("H", (r[2] for r in v6)),
+            _prefix_table([r[0] >> _V6_SHIFT for r in v6]),
+        )
+
+    @classmethod
+    def from_csv(cls, path: str) -> "GeoIPDatabase":
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls.from_ranges(read_ranges(csv.reader(f)))
+
+    @classmethod
+    def open(cls, path: str) -> "GeoIPDatabase":
+        """Load a .csv range file, or memory-map a compiled database"""
+        if path.endswith(".csv"):
+            return cls.from_csv(path)
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls._from_buffer(buffer)
+
+    @classmethod
+    def _from_buffer(cls, buffer) -> "GeoIPDatabase":
+        magic, byteorder, countries_size, v4_count, v6_count = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a compiled GeoIP database of this version (rebuild it with build-geoip)")
+        native = byteorder == (0 if sys.byteorder == "little" else 1)
+
+        view = memoryview(buffer)
+        offset = _HEADER.size
+        countries = bytes(view[offset:offset + countries_size]).decode("utf-8").split("\n") if countries_size else []
+        offset = _align(offset + countries_size)
+
+        def column(typecode: str, count: int):
+            nonlocal offset
+            size = array(typecode).itemsize * count
+            section = view[offset:offset + size]
+            offset = _align(offset + size)
+            if native:
+                return section.cast(typecode)
+            # Built on a machine of the other byte order: copy and swap once
+            values = array(typecode, section.tobytes())
+            values.byteswap()
+            return values
+
+        v4_starts, v4_ends, v4_country = column("I", v4_count), column("I", v4_count), column("H", v4_count)
+        v4_prefixes, v4_direct = column("I", _PREFIX_COUNT + 1), column("H", 1 << _DIRECT_BITS)
+        v6_starts = _WideColumn(column("Q", v6_count), column("Q", v6_count))
+        v6_ends = _WideColumn(column("Q", v6_count), column("Q", v6_count))
+        v6_country, v6_prefixes = column("H", v6_count), column("I", _PREFIX_COUNT + 1)
+        return cls(countries, v4_starts, v4_ends, v4_country, v4_prefixes, v4_direct,
+                   v6_starts, v6_ends, v6_country, v6_prefixes, source=buffer)
+
+    def write(self, path: str):
+        """Write the compiled form read by ``open``"""
+        countries = "\n".join(self.countries).encode("utf-8")
+        v4_count, v6_count = len(self.v4_starts), len(self.v6_starts)
+        sections = [
+            self.v4_starts, self.v4_ends, self.v4_country, self.v4_prefixes, self.v4_direct,
+            self.v6_starts.hi, self.v6_starts.lo, self.v6_ends.hi, self.v6_ends.lo, self.v6_country, self.v6_prefixes,
+        ]
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, 0 if sys.byteorder == "little" else 1, len(countries), v4_count, v6_count))
+            f.write(countries)
+            _pad(f)
+            for section in sections:
+                f.write(section)
+                _pad(f)
+
+    def __len__(self) -> int:
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    def lookup(self, ip: str) -> str:
+        """Country code for an IP address string, or "Unknown" """
+        try:
+            if ":" not in ip:
+                number = _from_bytes(_inet_aton(ip), "big")
+            else:
+                high, low = _unpack_v6(_inet_pton(_AF_INET6, ip))
+                if high or low >> 32 != 0xFFFF:
+                    # Search the high halves natively; ranges starting in the
+                    # same /64 are then ordered by their low halves
+                    starts, prefix = self.v6_starts, high >> _V6_HIGH_SHIFT
+                    first = self.v6_prefixes[prefix]
+                    i = bisect.bisect_right(starts.hi, high, first, self.v6_prefixes[prefix + 1]) - 1
+                    while i >= first and starts.hi[i] == high and starts.lo[i] > low:
+                        i -= 1
+                    if i < 0:
+                        return UNKNOWN
+                    ends = self.v6_ends
+                    if high > ends.hi[i] or (high == ends.hi[i] and low > ends.lo[i]):
+                        return UNKNOWN
+                    return self.countries[self.v6_country[i]]
+                number = low & 0xFFFFFFFF
+        except (OSError, ValueError):
+            return UNKNOWN
+        country = self.v4_direct[number >> _DIRECT_SHIFT]
+        if country < _UNCOVERED:
+            return self.countries[country]
+        if country == _UNCOVERED:
+            return UNKNOWN
+        prefix = number >> _V4_SHIFT
+        # Ranges before the bucket start below number; the last of them may still cover it
+        i = bisect.bisect_right(self.v4_starts, number, self.v4_prefixes[prefix], self.v4_prefixes[prefix + 1]) - 1
+        if i < 0 or number > self.v4_ends[i]:
+            return UNKNOWN
+        return self.countries[self.v4_country[i]]
+
+def _prefix_table(prefixes: List[int]) -> array:
+    """Index of the first entry of sorted ``prefixes`` at or after each prefix value"""
+    return array("I", (bisect.bisect_left(prefixes, p) for p in range(_PREFIX_COUNT + 1)))
+
+def _direct_table(ranges: List[Tuple[int, int, int]]) -> array:
+    """Country id per IPv4 block for blocks inside one range; _MIXED or _UNCOVERED otherwise"""
+    table = array("H", [_UNCOVERED]) * (1 << _DIRECT_BITS)
+    for start, end, country in ranges:
+        first, last = start >> _DIRECT_SHIFT, end >> _DIRECT_SHIFT
+        # Blocks the range only partly covers
+        if start & ((1 << _DIRECT_SHIFT) - 1):
+            table[first] = _MIXED
+            first += 1
+        if (end + 1) & ((1 << _DIRECT_SHIFT) - 1):
+            table[last] = _MIXED
+            last -= 1
+        if first <= last:
+            table[first:last + 1] = array("H", [country]) * (last + 1 - first)
+    return table
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def _pad(f):
+    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+
+def compile_database(csv_path: str, output_path: str) -> GeoIPDatabase:
+    """Compile a range CSV into the memory-mappable form"""
+    database = GeoIPDatabase.from_csv(csv_path)
+    database.write(output_path)
+    return database
+
+_database: Optional[GeoIPDatabase] = None
+# Set once opening the database was attempted, whether or not it worked, so
+# a broken file is reported once and lookups then answer "Unknown"
+_database_opened = False
+_database_lock = threading.Lock()
+
+def get_database() -> Optional[GeoIPDatabase]:
+    """The database at GEOIP_DATABASE_PATH, opened on first use; None if not configured or unreadable"""
+    global _database, _database_opened
+    if not _database_opened:
+        with _database_lock:
+            if not _database_opened:
+                if settings.GEOIP_DATABASE_PATH:
+                    try:
+                        _database = GeoIPDatabase.open(settings.GEOIP_DATABASE_PATH)
+                    except (OSError, ValueError) as e:
+                        print(f"Error loading GeoIP database {settings.GEOIP_DATABASE_PATH}: {e}; countries will be Unknown")
+                _database_opened = True
+    return _database
+
+@lru_cache(maxsize=settings.GEOIP_CACHE_SIZE)
+def _lookup_country(ip: str) -> str:
+    database = get_database()
+    return database.lookup(ip) if database is not None else UNKNOWN
+
+def _cache_metrics():
+    info = _lookup_country.cache_info()
+    return metrics.cache_samples("geoip", info.hits, info.misses, info.currsize)
+
+metrics.REGISTRY.register_collector(_cache_metrics)
+
+def lookup_country(ip: Optional[str]) -> str:
+    """
+    Country code for a client IP
+
+    Args:
+        ip: The client IP address, IPv4 or IPv6
+
+    Returns:
+        The country code from the configured database, or "Unknown" if the
+        IP is not covered or no database is configured
+    """
+    if not ip:
+        return UNKNOWN
+    return _lookup_country(ip)
@@ -0,0 +1,76 @@
+import heapq
+import threading
+from typing import Dict, Hashable, List, Tuple
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitter sketch over at most ``capacity`` keys
+
+    Every key whose true count exceeds total / capacity is tracked. A
+    tracked key's estimate is never below its true count and exceeds it by
+    at most its ``error`` (the count of the key it evicted), so
+    ``count - error`` is a guaranteed lower bound.
+
+    ``decay`` halves every count so the sketch follows current traffic
+    rather than all-time totals.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.total = 0
+        self._counts: Dict[Hashable, List[int]] = {}  # key -> [count, error]
+        # Min-heap of (count, key) with one entry per tracked key. Counts only
+        # grow between rebuilds, so an entry may be low but never high; it
+        # is corrected when it reaches the top during an eviction.
+        self._heap: List[Tuple[int, Hashable]] = []
+        self._lock = threading.Lock()
+
+    def offer(self, key: Hashable, count: int = 1) -> int:
+        """Count ``key``; returns its guaranteed count (estimate minus error)"""
+        with self._lock:
+            self.total += count
+            entry = self._counts.get(key)
+            if entry is None:
+                error = 0
+                if len(self._counts) >= self.capacity:
+                    error = self._evict_min()
+                entry = self._counts[key] = [error, error]
+                heapq.heappush(self._heap, (error + count, key))
+            entry[0] += count
+            return entry[0] - entry[1]
+
+    def _evict_min(self) -> int:
+        while True:
+            count, key = self._heap[0]
+            current = self._counts[key][0]
+            if current == count:
+                heapq.heappop(self._heap)
+                del self._counts[key]
+                return count
+            heapq.heapreplace(self._heap, (current, key))
+
+    def _rebuild_heap(self):
+        self._heap = [(entry[0], key) for key, entry in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def guaranteed(self, key: Hashable) -> int:
+        entry = self._counts.get(key)
+        return entry[0] - entry[1] if entry else 0
+
+    def top(self, n: int = 10) -> List[Tuple[Hashable, int, int]]:
+        """The ``n`` highest (key, estimated count, error) entries"""
+        with self._lock:
+            items = [(key, entry[0], entry[1]) for key, entry in self._counts.items()]
+        return heapq.nlargest(n, items, key=lambda item: item[1])
+
+    def decay(self, factor: float = 0.5):
+        """Scale every count down, forgetting keys that reach zero"""
+        with self._lock:
+            self.total = int(self.total * factor)
+            for key in list(self._counts):
+                entry = self._counts[key]
+                entry[0] = int(entry[0] * factor)
+                entry[1] = int(entry[1] * factor)
+                if entry[0] == 0:
+                    del self._counts[key]
+            self._rebuild_heap()
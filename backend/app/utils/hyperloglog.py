@@ -0,0 +1,180 @@
+"""
+HyperLogLog distinct-value sketch
+
+A sketch of precision ``p`` has ``m = 2 ** p`` one-byte registers and
+estimates the number of distinct values added to it with a standard error
+of about ``1.04 / sqrt(m)`` (1.6% at the default p = 12), however many
+values that is. Sketches of the same precision merge losslessly (register
+by register maximum), and merging is idempotent, so the same values can be
+merged in twice without changing the estimate.
+
+Until a sketch has ``m / 8`` non-zero registers it keeps them in a dict
+(sparse) rather than in ``m`` bytes, so sketches of rarely seen keys stay
+small in memory and when serialized.
+"""
+import hashlib
+import math
+import struct
+from typing import Dict, Optional
+
+DEFAULT_PRECISION = 12
+
+_SPARSE = 0
+_DENSE = 1
+_HEADER = struct.Struct("<BB")  # format, precision
+_SPARSE_ENTRY = struct.Struct("<HB")  # register index, value
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+def _bytewise_max(a: bytes, b: bytes) -> bytearray:
+    """
+    Byte-by-byte maximum of two equal-length register arrays
+
+    Done with big-int arithmetic over whole arrays, which is far faster than
+    a Python loop. Register values stay below 128, so setting the top bit of
+    every byte of ``a`` before subtracting ``b`` never borrows across bytes,
+    and the top bit is left set exactly where ``a >= b``.
+    """
+    length = len(a)
+    high = int.from_bytes(b"\x80" * length, "little")
+    x = int.from_bytes(a, "little")
+    y = int.from_bytes(b, "little")
+    a_wins = (((x | high) - y) & high) >> 7
+    mask = a_wins * 0xFF
+    return bytearray(((x & mask) | (y & ~mask)).to_bytes(length, "little"))
+
+def _sigma(x: float) -> float:
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+def _tau(x: float) -> float:
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+class HyperLogLog:
+    """Mergeable approximate distinct counter"""
+
+    __slots__ = ("precision", "_sparse", "_registers")
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self._sparse: Optional[Dict[int, int]] = {}
+        self._registers: Optional[bytearray] = None
+
+    @property
+    def size(self) -> int:
+        """Number of registers"""
+        return 1 << self.precision
+
+    @property
+    def error_rate(self) -> float:
+        """Relative standard error of ``count``"""
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value: str):
+        x = _hash64(value)
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        self._set(index, rank)
+
+    def _set(self, index: int, rank: int):
+        if self._registers is not None:
+            if rank > self._registers[index]:
+                self._registers[index] = rank
+            return
+        if rank > self._sparse.get(index, 0):
+            self._sparse[index] = rank
+            if len(self._sparse) > self.size // 8:
+                self._densify()
+
+    def _densify(self):
+        registers = bytearray(self.size)
+        for index, rank in self._sparse.items():
+            registers[index] = rank
+        self._registers, self._sparse = registers, None
+
+    def merge(self, other: "HyperLogLog"):
+        """Fold ``other`` into this sketch"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        if other._registers is None:
+            for index, rank in other._sparse.items():
+                self._set(index, rank)
+            return
+        if self._registers is None:
+            self._densify()
+        self._registers = _bytewise_max(self._registers, other._registers)
+
+    def count(self) -> int:
+        """
+        Estimated number of distinct values added
+
+        Uses Ertl's improved estimator ("New cardinality estimation
+        algorithms for HyperLogLog sketches", 2017), which stays unbiased
+        across the whole range without empirical correction tables.
+        """
+        m = self.size
+        q = 64 - self.precision
+        histogram = [0] * (q + 2)
+        if self._registers is None:
+            histogram[0] = m - len(self._sparse)
+            for rank in self._sparse.values():
+                histogram[rank] += 1
+        else:
+            registers = bytes(self._registers)
+            counted = 0
+            # Stop once every register is counted; high ranks are rare
+            for rank in range(q + 2):
+                histogram[rank] = registers.count(rank)
+                counted += histogram[rank]
+                if counted == m:
+                    break
+        z = m * _tau(1 - histogram[q + 1] / m)
+        for rank in range(q, 0, -1):
+            z = 0.5 * (z + histogram[rank])
+        z += m * _sigma(histogram[0] / m)
+        return int(round(m * m / (2 * math.log(2) * z)))
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def to_bytes(self) -> bytes:
+        if self._registers is not None:
+            return _HEADER.pack(_DENSE, self.precision) + bytes(self._registers)
+        return _HEADER.pack(_SPARSE, self.precision) + b"".join(
+            _SPARSE_ENTRY.pack(index, rank) for index, rank in sorted(self._sparse.items())
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        form, precision = _HEADER.unpack_from(data, 0)
+        sketch = cls(precision)
+        if form == _DENSE:
+            registers = bytearray(data[_HEADER.size:])
+            if len(registers) != sketch.size:
+                raise ValueError("Truncated HyperLogLog sketch")
+            sketch._registers, sketch._sparse = registers, None
+        else:
+            for index, rank in _SPARSE_ENTRY.iter_unpack(data[_HEADER.size:]):
+                sketch._sparse[index] = rank
+        return sketch
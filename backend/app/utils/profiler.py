@@ -0,0 +1,101 @@
+"""
+Sampling profiler that can be switched on and off in a running process
+
+A background thread wakes every ``interval`` seconds, reads the current
+stack of every other thread with ``sys._current_frames`` and counts each
+distinct stack. Nothing is traced between samples, so the cost is one
+stack walk per thread per interval and it is safe to leave running for a
+while in production. Results are collapsed stacks (``a;b;c 42`` lines),
+the input format of flamegraph.pl and speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: "Counter[str]" = Counter()
+        self.started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None, reset: bool = True):
+        """Start sampling; a no-op if already running"""
+        if self.running:
+            return
+        if interval:
+            self.interval = interval
+        if reset:
+            with self._lock:
+                self.samples.clear()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling, keeping the samples collected so far"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stacks.append(self._collapse(frame))
+            with self._lock:
+                self.samples.update(stacks)
+
+    def _collapse(self, frame) -> str:
+        names: List[str] = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+    def collapsed(self) -> str:
+        """Samples as collapsed stacks, most frequent first"""
+        with self._lock:
+            items = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def top(self, n: int = 20) -> List[Tuple[str, int, int]]:
+        """The ``n`` functions seen most often as (function, self, total) samples"""
+        own: "Counter[str]" = Counter()
+        total: "Counter[str]" = Counter()
+        with self._lock:
+            items = list(self.samples.items())
+        for stack, count in items:
+            names = stack.split(";")
+            own[names[-1]] += count
+            for name in set(names):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(n)]
+
+_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+def get_profiler() -> SamplingProfiler:
+    """The process-wide profiler, created stopped on first use"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = SamplingProfiler()
+    return _profiler
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import heapq
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Tuple
+from app.utils.cache import LRUCache
+
+class CachedResponse:
+    """
+    Serialized JSON body of a response plus its validators
+
+    ``modified_at`` is when the data behind the body last changed (epoch
+    seconds), e.g. the newest click counted; it defaults to, and is never
+    later than, the time the response is built.
+    """
+
+    __slots__ = ("body", "etag", "last_modified", "modified_at", "headers")
+
+    def __init__(self, body: bytes, headers: Optional[Dict[str, str]] = None, modified_at: Optional[float] = None):
+        self.body = body
+        # Content hash, so a rebuild that produces the same body keeps its ETag
+        self.etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        now = time.time()
+        self.modified_at = int(min(modified_at, now) if modified_at is not None else now)
+        self.last_modified = formatdate(self.modified_at, usegmt=True)
+        self.headers = headers or {}
+
+    def not_modified(self, request_headers: Mapping[str, str]) -> bool:
+        """Whether a conditional request can be answered with 304"""
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or any(tag.replace("W/", "", 1) == self.etag for tag in tags)
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return self.modified_at <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+Builder = Callable[[], Awaitable[Optional[Tuple[bytes, Dict[str, str], Optional[float]]]]]
+
+class ResponseCache:
+    """
+    Short-TTL cache of serialized responses with tag invalidation
+
+    Every entry belongs to a tag (e.g. ``analytics:<code>``) and remembers
+    the tag's generation when it was built. ``invalidate`` only bumps the
+    generation, so a burst of invalidations costs a counter increment each
+    and at most one rebuild, on the next read. An invalidation can also be
+    scheduled ``delay`` seconds ahead, for writes that only become visible
+    to the builder later (Elasticsearch's refresh); it is applied by the
+    first read after it is due.
+
+    Concurrent misses on one key share a single build: the first caller
+    starts it and everyone awaits the same task, so a popular page that
+    expires triggers one backend query rather than one per request.
+
+    When a build raises an error ``stale_if_error`` accepts, the last
+    response built for the key is served instead, however old.
+
+    Generations live in this process only: an invalidation in one worker
+    does not reach the others, which keep serving what they built for up
+    to ``ttl`` seconds. The TTL is therefore the staleness bound across
+    workers and should stay short.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5.0,
+                 stale_if_error: Optional[Callable[[Exception], bool]] = None):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl, negative_ttl=0)
+        self.stale_if_error = stale_if_error
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, "asyncio.Task"] = {}
+        # (due time, tag) heap of scheduled invalidations
+        self._scheduled: List[Tuple[float, str]] = []
+
+        # Metrics; hits only count fresh entries, unlike entries.hits
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self.stale_served = 0
+
+    def invalidate(self, tag: str, delay: float = 0.0):
+        """
+        Mark every entry of ``tag`` stale, now or once ``delay`` seconds
+        have passed; safe to call from any thread
+        """
+        if delay <= 0:
+            with self._lock:
+                self._bump(tag)
+            return
+        # Applying the due ones here too bounds the heap when nothing is read
+        now = self._apply_scheduled()
+        with self._lock:
+            heapq.heappush(self._scheduled, (now + delay, tag))
+
+    def _bump(self, tag: str):
+        # Called with the lock held
+        self._generations[tag] = self._generations.get(tag, 0) + 1
+        self.invalidations += 1
+
+    def _apply_scheduled(self) -> float:
+        """Apply the scheduled invalidations that are due; returns the time it checked against"""
+        now = time.monotonic()
+        if self._scheduled and self._scheduled[0][0] <= now:
+            with self._lock:
+                while self._scheduled and self._scheduled[0][0] <= now:
+                    self._bump(heapq.heappop(self._scheduled)[1])
+        return now
+
+    def _generation(self, tag: str) -> int:
+        return self._generations.get(tag, 0)
+
+    async def get_or_build(self, key: Hashable, tag: str, build: Builder) -> Optional[CachedResponse]:
+        """
+        The cached response for ``key``, building it on a miss
+
+        ``build`` returns the body, any extra headers and when its data
+        last changed (None for now), or None for a result that should not
+        be cached (e.g. not found).
+        """
+        if self._scheduled:
+            self._apply_scheduled()
+        cached = self.entries.get(key)
+        if cached is not None:
+            generation, response = cached
+            if generation == self._generation(tag):
+                self.hits += 1
+                return response
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._build(key, tag, build))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one caller disconnecting does not cancel the others' build
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            stale = self.entries.get_stale(key)
+            if stale is None or self.stale_if_error is None or not self.stale_if_error(e):
+                raise
+            self.stale_served += 1
+            return stale[1]
+
+    async def _build(self, key: Hashable, tag: str, build: Builder) -> Optional[CachedResponse]:
+        generation = self._generation(tag)
+        self.builds += 1
+        result = await build()
+        if result is None:
+            return None
+        response = CachedResponse(*result)
+        # Stored under the generation seen before building: an invalidation
+        # that raced the build leaves the entry already stale
+        self.entries.put(key, (generation, response))
+        return response
+
+    def stats(self) -> dict:
+        stats = self.entries.stats()
+        stats.update(hits=self.hits, misses=self.misses, builds=self.builds, coalesced=self.coalesced, invalidations=self.invalidations,
+                     stale_served=self.stale_served)
+        return stats
@@ -1,44 +1,208 @@
+import itertools
 import re
-from typing import Tuple
+import time
+from functools import lru_cache
+from typing import Dict, NamedTuple, Tuple
+from app.core.config import settings
+from app.utils import metrics
+
+# Only cache misses are timed: they are the actual parsing work, and hits
+# are already visible as cache_hits_total{cache="user_agent"}
+UA_PARSE_SECONDS = metrics.histogram(
+    "user_agent_parse_seconds",
+    "Time to classify a user agent not found in the memo cache",
+    buckets=(1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3)
+)
+
+class UserAgentInfo(NamedTuple):
+    browser: str
+    os: str
+    device: str
+    is_bot: bool
+
+# Browser user agents look like "Mozilla/5.0 (<platform>) <engine> <products>",
+# e.g. "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML,
+# like Gecko) Chrome/120.0.0.0 Safari/537.36". Parsing runs for every user
+# agent the cache has not seen, so tokens are matched in the case browsers
+# send them and the rules are ordered to need as few and as short scans as
+# possible; crawlers, which rarely look like that, take the slower path.
+
+# Crawler tokens, looked for in the lowercased string, most frequent first
+_BOT_TOKENS = (
+    "facebookexternalhit", "headlesschrome", "curl", "python-requests",
+    "wget", "spider", "crawler", "slurp", "lighthouse",
+)
+
+# "bot" counts only at the end of a crawler's product name (Googlebot/2.1,
+# Slackbot-LinkExpanding) or as a word of its own ("+http://.../bot.html"),
+# so phones like the CUBOT X30 are not taken for crawlers
+_BOT_WORD_RE = re.compile(r"\bbot\b")
+
+# Only this much of a UA string is classified (and kept as a cache key)
+_MAX_LENGTH = 512
+
+# One parse in this many is timed; the histogram shows the distribution,
+# and the cache metrics count the misses
+_TIMING_SAMPLE = 16
+_misses = itertools.count()
+
+@lru_cache(maxsize=settings.UA_CACHE_SIZE)
+def _classify(user_agent: str) -> UserAgentInfo:
+    if next(_misses) % _TIMING_SAMPLE:
+        return _parse(user_agent)
+    started = time.perf_counter()
+    info = _parse(user_agent)
+    UA_PARSE_SECONDS.observe(time.perf_counter() - started)
+    return info
+
+# Parsed results are few, so each combination is built once
+_INFOS: Dict[Tuple[str, str, str, bool], UserAgentInfo] = {}
+_NO_PLATFORM_BOT = ("Unknown", "Unknown", "Bot", True)
+_INFOS[_NO_PLATFORM_BOT] = UserAgentInfo(*_NO_PLATFORM_BOT)
+
+def _crawler(user_agent: str) -> bool:
+    ua = user_agent.lower()
+    if "bot/" in ua or "bot-" in ua:
+        return True
+    if "bot" in ua and _BOT_WORD_RE.search(ua) is not None:
+        return True
+    for token in _BOT_TOKENS:
+        if token in ua:
+            return True
+    return False
+
+def _parse(ua: str) -> UserAgentInfo:
+    # Set when the tokens hint at automation rather than a person
+    suspect = False
+
+    # Platform first: it settles the device and narrows down the browsers.
+    # iPhone and iPad user agents say "like Mac OS X", hence Macintosh
+    if "Windows" in ua:
+        if "Phone" in ua:
+            os, device = "Windows Phone", "Mobile"
+        else:
+            os, device = "Windows", "Desktop"
+    elif "Android" in ua:
+        os = "Android"
+        device = "Mobile" if "Mobile" in ua else "Tablet"
+    elif "iPhone" in ua:
+        os, device = "iOS", "Mobile"
+    elif "Macintosh" in ua:
+        os, device = "macOS", "Desktop"
+    elif not ua.startswith("Mozilla/") and _crawler(ua):
+        # Command-line clients and link unfurlers (curl/8.4.0, Twitterbot/1.0)
+        # name themselves first and carry no platform
+        return _INFOS[_NO_PLATFORM_BOT]
+    elif "iPad" in ua:
+        os, device = "iOS", "Tablet"
+    elif "iPod" in ua:
+        os, device = "iOS", "Mobile"
+    elif "Linux" in ua:
+        os, device = "Linux", "Desktop"
+    elif "CrOS" in ua:
+        os, device = "Chrome OS", "Desktop"
+    elif "BlackBerry" in ua or "BB10" in ua:
+        os, device = "BlackBerry", "Mobile"
+    else:
+        os = "Unknown"
+        device = "Tablet" if "Tablet" in ua else "Mobile" if "Mobile" in ua else "Desktop"
+        suspect = True
+
+    if os == "iOS":
+        # Every iOS browser is Safari's engine plus its own token: CriOS/,
+        # FxiOS/ or EdgiOS/
+        if "iOS/" not in ua:
+            browser = "Safari" if "Safari" in ua else "Unknown"
+        elif "CriOS" in ua:
+            browser = "Chrome"
+        elif "FxiOS" in ua:
+            browser = "Firefox"
+        elif "EdgiOS" in ua:
+            browser = "Edge"
+        else:
+            browser = "Safari"
+    elif "Chrome" in ua:
+        # Chromium-based browsers keep Chrome's tokens and add their own
+        if ua.endswith("Safari/537.36"):
+            # Nothing appended, the common case: Chrome itself or a browser
+            # that puts its token in front of Chrome's
+            if "Browser/" in ua:
+                browser = "Samsung Internet" if "SamsungBrowser" in ua else "Yandex" if "YaBrowser" in ua else "Chrome"
+            else:
+                browser = "Chrome"
+            if device == "Desktop" and "Headless" in ua:
+                suspect = True
+        else:
+            if "Edg" in ua:  # Edg/, EdgA/ and EdgeHTML's Edge/
+                browser = "Edge"
+            elif "OPR/" in ua:
+                browser = "Opera"
+            elif "SamsungBrowser" in ua:
+                browser = "Samsung Internet"
+            elif "YaBrowser" in ua:
+                browser = "Yandex"
+            else:
+                browser = "Chrome"
+            if "Headless" in ua or "Lighthouse" in ua:
+                suspect = True
+    elif "Firefox" in ua:
+        browser = "Firefox"
+    elif "Safari" in ua:
+        browser = "Opera" if "OPR/" in ua else "Safari"
+    elif "MSIE" in ua or "Trident" in ua:
+        browser = "Internet Explorer"
+    elif "Opera" in ua:
+        browser = "Opera"
+    else:
+        # Feed readers and crawlers that do not pose as a browser
+        browser = "Unknown"
+        suspect = True
+
+    # Crawlers posing as a browser on a platform append a comment after the
+    # last product ("... Safari/537.36 (compatible; Googlebot/2.1; ...)"),
+    # which no browser does
+    is_bot = (suspect or ua[-1:] == ")") and _crawler(ua)
+    if is_bot:
+        device = "Bot"
+
+    key = (browser, os, device, is_bot)
+    info = _INFOS.get(key)
+    if info is None:
+        info = _INFOS.setdefault(key, UserAgentInfo(*key))
+    return info
+
+def _cache_metrics():
+    info = _classify.cache_info()
+    return metrics.cache_samples("user_agent", info.hits, info.misses, info.currsize)
+
+metrics.REGISTRY.register_collector(_cache_metrics)
+
+def classify_user_agent(user_agent: str) -> UserAgentInfo:
+    """
+    Classify a user agent string into browser, OS and device
+
+    Rules are a handful of substring checks, and results are memoized in a
+    bounded LRU (UA_CACHE_SIZE) since real traffic repeats a small set of
+    distinct user agents.
+
+    Args:
+        user_agent: The user agent string from the request
+
+    Returns:
+        UserAgentInfo(browser, os, device, is_bot); device is one of
+        Desktop, Mobile, Tablet or Bot
+    """
+    return _classify(user_agent[:_MAX_LENGTH])
 
 def parse_user_agent(user_agent: str) -> Tuple[str, str]:
     """
     Parse user agent string to extract browser and device information
-    
+
     Args:
         user_agent: The user agent string from the request
-        
+
     Returns:
         Tuple containing (browser, device)
     """
-    # Browser detection
-    browser = "Unknown"
-    if "Firefox" in user_agent:
-        browser = "Firefox"
-    elif "Chrome" in user_agent and "Edg" not in user_agent and "OPR" not in user_agent:
-        browser = "Chrome"
-    elif "Safari" in user_agent and "Chrome" not in user_agent:
-        browser = "Safari"
-    elif "Edg" in user_agent:
-        browser = "Edge"
-    elif "OPR" in user_agent or "Opera" in user_agent:
-        browser = "Opera"
-    elif "MSIE" in user_agent or "Trident" in user_agent:
-        browser = "Internet Explorer"
-    
-    # Device detection
-    device = "Desktop"
-    mobile_patterns = [
-        "Android", "iPhone", "iPad", "iPod", "Windows Phone", 
-        "BlackBerry", "Mobile", "Tablet"
-    ]
-    
-    for pattern in mobile_patterns:
-        if pattern in user_agent:
-            if pattern in ["iPad", "Tablet"]:
-                device = "Tablet"
-            else:
-                device = "Mobile"
-            break
-    
-    return browser, device
+    info = classify_user_agent(user_agent)
+    return info.browser, info.device
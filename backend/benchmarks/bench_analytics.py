@@ -0,0 +1,92 @@
+"""
+Micro-benchmark for analytics aggregation
+
+- request: building the analytics msearch body
+- parse: turning one aggregation response into counters
+- merge: merging the rollup and raw-click responses of an msearch and
+  building the URLAnalytics fields
+- summarize: grouping a bulk batch of clicks into rollup upserts (ingest)
+
+Responses are synthetic: ``days`` histogram buckets and ``terms`` buckets
+per breakdown, shaped like real Elasticsearch output.
+
+Usage (from backend/):
+    python -m benchmarks.bench_analytics [--days N] [--terms N] [--batch N]
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+from app.services import es_queries
+from app.services import rollups as click_rollups
+
+BROWSERS = ["Chrome", "Safari", "Firefox", "Edge", "Opera", "Samsung Internet", "Unknown"]
+DEVICES = ["Desktop", "Mobile", "Tablet"]
+COUNTRIES = ["US", "IN", "DE", "GB", "BR", "FR", "JP", "CA", "AU", "NL", "ES", "IT"]
+
+def synthetic_response(days: int, terms: int, seed: int = 11) -> dict:
+    rng = random.Random(seed)
+    first = datetime(2024, 1, 1)
+
+    def buckets(keys):
+        return [{"key": key, "doc_count": n, "clicks": {"value": float(n)}}
+                for key, n in ((key, rng.randrange(1, 10000)) for key in keys)]
+
+    aggs = {
+        "total_clicks": {"value": float(rng.randrange(10 ** 6))},
+        "clicks_by_date": {"buckets": [
+            dict(bucket, key_as_string=bucket["key"])
+            for bucket in buckets((first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days))
+        ]},
+    }
+    for field in es_queries.DIMENSIONS:
+        keys = [f"{field}-{i}" for i in range(terms)]
+        aggs[f"clicks_by_{field}"] = {"buckets": buckets(keys)}
+    return {"took": 3, "hits": {"total": {"value": 0}, "hits": []}, "aggregations": aggs}
+
+def synthetic_batch(size: int, codes: int = 100, seed: int = 13) -> list:
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    return [{
+        "short_code": f"c{rng.randrange(codes):04d}",
+        "timestamp": now - timedelta(seconds=rng.randrange(3600)),
+        "browser": rng.choice(BROWSERS),
+        "device": rng.choice(DEVICES),
+        "os": "Unknown",
+        "country": rng.choice(COUNTRIES),
+        "ip": "10.0.0.1",
+    } for _ in range(size)]
+
+def per_call_us(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def run(days: int = 90, terms: int = 10, batch: int = 500) -> dict:
+    rollups = synthetic_response(days, terms, seed=1)
+    tail = synthetic_response(1, terms, seed=2)
+    msearch = {"responses": [rollups, tail]}
+    clicks = synthetic_batch(batch)
+    since = datetime.utcnow() - timedelta(days=days)
+
+    return {
+        "request_us": per_call_us(lambda: es_queries.analytics_msearch("c0001", since=since), 2000),
+        "parse_us": per_call_us(lambda: es_queries.analytics_counts(rollups), 500),
+        "merge_us": per_call_us(lambda: es_queries.counts_to_fields(es_queries.analytics_msearch_counts(msearch)), 200),
+        "summarize_batch_us": per_call_us(
+            lambda: list(click_rollups.rollup_actions(click_rollups.summarize(clicks), "batch")), 50
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--terms", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    results = run(args.days, args.terms, args.batch)
+    print(f"{args.days} days, {args.terms} terms per breakdown, batches of {args.batch} clicks")
+    for name, value in results.items():
+        print(f"  {name:<20} {value:10.1f} us")
+
+if __name__ == "__main__":
+    main()
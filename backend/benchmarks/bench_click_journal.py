@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for the on-disk click journal
+
+Times ``append`` with background group commit, and with every append
+waiting for its fsync from several threads at once (the fsyncs per
+second show how many clicks each one covers). Also times reading the
+journal back the way the shipper does.
+
+Usage (from backend/):
+    python -m benchmarks.bench_click_journal [--clicks N] [--threads N]
+"""
+import argparse
+import tempfile
+import threading
+import time
+from datetime import datetime
+from app.services.click_journal import ClickJournal
+
+UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+def make_doc(i: int) -> dict:
+    return {"short_code": f"c{i % 1000:05d}", "timestamp": datetime.utcnow(), "browser": "Chrome",
+            "device": "Desktop", "os": "Windows", "country": "US", "ip": f"10.0.{i % 256}.{i % 200}", "user_agent": UA}
+
+def append_all(journal: ClickJournal, docs, threads: int) -> float:
+    """Seconds to append every doc, split across ``threads``"""
+    def worker(part):
+        for doc in part:
+            journal.append(doc)
+    workers = [threading.Thread(target=worker, args=(docs[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started
+
+def run(clicks: int = 100000, threads: int = 16) -> dict:
+    docs = [make_doc(i) for i in range(clicks)]
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ClickJournal(f"{tmp}/interval")
+        elapsed = append_all(journal, docs, 1)
+        journal.commit()
+        record_bytes = journal.lag_bytes() / clicks
+        started = time.perf_counter()
+        read = 0
+        batch = journal.read(500)
+        while batch:
+            read += len(batch)
+            journal.acknowledge(batch)
+            batch = journal.read(500)
+        read_elapsed = time.perf_counter() - started
+        journal.close()
+
+        waited = docs[:clicks // 10]
+        journal = ClickJournal(f"{tmp}/commit", wait_for_commit=True)
+        commit_elapsed = append_all(journal, waited, threads)
+        fsyncs = journal.commits
+        journal.close()
+    return {
+        "clicks": clicks,
+        "append_us": elapsed / clicks * 1e6,
+        "append_wait_for_commit_us": commit_elapsed / len(waited) * 1e6,
+        "clicks_per_fsync": len(waited) / max(fsyncs, 1),
+        "read_us": read_elapsed / read * 1e6,
+        "record_bytes_per_click": record_bytes,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    results = run(args.clicks, args.threads)
+    print(f"{results['clicks']} clicks")
+    print(f"  append                  {results['append_us']:8.2f} us/click")
+    print(f"  append, wait for commit {results['append_wait_for_commit_us']:8.2f} us/click ({args.threads} threads)")
+    print(f"  clicks per fsync        {results['clicks_per_fsync']:8.1f}")
+    print(f"  read back               {results['read_us']:8.2f} us/click")
+    print(f"  record size             {results['record_bytes_per_click']:8.1f} bytes/click")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark for offline IP geolocation
+
+Builds a synthetic range table the size of a full country database, then
+times opening it (CSV parse vs. memory-mapped compiled file) and looking
+up random IPv4 and IPv6 addresses, both straight against the database and
+through the per-process LRU.
+
+Usage (from backend/):
+    python -m benchmarks.bench_geoip [--ranges N] [--lookups N]
+"""
+import argparse
+import ipaddress
+import os
+import random
+import tempfile
+import time
+import timeit
+from functools import lru_cache
+from app.utils.geoip import GeoIPDatabase, compile_database
+
+COUNTRIES = ["US", "DE", "GB", "FR", "IN", "BR", "JP", "CN", "CA", "AU", "NL", "SE", "KR", "IT", "ES"]
+
+def write_ranges_csv(path: str, v4_ranges: int, v6_ranges: int, rng: random.Random):
+    """Contiguous random-width ranges over the IPv4 space and 2000::/3"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("start,end,country\n")
+        bounds = sorted(rng.sample(range(1, 2 ** 32), v4_ranges))
+        start = 0
+        for end in bounds:
+            f.write(f"{ipaddress.IPv4Address(start)},{ipaddress.IPv4Address(end - 1)},{rng.choice(COUNTRIES)}\n")
+            start = end
+        base = 0x2000 << 112
+        bounds = sorted(rng.randrange(1, 1 << 125) for _ in range(v6_ranges))
+        start = 0
+        for end in bounds:
+            if end > start:
+                f.write(f"{ipaddress.IPv6Address(base + start)},{ipaddress.IPv6Address(base + end - 1)},{rng.choice(COUNTRIES)}\n")
+                start = end
+
+def bench(func, ips, number: int = 5) -> float:
+    """Best-of-5 nanoseconds per lookup"""
+    def run():
+        for ip in ips:
+            func(ip)
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / (number * len(ips)) * 1e9
+
+def run(ranges: int = 300000, lookups: int = 20000, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "ranges.csv")
+        db_path = os.path.join(tmp, "ranges.geoip")
+        write_ranges_csv(csv_path, ranges, ranges // 4, rng)
+        compile_database(csv_path, db_path)
+
+        started = time.perf_counter()
+        GeoIPDatabase.open(csv_path)
+        csv_open = time.perf_counter() - started
+        started = time.perf_counter()
+        database = GeoIPDatabase.open(db_path)
+        mmap_open = time.perf_counter() - started
+
+        v4_ips = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(lookups)]
+        v6_ips = [str(ipaddress.IPv6Address((0x2000 << 112) + rng.getrandbits(125))) for _ in range(lookups)]
+        # Clicks repeat IPs: draw the cached workload from a smaller pool
+        hot_ips = [rng.choice(v4_ips[:lookups // 10]) for _ in range(lookups)]
+        cached = lru_cache(maxsize=65536)(database.lookup)
+
+        results = {
+            "ranges": len(database),
+            "open_csv_ms": csv_open * 1e3,
+            "open_mmap_ms": mmap_open * 1e3,
+            "lookup_v4_ns": bench(database.lookup, v4_ips),
+            "lookup_v6_ns": bench(database.lookup, v6_ips),
+            "lookup_cached_ns": bench(cached, hot_ips),
+        }
+        del database, cached
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ranges", type=int, default=300000, help="IPv4 ranges (IPv6 gets a quarter as many)")
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = run(args.ranges, args.lookups)
+    print(f"{results['ranges']} ranges")
+    print(f"  open_csv        {results['open_csv_ms']:10.1f} ms")
+    print(f"  open_mmap       {results['open_mmap_ms']:10.3f} ms")
+    for name in ("lookup_v4_ns", "lookup_v6_ns", "lookup_cached_ns"):
+        print(f"  {name:<15} {results[name]:10.0f} ns/lookup")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Micro-benchmark for the shared, memory-mapped link table
+
+Builds a table of synthetic links, then times opening it and resolving
+codes (hits and misses) against the per-worker alternative, a dict of
+the same links. Also reports what each costs in memory: the table file
+is mapped once per machine, the dict is paid again by every worker.
+
+Usage (from backend/):
+    python -m benchmarks.bench_link_table [--links N] [--lookups N]
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+import timeit
+import tracemalloc
+from app.services.link_table import LinkTable
+
+ALPHABET = string.digits + string.ascii_letters
+
+def make_links(count: int, rng: random.Random):
+    codes = {"".join(rng.choices(ALPHABET, k=6)) for _ in range(count)}
+    return [(code, f"https://example.com/articles/{i}?utm_source=bench&ref={code}", f"2024-05-{i % 28 + 1:02d}T12:00:00Z")
+            for i, code in enumerate(codes)]
+
+def bench(func, codes, number: int = 5) -> float:
+    """Best-of-5 nanoseconds per lookup"""
+    def run():
+        for code in codes:
+            func(code)
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / (number * len(codes)) * 1e9
+
+def run(links: int = 500000, lookups: int = 20000, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    # What a worker caching every link itself would hold, strings included
+    tracemalloc.start()
+    mapping = {code: (url, created_at) for code, url, created_at in make_links(links, rng)}
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    data = [(code, url, created_at) for code, (url, created_at) in mapping.items()]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "links.bin")
+        started = time.perf_counter()
+        LinkTable.build(data).write(path)
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        table = LinkTable.open(path)
+        mmap_open = time.perf_counter() - started
+
+        hits = [rng.choice(data)[0] for _ in range(lookups)]
+        misses = []
+        while len(misses) < lookups:
+            code = "".join(rng.choices(ALPHABET, k=6))
+            if code not in mapping:
+                misses.append(code)
+        results = {
+            "links": len(table),
+            "build_s": build,
+            "open_mmap_ms": mmap_open * 1e3,
+            "lookup_hit_ns": bench(table.get, hits),
+            "lookup_miss_ns": bench(table.get, misses),
+            "lookup_dict_ns": bench(mapping.get, hits),
+            "file_bytes_per_link": os.path.getsize(path) / len(table),
+            "dict_bytes_per_link_per_worker": dict_bytes / len(mapping),
+        }
+        del table
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=500000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = run(args.links, args.lookups)
+    print(f"{results['links']} links")
+    print(f"  build           {results['build_s']:10.2f} s")
+    print(f"  open_mmap       {results['open_mmap_ms']:10.3f} ms")
+    for name in ("lookup_hit_ns", "lookup_miss_ns", "lookup_dict_ns"):
+        print(f"  {name:<15} {results[name]:10.0f} ns/lookup")
+    print(f"  table file      {results['file_bytes_per_link']:10.0f} bytes/link, shared by all workers")
+    print(f"  dict            {results['dict_bytes_per_link_per_worker']:10.0f} bytes/link, in every worker")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+End-to-end load generator for the FastAPI router and the Flask app
+
+Each target runs as its own server process (uvicorn for FastAPI, the
+threaded werkzeug server for Flask) against a fake Elasticsearch node in a
+third process (benchmarks/fake_es.py), so the load generator does not
+share a GIL with either. After creating ``--codes`` links, ``--concurrency``
+keep-alive client threads send a mix of requests for ``--duration``
+seconds:
+
+- redirect:  the target's HTTP redirect route
+- analytics: GET /api/analytics/{short_code}
+- shorten:   POST /api/shorten
+
+Links are picked with Zipf-distributed popularity (exponent ``--zipf``),
+so a few codes get most of the traffic as in real shortener logs.
+Reports throughput and p50/p95/p99 latency per operation.
+
+Usage (from backend/):
+    python -m benchmarks.bench_load [--targets fastapi flask] [--duration S]
+        [--concurrency N] [--codes N] [--zipf S] [--mix redirect=90,analytics=5,shorten=5]
+"""
+import argparse
+import bisect
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+# Route per operation for each target; {code} is the short code
+TARGETS = {
+    "fastapi": {"redirect": "/api/r/{code}", "analytics": "/api/analytics/{code}", "shorten": "/api/shorten"},
+    "flask": {"redirect": "/{code}", "analytics": "/api/analytics/{code}", "shorten": "/api/shorten"},
+}
+
+DEFAULT_MIX = "redirect=90,analytics=5,shorten=5"
+
+def serve(target: str, port: int):
+    """Run a target's server in this process until killed"""
+    # app.main configures INFO logging; per-request log lines would dominate
+    for name in ("werkzeug", "elastic_transport"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    if target == "fastapi":
+        import uvicorn
+        from fastapi import FastAPI
+        from app.api.api import api_router
+
+        app = FastAPI()
+        app.include_router(api_router, prefix="/api")
+        uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    else:
+        from werkzeug.serving import make_server
+        from app.main import app
+
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(port: int, path: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", path)
+            if conn.getresponse().status < 500:
+                conn.close()
+                return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server on port {port} did not come up")
+        time.sleep(0.1)
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+class ZipfSampler:
+    """Draw indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** s"""
+
+    def __init__(self, n: int, s: float, seed: int = 0):
+        self.cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+        self.rng = random.Random(seed)
+
+    def sample(self) -> int:
+        return bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class _Client:
+    """One keep-alive connection, reconnecting when the server closes it"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.conn = None
+
+    def request(self, method: str, path: str, body: bytes = None) -> Tuple[int, bytes]:
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            try:
+                headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36"}
+                if body is not None:
+                    headers["Content-Type"] = "application/json"
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                content = response.read()
+                if response.will_close:
+                    self.conn.close()
+                    self.conn = None
+                return response.status, content
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        return 0, b""
+
+def _shorten_body(i: int) -> bytes:
+    return json.dumps({"original_url": f"https://example.com/articles/{i}?utm_source=load"}).encode("utf-8")
+
+def load(
+    target: str,
+    port: int,
+    codes: int,
+    duration: float,
+    concurrency: int,
+    mix: Dict[str, float],
+    zipf: float
+) -> dict:
+    routes = TARGETS[target]
+    client = _Client(port)
+    short_codes = [
+        json.loads(client.request("POST", routes["shorten"], _shorten_body(i))[1])["short_code"]
+        for i in range(codes)
+    ]
+
+    operations = list(mix)
+    weights = list(itertools.accumulate(mix[name] for name in operations))
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        popularity = ZipfSampler(codes, zipf, seed)
+        client = _Client(port)
+        local: Dict[str, List[float]] = defaultdict(list)
+        local_errors: Dict[str, int] = defaultdict(int)
+        counter = itertools.count(codes + seed * 10 ** 7)
+        while time.monotonic() < deadline:
+            operation = operations[bisect.bisect(weights, rng.random() * weights[-1])]
+            if operation == "shorten":
+                method, path, body = "POST", routes["shorten"], _shorten_body(next(counter))
+            else:
+                method, path, body = "GET", routes[operation].format(code=short_codes[popularity.sample()]), None
+            started = time.perf_counter()
+            status, _ = client.request(method, path, body)
+            local[operation].append(time.perf_counter() - started)
+            if status >= 400:
+                local_errors[operation] += 1
+        with lock:
+            for operation, values in local.items():
+                latencies[operation].extend(values)
+            for operation, count in local_errors.items():
+                errors[operation] += count
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    results = {"requests": total, "throughput_rps": total / elapsed}
+    everything = sorted(itertools.chain.from_iterable(latencies.values()))
+    for name, values in [("all", everything)] + [(op, sorted(latencies[op])) for op in operations]:
+        for p in (50, 95, 99):
+            results[f"{name}_p{p}_ms"] = percentile(values, p) * 1e3
+        if name != "all":
+            results[f"{name}_errors"] = errors[name]
+    return results
+
+def run(
+    targets: Sequence[str] = ("fastapi", "flask"),
+    duration: float = 10.0,
+    concurrency: int = 8,
+    codes: int = 1000,
+    zipf: float = 1.1,
+    mix: str = DEFAULT_MIX
+) -> dict:
+    es_port = free_port()
+    fake_es = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_es", "--port", str(es_port)],
+        stdout=subprocess.DEVNULL
+    )
+    results = {}
+    try:
+        wait_until_ready(es_port, "/")
+        for target in targets:
+            port = free_port()
+            env = dict(
+                os.environ,
+                ELASTICSEARCH_HOST="127.0.0.1",
+                ELASTICSEARCH_PORT=str(es_port),
+                ELASTICSEARCH_MIGRATE_ON_STARTUP="true",
+                STORAGE_BACKEND="elasticsearch",
+            )
+            server = subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.bench_load", "--serve", target, "--port", str(port)],
+                env=env, stdout=subprocess.DEVNULL
+            )
+            try:
+                wait_until_ready(port, "/api/recent")
+                results[target] = load(target, port, codes, duration, concurrency, parse_mix(mix), zipf)
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        fake_es.terminate()
+        fake_es.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", choices=sorted(TARGETS), default=["fastapi", "flask"])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--codes", type=int, default=1000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--serve", choices=sorted(TARGETS), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+    results = run(args.targets, args.duration, args.concurrency, args.codes, args.zipf, args.mix)
+    operations = ["all"] + list(parse_mix(args.mix))
+    for target, result in results.items():
+        print(f"{target}: {result['requests']} requests, {result['throughput_rps']:.0f} req/s")
+        for operation in operations:
+            p50, p95, p99 = (result[f"{operation}_p{p}_ms"] for p in (50, 95, 99))
+            errors = result.get(f"{operation}_errors", 0)
+            print(f"  {operation:<10} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  p99 {p99:7.2f} ms  errors {errors}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark for the Flask app's in-memory storage
+
+Loads the same synthetic clicks into the old list-of-dicts layout and into
+MemoryStore, then reports memory per click and the latency of analytics
+for one short code and of the recent-URLs listing.
+
+Usage (from backend/):
+    python -m benchmarks.bench_memory_store [--clicks N] [--codes N]
+"""
+import argparse
+import gc
+import random
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from app.services.memory_store import MemoryStore
+
+BROWSERS = ["Chrome", "Safari", "Firefox", "Edge", "Opera", "Samsung Internet"]
+DEVICES = ["Desktop", "Mobile", "Tablet", "Bot"]
+OSES = ["Windows", "macOS", "Android", "iOS", "Linux"]
+COUNTRIES = ["US", "DE", "GB", "IN", "BR", "JP", "FR", "Unknown"]
+
+def synthetic_clicks(clicks: int, codes: int, seed: int = 3):
+    rng = random.Random(seed)
+    start = time.time() - 90 * 86400
+    for i in range(clicks):
+        yield (
+            f"c{rng.randrange(codes):05d}", start + i * (90 * 86400 / clicks),
+            rng.choice(BROWSERS), rng.choice(DEVICES), rng.choice(OSES), rng.choice(COUNTRIES),
+            f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}",
+        )
+
+def load_legacy(clicks, codes: int):
+    urls_db = {f"c{i:05d}": {"original_url": f"https://example.com/{i}", "short_code": f"c{i:05d}",
+                             "created_at": datetime.utcnow().isoformat()} for i in range(codes)}
+    clicks_db = [{"short_code": code, "timestamp": datetime.utcfromtimestamp(ts).isoformat(), "browser": browser,
+                  "device": device, "os": os, "country": country, "ip": ip}
+                 for code, ts, browser, device, os, country, ip in clicks]
+    return urls_db, clicks_db
+
+def legacy_analytics(clicks_db, short_code: str):
+    url_clicks = [click for click in clicks_db if click["short_code"] == short_code]
+    counts = {}
+    for field in ("browser", "device", "country"):
+        counts[field] = {}
+        for click in url_clicks:
+            counts[field][click[field]] = counts[field].get(click[field], 0) + 1
+    counts["date"] = {}
+    for click in url_clicks:
+        date = click["timestamp"].split("T")[0]
+        counts["date"][date] = counts["date"].get(date, 0) + 1
+    return counts
+
+def legacy_recent(urls_db):
+    return sorted(urls_db.values(), key=lambda x: x["created_at"], reverse=True)[:10]
+
+def load_store(clicks, codes: int) -> MemoryStore:
+    store = MemoryStore()
+    for i in range(codes):
+        store.add_url(f"c{i:05d}", f"https://example.com/{i}", datetime.utcnow().isoformat())
+    for code, ts, browser, device, os, country, ip in clicks:
+        store.add_click(code, browser, device, os, country, ip, timestamp=ts)
+    return store
+
+def measure(load, *args):
+    """(result, bytes allocated, seconds)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load(*args)
+    elapsed = time.perf_counter() - started
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated, elapsed
+
+def per_call_ms(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e3
+
+def run(clicks: int = 500000, codes: int = 1000) -> dict:
+    (urls_db, clicks_db), legacy_bytes, legacy_load = measure(load_legacy, synthetic_clicks(clicks, codes), codes)
+    store, store_bytes, store_load = measure(load_store, synthetic_clicks(clicks, codes), codes)
+    results = {
+        "clicks": clicks,
+        "codes": codes,
+        "legacy_bytes_per_click": legacy_bytes / clicks,
+        "store_bytes_per_click": store_bytes / clicks,
+        "legacy_load_s": legacy_load,
+        "store_load_s": store_load,
+        "legacy_analytics_ms": per_call_ms(lambda: legacy_analytics(clicks_db, "c00007"), 3),
+        "store_analytics_ms": per_call_ms(lambda: store.click_counts("c00007"), 50),
+        "legacy_recent_ms": per_call_ms(lambda: legacy_recent(urls_db), 20),
+        "store_recent_ms": per_call_ms(lambda: store.recent_urls(10), 1000),
+    }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=500000)
+    parser.add_argument("--codes", type=int, default=1000)
+    args = parser.parse_args()
+
+    results = run(args.clicks, args.codes)
+    print(f"{results['clicks']} clicks over {results['codes']} short codes")
+    print(f"  bytes/click     legacy {results['legacy_bytes_per_click']:10.0f}   store {results['store_bytes_per_click']:10.1f}")
+    print(f"  load            legacy {results['legacy_load_s']:10.2f}s  store {results['store_load_s']:10.2f}s")
+    print(f"  analytics       legacy {results['legacy_analytics_ms']:10.2f}ms store {results['store_analytics_ms']:10.3f}ms")
+    print(f"  recent          legacy {results['legacy_recent_ms']:10.3f}ms store {results['store_recent_ms']:10.4f}ms")
+
+if __name__ == "__main__":
+    main()
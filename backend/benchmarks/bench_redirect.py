@@ -0,0 +1,106 @@
+"""
+Redirect route benchmark: JSON route vs HTTP redirect fast path
+
+Calls the ASGI app directly (no sockets, no HTTP client) so the numbers
+are the server-side cost per request: routing, dependency resolution,
+cache lookup, click enqueue and response serialization. Short codes are
+warm in the URL cache and clicks go to a fake Elasticsearch node
+(benchmarks/fake_es.py).
+
+- json:     GET /api/{short_code}, returns {"url": ...}
+- redirect: GET /api/r/{short_code}, returns 302 with a Location header
+
+Usage (from backend/):
+    python -m benchmarks.bench_redirect [--requests N] [--codes N]
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import List
+
+async def _call(app, path: str) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"user-agent", b"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"),
+        ],
+        "client": ("203.0.113.7", 50000),
+        "server": ("bench", 80),
+    }
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+async def _measure(app, paths: List[str], requests: int, expected: int) -> float:
+    for path in paths:
+        assert await _call(app, path) == expected, path
+    started = time.perf_counter()
+    for i in range(requests):
+        await _call(app, paths[i % len(paths)])
+    return requests / (time.perf_counter() - started)
+
+async def _run(requests: int, codes: int) -> dict:
+    from fastapi import FastAPI
+    from app.api.api import api_router
+    from app.models.url import URLCreate
+    from app.services.async_url_service import close_async_url_service, get_async_url_service
+
+    app = FastAPI()
+    app.include_router(api_router, prefix="/api")
+    service = get_async_url_service()
+    await service.startup()
+    short_codes = [
+        (await service.create_short_url(URLCreate(original_url=f"https://example.com/page/{i}?ref=bench"))).short_code
+        for i in range(codes)
+    ]
+
+    results = {}
+    # Alternate rounds so background click flushing hits both routes alike
+    for _ in range(3):
+        for name, prefix, expected in (("json_rps", "/api/", 200), ("redirect_rps", "/api/r/", 302)):
+            rps = await _measure(app, [prefix + code for code in short_codes], requests, expected)
+            results[name] = max(results.get(name, 0.0), rps)
+    await close_async_url_service()
+    return results
+
+def run(requests: int = 5000, codes: int = 100) -> dict:
+    from benchmarks.fake_es import FakeElasticsearch
+    with FakeElasticsearch() as es:
+        os.environ["ELASTICSEARCH_HOST"] = "127.0.0.1"
+        os.environ["ELASTICSEARCH_PORT"] = str(es.port)
+        os.environ.setdefault("CLICK_QUEUE_SIZE", str(requests * 10))
+        return asyncio.run(_run(requests, codes))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--codes", type=int, default=100)
+    args = parser.parse_args()
+
+    results = run(args.requests, args.codes)
+    print(f"{args.requests} requests over {args.codes} cached codes (best of 3)")
+    for name, rps in results.items():
+        print(f"  {name:<14} {rps:10,.0f} req/s  {1e6 / rps:7.1f} us/req")
+    print(f"  speedup        {results['redirect_rps'] / results['json_rps']:10.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Startup benchmark: import time and first-request latency
+
+Each sample runs in a fresh interpreter against a fake Elasticsearch node
+(benchmarks/fake_es.py):
+
+- import: ``import app.api.api`` and ``import app.services.url_service``
+- startup: router startup hooks (service construction, pipeline start)
+- first_request / second_request: GET /api/recent through TestClient
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup [--runs N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+def child():
+    """One cold start, reported as JSON on stdout"""
+    from benchmarks.fake_es import FakeElasticsearch
+
+    es = FakeElasticsearch().start()
+    os.environ["ELASTICSEARCH_HOST"] = "127.0.0.1"
+    os.environ["ELASTICSEARCH_PORT"] = str(es.port)
+    os.environ["ELASTICSEARCH_MIGRATE_ON_STARTUP"] = "false"
+
+    started = time.perf_counter()
+    from app.api.api import api_router
+    import_api = time.perf_counter() - started
+
+    started = time.perf_counter()
+    import app.services.url_service  # noqa: F401
+    import_sync = time.perf_counter() - started
+
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.include_router(api_router, prefix="/api")
+    client = TestClient(app)
+    started = time.perf_counter()
+    client.__enter__()
+    startup = time.perf_counter() - started
+
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        response = client.get("/api/recent")
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.text
+
+    client.__exit__(None, None, None)
+    es.close()
+    print(json.dumps({
+        "import_api_ms": import_api * 1e3,
+        "import_url_service_ms": import_sync * 1e3,
+        "startup_ms": startup * 1e3,
+        "first_request_ms": timings[0] * 1e3,
+        "second_request_ms": timings[1] * 1e3,
+    }))
+
+def run(runs: int = 5) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+            check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {name: statistics.median(sample[name] for sample in samples) for name in samples[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+    results = run(args.runs)
+    print(f"median of {args.runs} cold starts")
+    for name, value in results.items():
+        print(f"  {name:<24} {value:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark for the embedded storage backends
+
+Times URL inserts, single and batched click appends, lookups and
+analytics against the memory and SQLite backends.
+
+Usage (from backend/):
+    python -m benchmarks.bench_storage [--clicks N] [--batch N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from app.services.sqlite_storage import SQLiteStorage
+from app.services.storage import MemoryStorage
+
+def clicks(count: int, codes, seed: int = 5):
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=30)
+    for i in range(count):
+        yield {
+            "short_code": rng.choice(codes),
+            "timestamp": start + timedelta(seconds=i),
+            "browser": rng.choice(["Chrome", "Safari", "Firefox", "Edge"]),
+            "device": rng.choice(["Desktop", "Mobile", "Tablet"]),
+            "os": rng.choice(["Windows", "macOS", "Android", "iOS"]),
+            "country": rng.choice(["US", "DE", "IN", "BR", "Unknown"]),
+            "ip": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}",
+        }
+
+def timed(func) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+def bench_backend(storage, count: int, batch: int) -> dict:
+    codes = [f"c{i:04d}" for i in range(1000)]
+    created_at = datetime.utcnow().isoformat()
+    url_s = timed(lambda: [storage.put_url(code, f"https://example.com/{code}", created_at) for code in codes])
+
+    single = list(clicks(count // 10, codes, seed=1))
+    single_s = timed(lambda: [storage.append_clicks([click]) for click in single])
+
+    batched = list(clicks(count, codes, seed=2))
+    batched_s = timed(lambda: [storage.append_clicks(batched[i:i + batch]) for i in range(0, count, batch)])
+
+    lookup_s = timed(lambda: [storage.get_url(code) for code in codes])
+    analytics_s = timed(lambda: [storage.click_counts(code) for code in codes[:100]])
+    recent_s = timed(lambda: [storage.recent_urls(10) for _ in range(100)])
+    return {
+        "put_url_us": url_s / len(codes) * 1e6,
+        "click_single_us": single_s / len(single) * 1e6,
+        "click_batched_us": batched_s / count * 1e6,
+        "get_url_us": lookup_s / len(codes) * 1e6,
+        "analytics_ms": analytics_s / 100 * 1e3,
+        "recent_ms": recent_s / 100 * 1e3,
+    }
+
+def run(count: int = 200000, batch: int = 500) -> dict:
+    results = {"memory": bench_backend(MemoryStorage(), count, batch)}
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, "bench.db"))
+        try:
+            results["sqlite"] = bench_backend(storage, count, batch)
+        finally:
+            storage.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    results = run(args.clicks, args.batch)
+    names = list(results["memory"])
+    print(f"{'':<18}" + "".join(f"{backend:>12}" for backend in results))
+    for name in names:
+        print(f"{name:<18}" + "".join(f"{results[backend][name]:12.2f}" for backend in results))
+
+if __name__ == "__main__":
+    main()
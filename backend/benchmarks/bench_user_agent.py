@@ -0,0 +1,74 @@
+"""
+Micro-benchmark for user agent classification
+
+Runs the classifier over a corpus of real user agent strings, uncached
+(every call scans the string) and memoized (the per-click steady state),
+next to the substring checks it replaced.
+
+Usage (from backend/):
+    python -m benchmarks.bench_user_agent [--iterations N]
+"""
+import argparse
+import os
+import timeit
+from app.utils.user_agent_parser import _classify, classify_user_agent
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "user_agents.txt")
+
+def load_corpus(path: str = CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def legacy_parse_user_agent(user_agent: str):
+    """The substring-scan parser classify_user_agent replaced, for comparison"""
+    browser = "Unknown"
+    if "Firefox" in user_agent:
+        browser = "Firefox"
+    elif "Chrome" in user_agent and "Edg" not in user_agent and "OPR" not in user_agent:
+        browser = "Chrome"
+    elif "Safari" in user_agent and "Chrome" not in user_agent:
+        browser = "Safari"
+    elif "Edg" in user_agent:
+        browser = "Edge"
+    elif "OPR" in user_agent or "Opera" in user_agent:
+        browser = "Opera"
+    elif "MSIE" in user_agent or "Trident" in user_agent:
+        browser = "Internet Explorer"
+
+    device = "Desktop"
+    for pattern in ["Android", "iPhone", "iPad", "iPod", "Windows Phone", "BlackBerry", "Mobile", "Tablet"]:
+        if pattern in user_agent:
+            device = "Tablet" if pattern in ["iPad", "Tablet"] else "Mobile"
+            break
+    return browser, device
+
+def bench(func, corpus, iterations: int) -> float:
+    """Best-of-5 nanoseconds per call over the corpus"""
+    def run():
+        for user_agent in corpus:
+            func(user_agent)
+    best = min(timeit.repeat(run, number=iterations, repeat=5))
+    return best / (iterations * len(corpus)) * 1e9
+
+def run(iterations: int = 200) -> dict:
+    corpus = load_corpus()
+    classify_user_agent(corpus[0])  # compile and warm up
+    return {
+        "corpus_size": len(corpus),
+        "legacy_substring_ns": bench(legacy_parse_user_agent, corpus, iterations),
+        "classify_uncached_ns": bench(_classify.__wrapped__, corpus, iterations),
+        "classify_memoized_ns": bench(classify_user_agent, corpus, iterations),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    print(f"{results['corpus_size']} user agents")
+    for name in ("legacy_substring_ns", "classify_uncached_ns", "classify_memoized_ns"):
+        print(f"  {name:<24} {results[name]:8.0f} ns/call")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+"""
+In-process stand-in for an Elasticsearch node, for benchmarks
+
+Speaks enough of the REST API for the services to run end to end: index
+admin calls, document create/get/mget/index/update/delete, bulk (index,
+create and scripted ``+=`` updates, with ``if_seq_no`` checks and rollup
+batch tokens), search,
+msearch, scrolls and points in time. Search
+supports ``term`` / ``range`` / ``bool`` filters, ``sort`` with ``size``
+and ``search_after``, and ``terms`` / ``date_histogram`` (hour, day, week)
+/ ``sum`` / ``max`` / ``value_count`` aggregations. Everything lives in dicts; the point is realistic HTTP and
+serialization cost, not realistic query cost.
+
+Usage:
+    with FakeElasticsearch() as es:
+        os.environ["ELASTICSEARCH_PORT"] = str(es.port)
+
+or as its own process (from backend/):
+    python -m benchmarks.fake_es [--port 9200]
+"""
+import json
+import re
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+_SCRIPT_RE = re.compile(r"ctx\._source\.(\w+)\s*\+=\s*params\.(\w+)")
+
+class _Store:
+    def __init__(self):
+        self.indices: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.aliases: Dict[str, str] = {}
+        self.pits: Dict[str, str] = {}  # point in time id -> index expression
+        self.scrolls: Dict[str, Tuple[List[Dict[str, Any]], int]] = {}  # scroll id -> hits left, page size
+        self.pit_seq = 0
+        self.seq_no = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, expression: str) -> List[str]:
+        """Concrete index names for a comma-separated list of names, aliases and patterns"""
+        names = []
+        for part in expression.split(","):
+            if part in ("_all", "*"):
+                names.extend(self.indices)
+            elif part == "clicks_all" or part.endswith("*"):
+                # clicks_all comes from the index template, which is not evaluated here
+                prefix = "clicks" if part == "clicks_all" else part[:-1]
+                names.extend(name for name in self.indices if name.startswith(prefix))
+            elif part in self.indices:
+                names.append(part)
+        return list(dict.fromkeys(names))
+
+    def index(self, name: str) -> Dict[str, Dict[str, Any]]:
+        return self.indices.setdefault(name, {})
+
+    def write(self, index: str, doc_id: str, source: Dict[str, Any], create: bool = False) -> Tuple[int, Dict[str, Any]]:
+        docs = self.index(index)
+        if create and doc_id in docs:
+            return 409, {"_index": index, "_id": doc_id, "status": 409, "error": {
+                "type": "version_conflict_engine_exception", "reason": f"[{doc_id}]: version conflict, document already exists"}}
+        created = doc_id not in docs
+        self.seq_no += 1
+        docs[doc_id] = {"_source": source, "_seq_no": self.seq_no, "_primary_term": 1}
+        return (201 if created else 200), {"_index": index, "_id": doc_id, "result": "created" if created else "updated",
+                                           "_seq_no": self.seq_no, "_primary_term": 1, "status": 201 if created else 200}
+
+    def update(self, index: str, doc_id: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        docs = self.index(index)
+        current = docs.get(doc_id)
+        if current is None:
+            source = body.get("upsert") or (body.get("doc") if body.get("doc_as_upsert") else None)
+            if source is None:
+                return 404, {"_index": index, "_id": doc_id, "status": 404, "error": {"type": "document_missing_exception", "reason": "document missing"}}
+            source = dict(source)
+        else:
+            source = dict(current["_source"])
+            if "doc" in body:
+                source.update(body["doc"])
+            script = body.get("script")
+            if script and "params.batch" in script.get("source", ""):
+                # Rollup updates: applied once per batch token
+                params = script.get("params", {})
+                batches = list(source.get("batches") or [])
+                if params.get("batch") in batches:
+                    return 200, {"_index": index, "_id": doc_id, "result": "noop", "status": 200}
+                source["batches"] = (batches + [params.get("batch")])[-params.get("keep", len(batches) + 1):]
+            if script:
+                match = _SCRIPT_RE.search(script.get("source", ""))
+                if match:
+                    field, param = match.groups()
+                    source[field] = source.get(field, 0) + script.get("params", {}).get(param, 0)
+                    if "ctx.op = 'delete'" in script.get("source", "") and source[field] <= 0:
+                        del docs[doc_id]
+                        return 200, {"_index": index, "_id": doc_id, "result": "deleted", "status": 200}
+        status, result = self.write(index, doc_id, source)
+        result["get"] = {"_source": source}
+        return status, result
+
+def _matches(source: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    if not query or "match_all" in query:
+        return True
+    if "term" in query:
+        (field, value), = query["term"].items()
+        if isinstance(value, dict):
+            value = value.get("value")
+        return source.get(field) == value
+    if "terms" in query:
+        (field, values), = query["terms"].items()
+        return source.get(field) in values
+    if "range" in query:
+        (field, bounds), = query["range"].items()
+        value = source.get(field)
+        if value is None:
+            return False
+        value = str(value)
+        return all((
+            "gte" not in bounds or value >= str(bounds["gte"]),
+            "gt" not in bounds or value > str(bounds["gt"]),
+            "lte" not in bounds or value <= str(bounds["lte"]),
+            "lt" not in bounds or value < str(bounds["lt"]),
+        ))
+    if "bool" in query:
+        clauses = query["bool"]
+        def listed(key):
+            value = clauses.get(key, [])
+            return value if isinstance(value, list) else [value]
+        return (all(_matches(source, q) for q in listed("filter") + listed("must"))
+                and not any(_matches(source, q) for q in listed("must_not"))
+                and (not listed("should") or any(_matches(source, q) for q in listed("should"))))
+    return True
+
+def _histogram_key(value: Any, interval: str) -> str:
+    value = str(value)
+    if interval == "hour":
+        return value[:13] + ":00"
+    if interval == "week":
+        day = date.fromisoformat(value[:10])
+        return (day - timedelta(days=day.weekday())).isoformat()
+    return value[:10]
+
+def _epoch_millis(value: Any) -> float:
+    """A date field value (ISO string, naive meaning UTC) as epoch milliseconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp() * 1000
+
+def _aggregate(hits: List[Dict[str, Any]], aggs: Dict[str, Any]) -> Dict[str, Any]:
+    results = {}
+    for name, agg in aggs.items():
+        sub_aggs = agg.get("aggs", {})
+        if "sum" in agg:
+            field, missing = agg["sum"]["field"], agg["sum"].get("missing", 0)
+            results[name] = {"value": float(sum(h["_source"].get(field, missing) for h in hits))}
+        elif "max" in agg:
+            values = [h["_source"][agg["max"]["field"]] for h in hits if h["_source"].get(agg["max"]["field"]) is not None]
+            results[name] = {"value": _epoch_millis(max(values, key=_epoch_millis)) if values else None}
+        elif "value_count" in agg:
+            results[name] = {"value": sum(1 for h in hits if agg["value_count"]["field"] in h["_source"])}
+        elif "terms" in agg or "date_histogram" in agg:
+            histogram = "date_histogram" in agg
+            spec = agg.get("terms") or agg.get("date_histogram")
+            groups = defaultdict(list)
+            for hit in hits:
+                value = hit["_source"].get(spec["field"])
+                if value is not None:
+                    groups[_histogram_key(value, spec.get("calendar_interval", "day")) if histogram else value].append(hit)
+            buckets = []
+            for key, members in groups.items():
+                bucket = {"key": key, "doc_count": len(members)}
+                if histogram:
+                    bucket["key_as_string"] = key
+                bucket.update(_aggregate(members, sub_aggs))
+                buckets.append(bucket)
+            if histogram:
+                buckets.sort(key=lambda b: b["key"])
+            else:
+                order = spec.get("order", {})
+                if order:
+                    (order_by, direction), = order.items()
+                    buckets.sort(key=lambda b: b[order_by]["value"] if order_by in b else b["doc_count"], reverse=direction == "desc")
+                else:
+                    buckets.sort(key=lambda b: b["doc_count"], reverse=True)
+                buckets = buckets[:spec.get("size", 10)]
+            results[name] = {"buckets": buckets}
+    return results
+
+def _sort_key(hit: Dict[str, Any], sort: List[Any]):
+    key = []
+    for clause in sort:
+        field = clause if isinstance(clause, str) else next(iter(clause))
+        value = hit["_id"] if field in ("_id", "_shard_doc") else hit["_source"].get(field)
+        key.append(str(value) if value is not None else "")
+    return key
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # response waits out the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    store: _Store = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: Any = None):
+        payload = b"" if body is None else json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json(self) -> Dict[str, Any]:
+        raw = self._body()
+        return json.loads(raw) if raw else {}
+
+    def do_HEAD(self):
+        parts = [unquote(p) for p in urlparse(self.path).path.split("/") if p]
+        with self.store.lock:
+            exists = bool(parts) and (parts[0] in self.store.indices or parts[0] in self.store.aliases)
+        self._send(200 if exists else 404)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        store = self.store
+        if not parts:
+            return self._send(200, {"version": {"number": "8.9.0"}, "tagline": "You Know, for Search"})
+        if parts[0] in ("_ilm", "_index_template"):
+            self._body()
+            return self._send(200, {"acknowledged": True})
+        if parts[0] == "_bulk" or (len(parts) == 2 and parts[1] == "_bulk"):
+            return self._send(200, self._bulk(self._body()))
+        if parts[0] == "_msearch":
+            return self._send(200, self._msearch(self._body()))
+        if parts[0] == "_pit":
+            pit_id = self._json().get("id")
+            with store.lock:
+                found = store.pits.pop(pit_id, None) is not None
+            return self._send(200 if found else 404, {"succeeded": found, "num_freed": int(found)})
+        if parts[:2] == ["_search", "scroll"]:
+            body = self._json()
+            with store.lock:
+                if method == "DELETE":
+                    for scroll_id in body.get("scroll_id") or []:
+                        store.scrolls.pop(scroll_id, None)
+                    return self._send(200, {"succeeded": True, "num_freed": 1})
+                scroll = store.scrolls.get(body.get("scroll_id"))
+            if scroll is None:
+                return self._send(404, {"error": {"type": "search_context_missing_exception", "reason": "No search context found"}, "status": 404})
+            hits, size = scroll
+            store.scrolls[body["scroll_id"]] = (hits[size:], size)
+            return self._send(200, {"_scroll_id": body["scroll_id"], "took": 1, "timed_out": False,
+                                    "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                                    "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits[:size]}})
+        if parts[0] == "_search":
+            body = self._json()
+            with store.lock:
+                index = store.pits.get((body.get("pit") or {}).get("id"))
+            if index is None:
+                return self._send(404, {"error": {"type": "search_context_missing_exception", "reason": "No search context found"}, "status": 404})
+            # Points in time sort on _shard_doc last so every hit has a unique sort key
+            body["sort"] = list(body.get("sort") or []) + [{"_shard_doc": "asc"}]
+            result = self._search(index, body, params)
+            result["pit_id"] = body["pit"]["id"]
+            return self._send(200, result)
+
+        index = parts[0]
+        if len(parts) == 1:
+            self._json()
+            with store.lock:
+                if method == "PUT":
+                    store.index(index)
+                elif method == "DELETE":
+                    store.indices.pop(index, None)
+            return self._send(200, {"acknowledged": True, "index": index})
+
+        action = parts[1]
+        if action == "_pit":
+            self._body()
+            with store.lock:
+                store.pit_seq += 1
+                pit_id = f"pit-{store.pit_seq}"
+                store.pits[pit_id] = index
+            return self._send(200, {"id": pit_id})
+        if action == "_search":
+            body = self._json()
+            if "scroll" not in params:
+                return self._send(200, self._search(index, body, params))
+            # Scrolls keep every hit past the first page until read
+            size = int(body.get("size", params.get("size", 10)))
+            result = self._search(index, dict(body, size=1 << 31), params)
+            hits = result["hits"]["hits"]
+            with store.lock:
+                store.pit_seq += 1
+                scroll_id = f"scroll-{store.pit_seq}"
+                store.scrolls[scroll_id] = (hits[size:], size)
+            result["hits"]["hits"] = hits[:size]
+            result["_scroll_id"] = scroll_id
+            return self._send(200, result)
+        if action == "_mget":
+            ids = self._json().get("ids", [])
+            with store.lock:
+                stored = store.indices.get(index, {})
+                docs = [{"_index": index, "_id": doc_id, "found": True, **stored[doc_id]} if doc_id in stored
+                        else {"_index": index, "_id": doc_id, "found": False} for doc_id in ids]
+            return self._send(200, {"docs": docs})
+        if action == "_count":
+            result = self._search(index, dict(self._json(), size=0), params)
+            return self._send(200, {"count": result["hits"]["total"]["value"]})
+        if action == "_mapping":
+            self._body()
+            return self._send(200, {"acknowledged": True})
+        if action in ("_refresh", "_flush"):
+            self._body()
+            return self._send(200, {"_shards": {"total": 1, "successful": 1, "failed": 0}})
+        if action in ("_alias", "_aliases"):
+            self._body()
+            with store.lock:
+                if len(parts) > 2:
+                    store.aliases[parts[2]] = index
+            return self._send(200, {"acknowledged": True})
+        if action == "_create":
+            with store.lock:
+                status, result = store.write(index, parts[2], self._json(), create=True)
+            return self._send(status, result if status < 300 else {"error": result["error"], "status": status})
+        if action == "_update":
+            with store.lock:
+                status, result = store.update(index, parts[2], self._json())
+            return self._send(status, result if status < 300 else {"error": result["error"], "status": status})
+        if action == "_doc":
+            doc_id = parts[2] if len(parts) > 2 else None
+            if method == "GET":
+                with store.lock:
+                    doc = store.indices.get(index, {}).get(doc_id)
+                if doc is None:
+                    return self._send(404, {"_index": index, "_id": doc_id, "found": False})
+                return self._send(200, {"_index": index, "_id": doc_id, "found": True, **doc})
+            if method == "DELETE":
+                with store.lock:
+                    found = store.indices.get(index, {}).pop(doc_id, None) is not None
+                return self._send(200 if found else 404, {"_index": index, "_id": doc_id, "result": "deleted" if found else "not_found"})
+            body = self._json()
+            with store.lock:
+                if doc_id is None:
+                    doc_id = f"auto-{store.seq_no + 1}"
+                if "if_seq_no" in params:
+                    current = store.indices.get(index, {}).get(doc_id)
+                    if current is None or str(current["_seq_no"]) != params["if_seq_no"]:
+                        return self._send(409, {"error": {"type": "version_conflict_engine_exception", "reason": "seq_no mismatch"}, "status": 409})
+                status, result = store.write(index, doc_id, body, create=params.get("op_type") == "create")
+            return self._send(status, result if status < 300 else {"error": result["error"], "status": status})
+        self._body()
+        self._send(400, {"error": {"type": "unsupported", "reason": f"{method} {url.path}"}, "status": 400})
+
+    def _search(self, index: str, body: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        store = self.store
+        with store.lock:
+            hits = [
+                {"_index": name, "_id": doc_id, **doc}
+                for name in store.resolve(index)
+                for doc_id, doc in store.indices[name].items()
+                if _matches(doc["_source"], body.get("query"))
+            ]
+        sort = body.get("sort") or []
+        if sort:
+            descending = any(isinstance(c, dict) and (next(iter(c.values())) == "desc" or next(iter(c.values())).get("order") == "desc")
+                             for c in sort[:1])
+            hits.sort(key=lambda h: _sort_key(h, sort), reverse=descending)
+            for hit in hits:
+                hit["sort"] = _sort_key(hit, sort)
+            if body.get("search_after"):
+                after = [str(v) for v in body["search_after"]]
+                hits = [h for h in hits if (h["sort"] < after if descending else h["sort"] > after)]
+        size = int(body.get("size", params.get("size", 10)))
+        result = {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits[:size]},
+        }
+        if body.get("aggs") or body.get("aggregations"):
+            result["aggregations"] = _aggregate(hits, body.get("aggs") or body.get("aggregations"))
+        return result
+
+    def _msearch(self, raw: bytes) -> Dict[str, Any]:
+        lines = [json.loads(line) for line in raw.splitlines() if line.strip()]
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            responses.append(dict(self._search(header.get("index", "_all"), body, {}), status=200))
+        return {"took": 1, "responses": responses}
+
+    def _bulk(self, raw: bytes) -> Dict[str, Any]:
+        lines = [json.loads(line) for line in raw.splitlines() if line.strip()]
+        items = []
+        errors = False
+        i = 0
+        with self.store.lock:
+            while i < len(lines):
+                (op, meta), = lines[i].items()
+                index, doc_id = meta.get("_index"), meta.get("_id")
+                if op == "delete":
+                    self.store.indices.get(index, {}).pop(doc_id, None)
+                    items.append({op: {"_index": index, "_id": doc_id, "status": 200}})
+                    i += 1
+                    continue
+                body = lines[i + 1]
+                i += 2
+                if doc_id is None:
+                    doc_id = f"auto-{self.store.seq_no + 1}"
+                current = self.store.indices.get(index, {}).get(doc_id)
+                if "if_seq_no" in meta and (current is None or current["_seq_no"] != meta["if_seq_no"]):
+                    status, result = 409, {"_index": index, "_id": doc_id, "error": {
+                        "type": "version_conflict_engine_exception", "reason": "seq_no mismatch"}}
+                elif op == "update":
+                    status, result = self.store.update(index, doc_id, body)
+                else:
+                    status, result = self.store.write(index, doc_id, body, create=op == "create")
+                result.pop("get", None)
+                result["status"] = status
+                errors = errors or status >= 300
+                items.append({op: result})
+        return {"took": 1, "errors": errors, "items": items}
+
+class FakeElasticsearch:
+    """Serve a fresh fake node on a free localhost port until closed"""
+
+    def __init__(self, port: int = 0):
+        self.store = _Store()
+        handler = type("Handler", (_Handler,), {"store": self.store})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-es", daemon=True)
+
+    def start(self) -> "FakeElasticsearch":
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeElasticsearch":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count(self, expression: str) -> int:
+        with self.store.lock:
+            return sum(len(self.store.indices[name]) for name in self.store.resolve(expression))
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve a fake Elasticsearch node until interrupted")
+    parser.add_argument("--port", type=int, default=9200)
+    args = parser.parse_args()
+
+    es = FakeElasticsearch(args.port)
+    print(f"Fake Elasticsearch listening on {es.url}", flush=True)
+    try:
+        es.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        es.server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Run the benchmark suite and compare it with a stored baseline
+
+Every benchmark runs in a fresh interpreter (settings and service
+singletons are per process) and reports a flat set of metrics. Metric
+names carry their unit, which also tells the comparison which way is
+better:
+
+- ``*_rps``: requests per second, higher is better
+- ``*_ns`` / ``*_us`` / ``*_ms`` / ``*_s`` and ``*_bytes_per_click``:
+  lower is better
+- anything else (sizes, request counts, error counts) is informational
+
+A metric regresses when it is worse than the baseline by more than
+``--tolerance`` (a ratio, 0.25 = 25%). The exit status is 1 if anything
+regressed, so the suite can gate CI.
+
+Usage (from backend/):
+    python -m benchmarks.suite [--quick] [--only NAME ...] [--output results.json]
+        [--baseline benchmarks/baseline.json] [--save-baseline] [--tolerance 0.25]
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# name -> (module, full run arguments, --quick run arguments)
+BENCHMARKS = {
+    "codegen": ("benchmarks.bench_codegen", {}, {"codes": 20000}),
+    "user_agent": ("benchmarks.bench_user_agent", {}, {"iterations": 20}),
+    "analytics": ("benchmarks.bench_analytics", {}, {}),
+    "geoip": ("benchmarks.bench_geoip", {}, {"ranges": 50000, "lookups": 5000}),
+    "link_table": ("benchmarks.bench_link_table", {}, {"links": 50000, "lookups": 5000}),
+    "click_journal": ("benchmarks.bench_click_journal", {}, {"clicks": 20000}),
+    "memory_store": ("benchmarks.bench_memory_store", {}, {"clicks": 100000}),
+    "storage": ("benchmarks.bench_storage", {}, {"count": 20000}),
+    "redirect": ("benchmarks.bench_redirect", {}, {"requests": 2000}),
+    "startup": ("benchmarks.bench_startup", {}, {"runs": 3}),
+    "load": ("benchmarks.bench_load", {}, {"duration": 3.0, "codes": 200}),
+}
+
+HIGHER_IS_BETTER = ("_rps",)
+LOWER_IS_BETTER = ("_ns", "_us", "_ms", "_s", "_bytes_per_click")
+
+def direction(metric: str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 if informational"""
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def child(name: str, quick: bool):
+    """Run one benchmark and print its results as the last line of stdout"""
+    module, full, reduced = BENCHMARKS[name]
+    results = importlib.import_module(module).run(**(reduced if quick else full))
+    print(json.dumps(results))
+
+def run_benchmark(name: str, quick: bool) -> Dict[str, float]:
+    args = [sys.executable, "-m", "benchmarks.suite", "--child", name]
+    if quick:
+        args.append("--quick")
+    output = subprocess.run(args, check=True, capture_output=True, text=True).stdout
+    return flatten(json.loads(output.strip().splitlines()[-1]), name)
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> list:
+    """(metric, baseline, current, change) for every regressed metric"""
+    regressions = []
+    for metric, current in results.items():
+        better = direction(metric)
+        previous = baseline.get(metric)
+        if not better or not previous or not current:
+            continue
+        # > 1 means worse than the baseline
+        worse_by = previous / current if better > 0 else current / previous
+        if worse_by > 1 + tolerance:
+            regressions.append((metric, previous, current, worse_by - 1))
+    return regressions
+
+def load_report(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller workloads, for CI")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run just these benchmarks")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--child", choices=sorted(BENCHMARKS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.quick)
+        return
+
+    results: Dict[str, float] = {}
+    for name in args.only or BENCHMARKS:
+        started = time.perf_counter()
+        results.update(run_benchmark(name, args.quick))
+        print(f"{name:<14} done in {time.perf_counter() - started:6.1f} s", flush=True)
+
+    report = {
+        "meta": {
+            "quick": args.quick,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    baseline = load_report(args.baseline)
+    print()
+    print(f"{'metric':<44}{'value':>14}{'baseline':>14}{'change':>9}")
+    for metric, value in sorted(results.items()):
+        previous = baseline["results"].get(metric) if baseline else None
+        change = f"{(value - previous) / previous:+8.1%}" if previous else ""
+        previous = f"{previous:14.2f}" if previous is not None else f"{'':14}"
+        print(f"{metric:<44}{value:14.2f}{previous}{change:>9}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+    if baseline is None:
+        return
+    if baseline["meta"].get("quick") != args.quick:
+        print("\nNote: the baseline was recorded with a different --quick setting")
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}:")
+        for metric, previous, current, worse_by in regressions:
+            print(f"  {metric:<44} {previous:12.2f} -> {current:12.2f}  ({worse_by:+.0%} worse)")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from collections import Counter
+import pytest
+from elasticsearch import Elasticsearch
+from app.core.config import settings
+from app.services import es_queries
+from app.utils import cache as cache_module
+from benchmarks.fake_es import FakeElasticsearch
+
+@pytest.fixture
+def fake_es():
+    """A fresh in-process fake Elasticsearch node"""
+    with FakeElasticsearch() as fake:
+        yield fake
+
+@pytest.fixture
+def es(fake_es):
+    """A client for ``fake_es``"""
+    client = Elasticsearch(fake_es.url)
+    yield client
+    client.close()
+
+@pytest.fixture
+def fail_writes(fake_es):
+    """
+    Make the fake node answer ``status`` to every write of a source ``when``
+    accepts; returns the original write, to put back
+    """
+    def install(status: int, error_type: str, when):
+        write = fake_es.store.write
+
+        def failing_write(index, doc_id, source, create=False):
+            if when(source):
+                return status, {"_index": index, "_id": doc_id, "status": status,
+                                "error": {"type": error_type, "reason": "injected"}}
+            return write(index, doc_id, source, create=create)
+
+        fake_es.store.write = failing_write
+        return write
+    return install
+
+class Clock:
+    """A settable stand-in for ``time.monotonic``"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze ``time.monotonic``, which the caches read; advance it through ``clock.now``"""
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+@pytest.fixture
+def raw_clicks(fake_es):
+    """Returns every click stored on ``fake_es``, as search hits"""
+    def raw_clicks():
+        return [
+            {"_index": name, "_id": doc_id, "_source": doc["_source"]}
+            for name, docs in fake_es.store.indices.items() if name.startswith(es_queries.CLICKS_PARTITION_PREFIX)
+            for doc_id, doc in docs.items()
+        ]
+    return raw_clicks
+
+@pytest.fixture
+def rollup_counts(fake_es):
+    """Returns the rollup counts stored on ``fake_es`` by browser"""
+    def rollup_counts() -> Counter:
+        counts = Counter()
+        for doc in fake_es.store.indices.get(es_queries.ROLLUPS_INDEX, {}).values():
+            counts[doc["_source"]["browser"]] += doc["_source"]["count"]
+        return counts
+    return rollup_counts
+
+@pytest.fixture
+def fail_rollup_updates(fake_es, monkeypatch):
+    """
+    Make the fake node answer ``status`` to every rollup update; returns
+    the original update, to put back
+    """
+    def install(status: int = 503):
+        update = fake_es.store.update
+
+        def failing_update(index, doc_id, body):
+            if index == es_queries.ROLLUPS_INDEX:
+                return status, {"_index": index, "_id": doc_id, "status": status,
+                                "error": {"type": "injected", "reason": "injected"}}
+            return update(index, doc_id, body)
+
+        monkeypatch.setattr(fake_es.store, "update", failing_update)
+        return update
+    return install
+
+@pytest.fixture
+def api(fake_es, tmp_path, monkeypatch):
+    """A FastAPI test client whose URL service talks to ``fake_es``"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api.api import api_router
+
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", fake_es.url)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_MIGRATE_ON_STARTUP", True)
+    monkeypatch.setattr(settings, "CLICK_SPILL_PATH", str(tmp_path / "clicks-spill.ndjson"))
+    app = FastAPI()
+    app.include_router(api_router, prefix="/api")
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def url_service(fake_es, tmp_path, monkeypatch):
+    """A synchronous URLService talking to ``fake_es``, with its indices created"""
+    from app.services.url_service import URLService
+
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", fake_es.url)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_MIGRATE_ON_STARTUP", True)
+    monkeypatch.setattr(settings, "CLICK_SPILL_PATH", str(tmp_path / "clicks-spill.ndjson"))
+    service = URLService()
+    yield service
+    service.click_pipeline.stop()
+    service.es.close()
@@ -0,0 +1,107 @@
+from datetime import datetime
+import pytest
+from app.core.config import settings
+from app.models.url import URLCreate
+from app.services import es_queries
+from app.services.async_url_service import get_async_url_service
+
+def click(short_code, timestamp, browser="Chrome", country="US"):
+    return dict(
+        es_queries.click_document(short_code, browser, "Desktop", country, "203.0.113.7"),
+        timestamp=timestamp
+    )
+
+@pytest.fixture
+def searches(url_service, monkeypatch):
+    """Paths of the search requests ``url_service`` sends"""
+    paths = []
+    perform_request = url_service.es.perform_request
+
+    def recording(method, path, **kwargs):
+        if "_search" in path or "_msearch" in path:
+            paths.append(path)
+        return perform_request(method, path, **kwargs)
+
+    monkeypatch.setattr(url_service.es, "perform_request", recording)
+    return paths
+
+def test_analytics_take_one_search(url_service, searches, monkeypatch):
+    monkeypatch.setattr(settings, "CLICK_ROLLUPS_ENABLED", False)
+    monkeypatch.setattr(settings, "VISITOR_SKETCHES_ENABLED", False)
+    url = url_service.create_short_url(URLCreate(original_url="https://example.com/a"))
+    now = datetime.utcnow()
+    url_service.click_pipeline._flush([
+        click(url.short_code, now),
+        click(url.short_code, now, browser="Firefox"),
+        click(url.short_code, now, country="DE"),
+        click("other", now),
+    ])
+    searches.clear()
+
+    analytics = url_service.get_url_analytics(url.short_code)
+    assert len(searches) == 1 and searches[0].endswith("/_search")
+    assert analytics.total_clicks == 3
+    assert {b.browser: b.count for b in analytics.clicks_by_browser} == {"Chrome": 2, "Firefox": 1}
+    assert {c.country: c.count for c in analytics.clicks_by_country} == {"US": 2, "DE": 1}
+    assert {d.device: d.count for d in analytics.clicks_by_device} == {"Desktop": 3}
+    assert [d.count for d in analytics.clicks_by_date] == [3]
+
+def test_analytics_of_unknown_codes_are_none(url_service):
+    assert url_service.get_url_analytics("missing") is None
+
+@pytest.fixture
+def clicked(api, es):
+    """A URL created on 2024-05-17 08:00 with clicks at 09:00, 10:30 and 12:00 that day and 12:00 the next"""
+    es.index(index=es_queries.URLS_INDEX, id="abc", document=es_queries.url_document("https://example.com/a", "abc", datetime(2024, 5, 17, 8, 0)), refresh=True)
+    get_async_url_service().click_pipeline._flush([
+        click("abc", datetime(2024, 5, 17, 9, 0)),
+        click("abc", datetime(2024, 5, 17, 10, 30), browser="Firefox"),
+        click("abc", datetime(2024, 5, 17, 12, 0)),
+        click("abc", datetime(2024, 5, 18, 12, 0), country="DE"),
+    ])
+    return "abc"
+
+def test_analytics_windows_and_intervals(api, clicked):
+    whole = api.get(f"/api/analytics/{clicked}").json()
+    assert whole["total_clicks"] == 4
+    assert [(d["date"], d["count"]) for d in whole["clicks_by_date"]] == [("2024-05-17", 3), ("2024-05-18", 1)]
+
+    hourly = api.get(f"/api/analytics/{clicked}", params={"from": "2024-05-17T10:00:00", "to": "2024-05-17T12:00:00", "interval": "hour"}).json()
+    assert hourly["total_clicks"] == 1
+    assert [d["count"] for d in hourly["clicks_by_date"]] == [1]
+    assert [b["browser"] for b in hourly["clicks_by_browser"]] == ["Firefox"]
+
+    second_day = api.get(f"/api/analytics/{clicked}", params={"from": "2024-05-18T00:00:00Z"}).json()
+    assert second_day["total_clicks"] == 1 and second_day["clicks_by_country"] == [{"country": "DE", "count": 1}]
+
+    assert api.get(f"/api/analytics/{clicked}", params={"from": "2024-05-18T00:00:00", "to": "2024-05-17T00:00:00"}).status_code == 400
+    assert api.get(f"/api/analytics/{clicked}", params={"interval": "minute"}).status_code == 422
+
+def test_clicks_are_paged_with_a_cursor(api, clicked):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, "from": "2024-05-17T09:30:00"}
+        if cursor:
+            params["cursor"] = cursor
+        page = api.get(f"/api/analytics/{clicked}/clicks", params=params).json()
+        pages.append([c["timestamp"] for c in page["clicks"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] in ([3, 0], [3])
+    assert [timestamp[:16] for timestamp in sum(pages, [])] == ["2024-05-17T10:30", "2024-05-17T12:00", "2024-05-18T12:00"]
+    assert api.get(f"/api/analytics/{clicked}/clicks", params={"cursor": "garbage"}).status_code == 400
+    assert api.get("/api/analytics/missing/clicks").status_code == 404
+
+def test_recent_urls_are_paged_with_a_cursor(api, recwarn):
+    created = [api.post("/api/shorten", json={"original_url": f"https://example.com/{i}"}).json()["short_code"] for i in range(5)]
+    seen, cursor = [], None
+    while True:
+        response = api.get("/api/recent", params=dict(limit=2, **({"cursor": cursor} if cursor else {})))
+        seen += [url["short_code"] for url in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == created[::-1]
+    assert api.get("/api/recent", params={"cursor": "garbage"}).status_code == 400
+    assert not [w for w in recwarn if "'body' parameter" in str(w.message)]
@@ -0,0 +1,29 @@
+from app.services.async_url_service import close_async_url_service, get_async_url_service
+
+def test_urls_are_created_listed_and_analysed(api):
+    created = api.post("/api/shorten", json={"original_url": "https://example.com/a"})
+    assert created.status_code == 200
+    short_code = created.json()["short_code"]
+
+    assert [url["short_code"] for url in api.get("/api/recent").json()] == [short_code]
+    analytics = api.get(f"/api/analytics/{short_code}").json()
+    assert (analytics["short_code"], analytics["total_clicks"]) == (short_code, 0)
+    assert api.get("/api/analytics/missing").status_code == 404
+
+def test_shutdown_closes_both_connection_pools(api):
+    service = get_async_url_service()
+    closed = []
+    sync_close, async_close = service.sync_es.close, service.es.close
+
+    def close_sync():
+        closed.append("sync")
+        sync_close()
+
+    async def close_async():
+        closed.append("async")
+        await async_close()
+
+    service.sync_es.close = close_sync
+    service.es.close = close_async
+    api.portal.call(close_async_url_service)
+    assert closed == ["sync", "async"]
@@ -0,0 +1,30 @@
+import json
+from app.core.config import settings
+
+def lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_ndjson_in_ndjson_out(api, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_SHORTEN_CHUNK_SIZE", 3)
+    body = "\n".join(json.dumps({"original_url": f"https://example.com/{i}"}) for i in range(7)) + "\n"
+    response = api.post("/api/shorten/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    results = lines(response)
+    assert [result["original_url"] for result in results] == [f"https://example.com/{i}" for i in range(7)]
+    assert len({result["short_code"] for result in results}) == 7
+    redirect = api.get(f"/api/r/{results[4]['short_code']}", follow_redirects=False)
+    assert redirect.headers["location"] == "https://example.com/4"
+
+def test_bad_lines_are_reported_after_the_rest(api):
+    body = '{"original_url": "https://example.com/a"}\nnot json\n{"url": "wrong field"}\n{"original_url": "https://example.com/b"}'
+    results = lines(api.post("/api/shorten/bulk", content=body, headers={"Content-Type": "application/x-ndjson"}))
+    assert [result.get("short_code") is not None for result in results] == [True, True, False, False]
+    assert [result["original_url"] for result in results[2:]] == ["not json", '{"url": "wrong field"}']
+    assert all(result["error"] for result in results[2:])
+
+def test_json_array_input(api):
+    response = api.post("/api/shorten/bulk", json=[{"original_url": "https://example.com/a"}, {"original_url": "https://example.com/b"}])
+    assert [result["original_url"] for result in lines(response)] == ["https://example.com/a", "https://example.com/b"]
+    assert api.post("/api/shorten/bulk", json={"original_url": "https://example.com/a"}).status_code == 400
@@ -0,0 +1,41 @@
+from app.utils.cache import LRUCache, MISSING
+
+def test_entries_expire_after_ttl(clock):
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.put("a", 1)
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_negative_results_use_their_own_ttl(clock):
+    cache = LRUCache(maxsize=10, ttl=60, negative_ttl=5)
+    cache.put_missing("a")
+    assert cache.get("a") is MISSING
+    clock.now += 6
+    assert cache.get("a") is None
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.evictions == 1
+
+def test_invalidate_and_clear():
+    cache = LRUCache(maxsize=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is None and cache.get_stale("a") is None
+    cache.clear()
+    assert len(cache) == 0
+
+def test_zero_size_caches_nothing():
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
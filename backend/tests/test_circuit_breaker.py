@@ -0,0 +1,112 @@
+import asyncio
+import socket
+import time
+import pytest
+from app.core import elasticsearch as es_client
+from app.core.config import settings
+from app.core.elasticsearch import CircuitOpenError, InstrumentedAsyncElasticsearch, InstrumentedElasticsearch
+from app.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10)
+    for failed in (True, True, False, True, True):
+        assert breaker.allow()
+        breaker.record(failed)
+    assert breaker.state == CLOSED
+
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert (breaker.opened, breaker.rejected) == (1, 1)
+
+def open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.allow()
+    breaker.record(True)
+    return breaker
+
+def test_successful_trial_closes_the_circuit(clock):
+    breaker = open_breaker()
+    clock.now += 9
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only the trial goes through
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+def test_failed_trial_opens_the_circuit_again(clock):
+    breaker = open_breaker()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.opened == 2
+
+def test_trial_that_never_reports_is_replaced(clock):
+    breaker = open_breaker()
+    clock.now += 10
+    assert breaker.allow()
+    clock.now += 9
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+def test_released_trial_is_replaced_right_away(clock):
+    breaker = open_breaker()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """A fresh breaker for the Elasticsearch clients, opening on two failures"""
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(es_client, "_circuit_breaker", breaker)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_RETRY_BACKOFF", 0.0)
+    return breaker
+
+def test_client_retries_reads_then_fails_fast(breaker, monkeypatch):
+    monkeypatch.setattr(settings, "ELASTICSEARCH_MAX_RETRIES", 1)
+    # Nothing listens on port 9: every attempt fails to connect
+    es = InstrumentedElasticsearch("http://127.0.0.1:9", max_retries=0)
+    with pytest.raises(es_client.ConnectionError) as raised:
+        es.info()
+    assert not isinstance(raised.value, CircuitOpenError)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        es.info()
+    assert breaker.rejected == 1
+
+def test_cancelled_trial_does_not_keep_the_circuit_open(breaker):
+    # Accepts connections but never answers
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        es = InstrumentedAsyncElasticsearch(f"http://127.0.0.1:{server.getsockname()[1]}", max_retries=0)
+        breaker.state = OPEN
+        breaker._opened_at = time.monotonic() - breaker.reset_timeout
+
+        async def cancelled_trial():
+            try:
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(es.info(), 0.2)
+            finally:
+                await es.close()
+
+        asyncio.run(cancelled_trial())
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,121 @@
+import os
+from datetime import datetime
+import pytest
+from app.services.click_journal import SEGMENT_MAGIC, ClickJournal, decode, encode
+
+def click(i: int) -> dict:
+    return {
+        "short_code": f"code{i}", "timestamp": datetime(2024, 5, 17, 12, 0, i % 60),
+        "browser": "Chrome", "device": "Desktop", "os": "Windows", "country": "DE",
+        "ip": f"10.0.0.{i % 256}", "user_agent": None,
+    }
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "journal")
+
+def open_journal(directory: str, **options) -> ClickJournal:
+    return ClickJournal(directory, commit_interval=60, **options)
+
+def write(directory: str, count: int, **options):
+    journal = open_journal(directory, **options)
+    for i in range(count):
+        journal.append(click(i))
+    journal.close()
+
+def segment_paths(directory: str):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".wal"))
+
+def test_record_round_trip():
+    doc = click(7)
+    record = encode(doc)
+    assert decode(record[8:]) == doc
+
+def test_reopen_reads_unshipped_clicks_once(directory):
+    write(directory, 5)
+
+    journal = open_journal(directory)
+    batch = journal.read(100)
+    assert [doc["short_code"] for doc in batch.docs] == [f"code{i}" for i in range(5)]
+    assert len(set(batch.ids)) == 5
+    journal.acknowledge(batch)
+    journal.close()
+
+    journal = open_journal(directory)
+    assert len(journal.read(100)) == 0
+    assert journal.lag_bytes() == 0
+    journal.close()
+
+def test_unacknowledged_batch_comes_back_identical(directory):
+    write(directory, 6)
+
+    journal = open_journal(directory)
+    first = journal.read(4)
+    journal.begin(first)
+    journal.append(click(99))
+    journal.close()
+
+    # A restart resends exactly the in-flight batch, under the same IDs
+    journal = open_journal(directory)
+    again = journal.read(100)
+    assert again.ids == first.ids
+    assert again.end == first.end
+    journal.acknowledge(again)
+    rest = journal.read(100)
+    assert [doc["short_code"] for doc in rest.docs] == ["code4", "code5", "code99"]
+    journal.close()
+
+@pytest.mark.parametrize("tail", [b"\x10", b"\x20\x00\x00\x00\x01\x02", b"\x05\x00\x00\x00\x00\x00\x00\x00ab"])
+def test_torn_tail_is_truncated(directory, tail):
+    write(directory, 3)
+    path, = segment_paths(directory)
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(tail)
+
+    journal = open_journal(directory)
+    assert journal.truncated == len(tail)
+    assert os.path.getsize(path) == intact
+    journal.append(click(3))
+    journal.commit()
+    batch = journal.read(100)
+    assert [doc["short_code"] for doc in batch.docs] == ["code0", "code1", "code2", "code3"]
+    journal.close()
+
+def test_corrupt_record_cuts_the_segment_there(directory):
+    write(directory, 4)
+    path, = segment_paths(directory)
+    record_size = len(encode(click(0)))
+    with open(path, "r+b") as f:
+        # Flip a payload byte of the third record
+        f.seek(len(SEGMENT_MAGIC) + 2 * record_size + 12)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    journal = open_journal(directory)
+    assert journal.truncated == 2 * record_size
+    batch = journal.read(100)
+    assert [doc["short_code"] for doc in batch.docs] == ["code0", "code1"]
+    journal.close()
+
+def test_segments_rotate_and_are_deleted_once_shipped(directory):
+    record_size = len(encode(click(0)))
+    write(directory, 10, segment_bytes=len(SEGMENT_MAGIC) + 3 * record_size)
+    assert len(segment_paths(directory)) == 4
+
+    journal = open_journal(directory)
+    batch = journal.read(100)
+    assert len(batch) == 10
+    journal.acknowledge(batch)
+    assert len(segment_paths(directory)) == 1
+    journal.close()
+
+def test_directory_is_held_by_one_journal(tmp_path):
+    first = ClickJournal.claim(str(tmp_path), commit_interval=60)
+    second = ClickJournal.claim(str(tmp_path), commit_interval=60)
+    assert first.directory != second.directory
+    with pytest.raises(BlockingIOError):
+        ClickJournal(first.directory)
+    first.close()
+    second.close()
@@ -0,0 +1,138 @@
+import json
+import os
+from datetime import datetime
+import pytest
+from elasticsearch import Elasticsearch
+from app.services.click_journal import ClickJournal
+from app.services.click_pipeline import BACKPRESSURE_DROP, BACKPRESSURE_SPILL, ClickPipeline
+from app.services.visitor_sketches import VisitorSketches
+
+def click(short_code: str) -> dict:
+    return {
+        "short_code": short_code, "timestamp": datetime(2024, 5, 17, 12, 0),
+        "browser": "Chrome", "device": "Desktop", "os": "Windows", "country": "DE",
+        "ip": "10.0.0.1", "user_agent": None,
+    }
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = ClickJournal(str(tmp_path / "journal"), commit_interval=60)
+    yield journal
+    journal.close()
+
+def test_queued_clicks_refused_for_now_are_spilled(fake_es, es, tmp_path, fail_writes):
+    fail_writes(503, "unavailable_shards_exception", lambda source: source["short_code"] == "busy")
+    spill_path = str(tmp_path / "spill.ndjson")
+    pipeline = ClickPipeline(es, backpressure=BACKPRESSURE_SPILL, spill_path=spill_path)
+
+    assert pipeline._flush([click("ok"), click("busy")]) is True
+    assert pipeline.flushed == 1
+    assert pipeline.spilled == 1
+    with open(spill_path, encoding="utf-8") as f:
+        assert [json.loads(line)["short_code"] for line in f] == ["busy"]
+
+
+def test_queued_clicks_refused_are_counted_as_failed(fake_es, es, fail_writes):
+    fail_writes(400, "mapper_parsing_exception", lambda source: source["short_code"] == "bad")
+    pipeline = ClickPipeline(es, backpressure=BACKPRESSURE_DROP)
+
+    assert pipeline._flush([click("ok"), click("bad"), click("bad")]) is True
+    assert pipeline.flushed == 1
+    assert pipeline.failed == 2
+
+
+def test_failed_request_drops_queued_clicks():
+    # Nothing listens on port 9: every request fails
+    es = Elasticsearch("http://127.0.0.1:9", max_retries=0)
+    pipeline = ClickPipeline(es, backpressure=BACKPRESSURE_DROP)
+    assert pipeline._flush([click("ok"), click("ok")]) is False
+    assert pipeline.failed == 2
+
+def spill_lines(path: str, *short_codes: str):
+    with open(path, "a", encoding="utf-8") as f:
+        for short_code in short_codes:
+            f.write(json.dumps(dict(click(short_code), timestamp="2024-05-17T12:00:00")) + "\n")
+
+def test_spilled_clicks_are_replayed_once(fake_es, es, tmp_path, fail_writes):
+    write = fail_writes(503, "unavailable_shards_exception", lambda source: source["short_code"] == "busy")
+    spill_path = str(tmp_path / "spill.ndjson")
+    pipeline = ClickPipeline(es, backpressure=BACKPRESSURE_SPILL, spill_path=spill_path)
+    pipeline._flush([click("busy"), click("busy")])
+
+    # Still refused: spilled again, but not counted again
+    pipeline._replay_spill()
+    assert pipeline.spilled == 2
+    assert not os.path.exists(spill_path + ".replay")
+
+    fake_es.store.write = write
+    pipeline._replay_spill()
+    assert fake_es.count("clicks-*") == 2
+    assert not os.path.exists(spill_path)
+    assert (pipeline.flushed, pipeline.spilled) == (2, 2)
+
+def test_replay_left_by_a_crash_is_sent_first(fake_es, es, tmp_path):
+    spill_path = str(tmp_path / "spill.ndjson")
+    spill_lines(spill_path + ".replay", "crashed", "crashed")
+    spill_lines(spill_path, "new")
+    pipeline = ClickPipeline(es, backpressure=BACKPRESSURE_SPILL, spill_path=spill_path)
+
+    pipeline._replay_spill()
+    assert fake_es.count("clicks-*") == 2
+    assert os.path.exists(spill_path)
+    pipeline._replay_spill()
+    assert fake_es.count("clicks-*") == 3
+    assert not os.path.exists(spill_path) and not os.path.exists(spill_path + ".replay")
+
+def test_torn_spill_line_is_skipped(fake_es, es, tmp_path):
+    spill_path = str(tmp_path / "spill.ndjson")
+    spill_lines(spill_path, "ok")
+    with open(spill_path, "a", encoding="utf-8") as f:
+        f.write('{"short_code": "to')
+    pipeline = ClickPipeline(es, backpressure=BACKPRESSURE_SPILL, spill_path=spill_path)
+
+    pipeline._replay_spill()
+    assert fake_es.count("clicks-*") == 1
+
+def test_dropped_clicks_are_not_counted_as_visitors(es):
+    sketches = VisitorSketches(es)
+    pipeline = ClickPipeline(es, max_queue_size=1, backpressure=BACKPRESSURE_DROP, sketches=sketches)
+    assert pipeline.submit(dict(click("ok"), ip="10.0.0.1"))
+    assert not pipeline.submit(dict(click("ok"), ip="10.0.0.2"))
+    assert (pipeline.dropped, sketches.added) == (1, 1)
+
+def test_journaled_batch_waits_for_clicks_refused_for_now(fake_es, es, journal, fail_writes):
+    write = fail_writes(429, "es_rejected_execution_exception", lambda source: source["short_code"] == "busy")
+    pipeline = ClickPipeline(es, journal=journal)
+    batch = [click("ok"), click("busy")]
+    ids = ["j-0-8", "j-0-100"]
+
+    assert pipeline._flush(batch, ids) is False
+    assert fake_es.count("clicks-*") == 1
+    assert pipeline.rejected == 0
+
+    # Sent again once Elasticsearch accepts it: the click created the first
+    # time answers 409 and is neither duplicated nor counted again
+    fake_es.store.write = write
+    assert pipeline._flush(batch, ids) is True
+    assert fake_es.count("clicks-*") == 2
+    assert pipeline.flushed == 2
+
+
+def test_journaled_clicks_refused_for_good_are_set_aside(fake_es, es, journal, fail_writes):
+    fail_writes(400, "mapper_parsing_exception", lambda source: source["short_code"] == "bad")
+    pipeline = ClickPipeline(es, journal=journal)
+
+    assert pipeline._flush([click("ok"), click("bad")], ["j-0-8", "j-0-100"]) is True
+    assert pipeline.rejected == 1
+    with open(os.path.join(journal.directory, "rejected.ndjson"), encoding="utf-8") as f:
+        rejected = [json.loads(line) for line in f]
+    assert [doc["short_code"] for doc in rejected] == ["bad"]
+    assert rejected[0]["error"]["type"] == "mapper_parsing_exception"
+
+
+def test_failed_request_leaves_journaled_clicks_for_a_retry(journal):
+    # Nothing listens on port 9: every request fails
+    es = Elasticsearch("http://127.0.0.1:9", max_retries=0)
+    pipeline = ClickPipeline(es, journal=journal)
+    assert pipeline._flush([click("ok")], ["j-0-8"]) is False
+    assert pipeline.failed == 0
@@ -0,0 +1,83 @@
+from collections import Counter
+from datetime import datetime
+import pytest
+from app.core.elasticsearch import bulk_items
+from app.services import click_export, click_replay, es_queries, rollups
+from app.services.click_pipeline import ClickPipeline
+
+CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+FIREFOX = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0"
+
+def click(browser: str, user_agent: str = None) -> dict:
+    return {
+        "short_code": "abc", "timestamp": datetime(2024, 5, 17, 12, 0),
+        "browser": browser, "device": "Desktop", "os": "Windows", "country": "DE",
+        "ip": "10.0.0.1", "user_agent": user_agent,
+    }
+
+def test_adjustment_moves_counts_once(fake_es, es, rollup_counts):
+    ClickPipeline(es, rollups=True)._flush([click("Chrome"), click("Chrome"), click("Firefox")])
+    before = [click("Chrome")]
+    after = [click("Firefox")]
+    batch = rollups.new_batch()
+
+    actions = list(rollups.adjustment_actions(before, after, batch))
+    assert sorted(action["script"]["params"]["count"] for action in actions) == [-1, 1]
+    assert all(ok for ok, _ in bulk_items(es, actions))
+    assert rollup_counts() == {"Chrome": 1, "Firefox": 2}
+
+    # Retried with its token: a no-op
+    bulk_items(es, list(rollups.adjustment_actions(before, after, batch)))
+    assert rollup_counts() == {"Chrome": 1, "Firefox": 2}
+
+    # Moving the last click away deletes the rollup
+    bulk_items(es, list(rollups.adjustment_actions(before, after, rollups.new_batch())))
+    assert rollup_counts() == {"Firefox": 3}
+    assert len(fake_es.store.indices[es_queries.ROLLUPS_INDEX]) == 1
+
+def test_adjustment_of_unchanged_keys_is_empty():
+    assert list(rollups.adjustment_actions([click("Chrome")], [click("Chrome")], rollups.new_batch())) == []
+
+@pytest.fixture
+def renamed_chrome(monkeypatch):
+    """A parser change: Chrome is now reported as Chromium"""
+    classify = click_replay.classify_user_agent
+
+    def classify_renamed(user_agent):
+        info = classify(user_agent)
+        return info._replace(browser="Chromium") if info.browser == "Chrome" else info
+
+    monkeypatch.setattr(click_replay, "classify_user_agent", classify_renamed)
+
+def test_replay_moves_rollup_counts_with_the_clicks(es, rollup_counts, raw_clicks, renamed_chrome):
+    ClickPipeline(es, rollups=True)._flush([click("Chrome", CHROME), click("Chrome", CHROME), click("Firefox", FIREFOX)])
+
+    replay = click_replay.ClickReplay(es).run(thread_count=2, chunk_size=1)
+    assert (replay.changed, replay.failed) == (2, 0)
+    assert Counter(hit["_source"]["browser"] for hit in raw_clicks()) == {"Chromium": 2, "Firefox": 1}
+    assert rollup_counts() == {"Chromium": 2, "Firefox": 1}
+    assert not any(hit["_source"].get("replay_pending") for hit in raw_clicks())
+
+    assert click_replay.ClickReplay(es).run().changed == 0
+
+def test_interrupted_replay_is_finished_by_the_next_run(fake_es, es, rollup_counts, raw_clicks, renamed_chrome,
+                                                       fail_rollup_updates, monkeypatch):
+    ClickPipeline(es, rollups=True)._flush([click("Chrome", CHROME), click("Chrome", CHROME)])
+    update = fail_rollup_updates()
+
+    replay = click_replay.ClickReplay(es).run()
+    assert replay.failed == 2
+    assert all(hit["_source"].get("replay_pending") for hit in raw_clicks())
+    assert rollup_counts() == {"Chrome": 2}
+
+    monkeypatch.setattr(fake_es.store, "update", update)
+    replay = click_replay.ClickReplay(es).run()
+    assert (replay.resumed, replay.failed) == (2, 0)
+    assert rollup_counts() == {"Chromium": 2}
+    assert not any(hit["_source"].get("replay_pending") for hit in raw_clicks())
+
+def test_scan_passes_search_arguments_without_a_body(es, raw_clicks, recwarn):
+    ClickPipeline(es)._flush([click("Chrome", CHROME) for _ in range(5)])
+    batches = list(click_export.scan_clicks(es, "abc", batch_size=2))
+    assert [len(hits) for hits in batches] == [2, 2, 1]
+    assert not [w for w in recwarn if "body" in str(w.message)]
@@ -0,0 +1,62 @@
+import threading
+from app.models.url import URLCreate
+from app.services import es_queries
+from app.services.code_generator import BlockCounterCodeGenerator, FeistelPermutation, encode
+
+ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def test_encode_pads_to_width():
+    assert encode(0, ALPHABET, 3) == "000"
+    assert encode(61, ALPHABET, 3) == "00Z"
+    assert encode(62, ALPHABET, 1) == "10"
+
+def test_feistel_permutation_is_a_bijection():
+    for domain in (1, 2, 62, 1000, 62 ** 2):
+        permutation = FeistelPermutation(b"key", domain)
+        assert sorted(permutation(value) for value in range(domain)) == list(range(domain))
+    assert [FeistelPermutation(b"key", 1000)(v) for v in range(10)] != [FeistelPermutation(b"other", 1000)(v) for v in range(10)]
+
+def test_codes_are_unique_across_workers_and_lengths(es):
+    workers = [BlockCounterCodeGenerator(es, ALPHABET, 1, block_size=50, scramble_key="secret") for _ in range(3)]
+    codes = []
+    lock = threading.Lock()
+
+    def draw(generator):
+        drawn = [generator.next_code() for _ in range(700)] + generator.next_codes(300)
+        with lock:
+            codes.extend(drawn)
+
+    threads = [threading.Thread(target=draw, args=(generator,)) for generator in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 3000 codes overflow the 62 one-character codes into two characters
+    assert len(set(codes)) == len(codes) == 3000
+    assert {len(code) for code in codes} == {1, 2}
+
+def test_leases_reserve_whole_blocks(es, fake_es):
+    generator = BlockCounterCodeGenerator(es, ALPHABET, 6, block_size=10)
+    assert [generator.next_code() for _ in range(3)] == ["000000", "000001", "000002"]
+
+    def counter():
+        return fake_es.store.indices[es_queries.COUNTERS_INDEX][es_queries.SHORT_CODE_COUNTER]["_source"]["value"]
+
+    assert counter() == 10
+
+    # 7 left in the block plus 5 more: one lease covering the rest and a fresh block
+    assert generator.next_codes(12)[-1] == "00000e"
+    assert counter() == 10 + 5 + 10
+    assert generator.next_code() == "00000f"
+
+def test_taken_codes_are_skipped(url_service):
+    taken = ["000000", "000001"]
+    codes = iter(taken + ["000002"])
+    url_service.code_generator.next_code = lambda: next(codes)
+    for code in taken:
+        url_service.es.create(
+            index=es_queries.URLS_INDEX, id=code, document=es_queries.url_document("https://example.com/old", code, "2024-05-17T12:00:00")
+        )
+    url = url_service.create_short_url(URLCreate(original_url="https://example.com/new"))
+    assert url.short_code == "000002"
+    assert url_service.get_url_by_short_code("000000").original_url == "https://example.com/old"
@@ -0,0 +1,36 @@
+from app.models.url import URLCreate
+from app.services import es_queries
+from app.services.dedup import URLDeduplicator, url_hash
+
+def shorten(service, original_url):
+    return service.create_short_url(URLCreate(original_url=original_url))
+
+def test_duplicates_get_the_existing_code(url_service):
+    url_service.dedup = URLDeduplicator()
+    first = shorten(url_service, "https://example.com/a")
+    assert shorten(url_service, "https://example.com/a").short_code == first.short_code
+    assert shorten(url_service, "https://example.com/b").short_code != first.short_code
+
+    # Another worker has not seen the URL but finds it in url_hashes
+    url_service.dedup = URLDeduplicator()
+    assert shorten(url_service, "https://example.com/a").short_code == first.short_code
+    assert url_service.dedup.cached_code(url_hash("https://example.com/a")) == first.short_code
+
+def test_hash_of_a_deleted_code_is_taken_over(url_service, fake_es):
+    url_service.dedup = URLDeduplicator()
+    first = shorten(url_service, "https://example.com/a")
+    url_service.es.delete(index=es_queries.URLS_INDEX, id=first.short_code, refresh=True)
+    url_service.url_cache.invalidate(first.short_code)
+    url_service.dedup = URLDeduplicator()
+
+    second = shorten(url_service, "https://example.com/a")
+    assert second.short_code != first.short_code
+    assert fake_es.store.indices[es_queries.URL_HASHES_INDEX][url_hash("https://example.com/a")]["_source"]["short_code"] == second.short_code
+
+def test_losing_a_race_returns_the_winner_and_drops_the_new_code(url_service, fake_es):
+    url_service.dedup = URLDeduplicator()
+    winner = shorten(url_service, "https://example.com/a")
+    # As if another worker claimed the hash between our lookup and our create
+    url_service._find_duplicate = lambda key: None
+    assert shorten(url_service, "https://example.com/a").short_code == winner.short_code
+    assert fake_es.count(es_queries.URLS_INDEX) == 1
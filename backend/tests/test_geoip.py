@@ -0,0 +1,79 @@
+import ipaddress
+import random
+import pytest
+from app.core.config import settings
+from app.utils import geoip
+from app.utils.geoip import GeoIPDatabase, compile_database
+
+ROWS = [
+    # Whole 1024-address blocks, answered from the direct table
+    ("1.0.0.0", "1.0.255.255", "AU"),
+    # Ranges sharing blocks, which need the bisect
+    ("2.0.0.0", "2.0.0.99", "FR"),
+    ("2.0.0.100", "2.0.1.10", "DE"),
+    ("2.0.1.200", "2.0.7.255", "NL"),
+    (str(int(ipaddress.ip_address("3.3.3.3"))), str(int(ipaddress.ip_address("3.3.3.3"))), "US"),
+    ("255.255.255.0", "255.255.255.255", "ZA"),
+    ("2001:db8::", "2001:db8::ffff", "GB"),
+    ("2001:db8::1:0", "2001:db8::ffff:ffff", "IE"),
+    ("2001:db8:0:1::", "2001:db8:0:1:ffff:ffff:ffff:ffff", "JP"),
+    ("::ffff:4.4.4.0", "::ffff:4.4.4.255", "CA"),
+    # Skipped: header, unknown country, junk
+    ("ip_from", "ip_to", "country_code"),
+    ("5.0.0.0", "5.0.0.255", "-"),
+    ("not an ip", "6.0.0.0", "XX"),
+]
+
+def reference(ip: str) -> str:
+    address = ipaddress.ip_address(ip)
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    for start, end, country in ROWS[:10]:
+        first, last = (ipaddress.ip_address(int(v) if v.isdigit() else v) for v in (start, end))
+        if first.version == 6 and first.ipv4_mapped:
+            first, last = first.ipv4_mapped, last.ipv4_mapped
+        if first.version == address.version and first <= address <= last:
+            return country
+    return "Unknown"
+
+@pytest.fixture(params=["csv", "compiled"])
+def database(request, tmp_path):
+    path = tmp_path / "ranges.csv"
+    path.write_text("\n".join(",".join(row) for row in ROWS) + "\n")
+    if request.param == "csv":
+        return GeoIPDatabase.open(str(path))
+    compile_database(str(path), str(tmp_path / "ranges.bin"))
+    return GeoIPDatabase.open(str(tmp_path / "ranges.bin"))
+
+@pytest.mark.parametrize("ip, country", [
+    ("1.0.0.0", "AU"), ("1.0.128.7", "AU"), ("1.0.255.255", "AU"), ("1.1.0.0", "Unknown"),
+    ("2.0.0.99", "FR"), ("2.0.0.100", "DE"), ("2.0.1.10", "DE"), ("2.0.1.11", "Unknown"), ("2.0.1.200", "NL"),
+    ("3.3.3.3", "US"), ("3.3.3.4", "Unknown"), ("255.255.255.255", "ZA"), ("5.0.0.1", "Unknown"),
+    ("2001:db8::1", "GB"), ("2001:db8::1:1", "IE"), ("2001:db8::1:0:0", "Unknown"), ("2001:db8:0:1::5", "JP"),
+    ("2001:db9::", "Unknown"), ("::ffff:4.4.4.4", "CA"), ("4.4.4.4", "CA"), ("::ffff:1.0.0.1", "AU"),
+    ("", "Unknown"), ("not an ip", "Unknown"), ("1.2.3", "Unknown"), ("2001:::1", "Unknown"),
+])
+def test_lookup(database, ip, country):
+    assert database.lookup(ip) == country
+
+def test_lookup_matches_a_linear_scan(database):
+    rng = random.Random(7)
+    near = [int(ipaddress.ip_address(row[0] if not row[0].isdigit() else int(row[0]))) for row in ROWS[:6]]
+    for _ in range(3000):
+        ip = str(ipaddress.IPv4Address((rng.choice(near) + rng.randint(-2048, 2048)) % (1 << 32)))
+        assert database.lookup(ip) == reference(ip), ip
+    assert len(database) == 10
+
+def test_unreadable_database_answers_unknown(tmp_path, monkeypatch):
+    path = tmp_path / "broken.bin"
+    path.write_bytes(b"not a database" * 10)
+    monkeypatch.setattr(settings, "GEOIP_DATABASE_PATH", str(path))
+    monkeypatch.setattr(geoip, "_database", None)
+    monkeypatch.setattr(geoip, "_database_opened", False)
+    geoip._lookup_country.cache_clear()
+    try:
+        assert geoip.get_database() is None
+        assert geoip.lookup_country("1.0.0.1") == "Unknown"
+        assert geoip._database_opened
+    finally:
+        geoip._lookup_country.cache_clear()
@@ -0,0 +1,48 @@
+from datetime import datetime
+from app.core.config import settings
+from app.services.hot_links import HotLinkAggregator
+
+def click(short_code: str, second: int = 0) -> dict:
+    return {
+        "short_code": short_code, "timestamp": datetime(2024, 5, 17, 12, 0, second),
+        "browser": "Chrome", "device": "Desktop", "os": "Windows", "country": "DE",
+    }
+
+def test_hot_code_clicks_are_coalesced_per_minute():
+    hot_links = HotLinkAggregator(capacity=10, threshold=3)
+    absorbed = [hot_links.absorb(click("viral", i)) for i in range(5)]
+    assert absorbed == [False, False, True, True, True]
+    assert not hot_links.absorb(click("quiet"))
+
+    assert hot_links.drain(now=datetime(2024, 5, 17, 12, 0, 30)) == []
+    docs = hot_links.drain(now=datetime(2024, 5, 17, 12, 1))
+    assert [(doc["short_code"], doc["timestamp"], doc["count"]) for doc in docs] == [("viral", datetime(2024, 5, 17, 12, 0), 3)]
+    assert hot_links.pending() == 0
+
+def test_journal_batches_are_coalesced_the_same_way_every_time():
+    hot_links = HotLinkAggregator(capacity=10, threshold=3)
+    docs = [click("viral", i) for i in range(4)] + [click("quiet")]
+    ids = [f"j-0-{i}" for i in range(5)]
+
+    first = hot_links.coalesce(docs, ids)
+    assert first == hot_links.coalesce(docs, ids)
+    out_docs, out_ids = first
+    assert out_ids == ["j-0-4", "j-0-0"]
+    assert out_docs[1]["count"] == 4
+
+def test_without_coalescing_hot_codes_are_only_tracked():
+    hot_links = HotLinkAggregator(capacity=10, threshold=3, coalescing=False)
+    assert not any(hot_links.absorb(click("viral", i)) for i in range(5))
+    docs, ids = [click("viral", i) for i in range(4)], [f"j-0-{i}" for i in range(4)]
+    assert hot_links.coalesce(docs, ids) == (docs, ids)
+
+    assert hot_links.top(1) == [{"short_code": "viral", "clicks": 9, "error": 0, "coalesced": False}]
+
+def test_hot_links_are_listed_with_coalescing_off(api):
+    assert not settings.HOT_LINKS_ENABLED
+    short_code = api.post("/api/shorten", json={"original_url": "https://example.com/viral"}).json()["short_code"]
+    for _ in range(3):
+        assert api.get(f"/api/r/{short_code}", follow_redirects=False).status_code in (301, 302)
+
+    hot = api.get("/api/hot").json()
+    assert hot == [{"short_code": short_code, "clicks": 3, "error": 0, "coalesced": False}]
@@ -0,0 +1,57 @@
+import pytest
+from app.utils.hyperloglog import HyperLogLog
+
+def sketch(values, precision: int = 12) -> HyperLogLog:
+    hll = HyperLogLog(precision)
+    for value in values:
+        hll.add(value)
+    return hll
+
+def ips(start: int, stop: int):
+    return (f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(start, stop))
+
+def test_empty_sketch_counts_zero():
+    assert HyperLogLog().count() == 0
+
+@pytest.mark.parametrize("cardinality", [10, 300, 1000, 20_000, 200_000])
+def test_count_is_within_error_bounds(cardinality):
+    hll = sketch(ips(0, cardinality))
+    # Four standard errors: deterministic hashes, but no margin for luck
+    assert abs(hll.count() - cardinality) <= max(4 * hll.error_rate * cardinality, 1)
+
+def test_duplicates_are_not_counted():
+    hll = sketch(list(ips(0, 1000)) * 5)
+    assert hll.count() == sketch(ips(0, 1000)).count()
+
+@pytest.mark.parametrize("sizes", [(100, 100), (100, 5000), (5000, 5000)])
+def test_merge_counts_the_union(sizes):
+    # Sparse + sparse, sparse + dense and dense + dense
+    first, second = sketch(ips(0, sizes[0])), sketch(ips(sizes[0] // 2, sizes[0] // 2 + sizes[1]))
+    union = sketch(ips(0, sizes[0] // 2 + sizes[1]))
+    first.merge(second)
+    assert first.count() == union.count()
+
+    first.merge(second)
+    assert first.count() == union.count()
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+
+@pytest.mark.parametrize("precision", [3, 17])
+def test_precision_is_validated(precision):
+    with pytest.raises(ValueError):
+        HyperLogLog(precision)
+
+@pytest.mark.parametrize("cardinality", [0, 50, 50_000])
+def test_serialization_round_trip(cardinality):
+    hll = sketch(ips(0, cardinality), precision=10)
+    copy = HyperLogLog.from_bytes(hll.to_bytes())
+    assert (copy.precision, copy.count(), copy.to_bytes()) == (10, hll.count(), hll.to_bytes())
+
+def test_sparse_form_is_smaller():
+    assert len(sketch(ips(0, 10)).to_bytes()) < len(sketch(ips(0, 50_000)).to_bytes())
+
+def test_truncated_dense_sketch_is_rejected():
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(sketch(ips(0, 50_000)).to_bytes()[:-1])
@@ -0,0 +1,90 @@
+import os
+import pytest
+from app.core.config import settings
+from app.models.url import URLCreate
+from app.services import link_table as link_table_module
+from app.services.link_table import LinkTable, SharedLinkTable, build_link_table
+
+LINKS = [(f"code{i}", f"https://example.com/{i}", f"2024-05-17T12:00:0{i % 10}+00:00") for i in range(50)]
+
+def test_every_link_is_found():
+    table = LinkTable.build(LINKS)
+    assert len(table) == 50
+    for short_code, original_url, created_at in LINKS:
+        assert table.get(short_code) == (original_url, created_at)
+        assert table.original_url(short_code) == original_url
+
+@pytest.mark.parametrize("short_code", ["missing", "code", "code499", "é", "x" * 300])
+def test_unknown_codes_are_not_found(short_code):
+    table = LinkTable.build(LINKS)
+    assert table.get(short_code) is None
+    assert table.original_url(short_code) is None
+
+def test_first_duplicate_wins_and_empty_table_works():
+    assert LinkTable.build([("a", "https://first", "t"), ("a", "https://second", "t")]).original_url("a") == "https://first"
+    empty = LinkTable.build([])
+    assert len(empty) == 0 and empty.get("a") is None
+
+def test_written_table_maps_back(tmp_path):
+    path = str(tmp_path / "links.bin")
+    LinkTable.build(LINKS + [("ünï", "https://example.com/ünïcode", "t")], built_at=1234.5).write(path)
+    table = LinkTable.open(path)
+    assert table.built_at == 1234.5
+    assert table.get("code7") == LINKS[7][1:]
+    assert table.original_url("ünï") == "https://example.com/ünïcode"
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_garbage_file_is_rejected(tmp_path):
+    path = tmp_path / "links.bin"
+    path.write_bytes(b"not a table" * 10)
+    with pytest.raises(ValueError):
+        LinkTable.open(str(path))
+
+def test_shared_table_follows_the_loader(tmp_path):
+    path = str(tmp_path / "links.bin")
+    shared = SharedLinkTable(path, check_interval=0)
+    assert shared.get_original_url("code1") is None
+
+    LinkTable.build(LINKS[:2]).write(path)
+    assert shared.get_original_url("code1") == "https://example.com/1"
+    url = shared.get_url("code1")
+    assert (url.short_code, url.original_url) == ("code1", "https://example.com/1")
+
+    os.remove(path)
+    LinkTable.build([("code1", "https://example.com/moved", "t")]).write(path)
+    assert shared.get_original_url("code1") == "https://example.com/moved"
+    assert shared.get_original_url("code0") is None
+    assert (shared.reloads, shared.hits, shared.misses) == (2, 3, 2)
+
+def test_resolved_urls_are_bounded(tmp_path):
+    path = str(tmp_path / "links.bin")
+    LinkTable.build(LINKS).write(path)
+    shared = SharedLinkTable(path, resolved_size=4)
+    for short_code, original_url, _ in LINKS:
+        assert shared.get_original_url(short_code) == original_url
+    assert len(shared._resolved) <= 4
+
+def test_loader_snapshots_the_urls_index(es, url_service, tmp_path):
+    urls = [url_service.create_short_url(URLCreate(original_url=f"https://example.com/{i}")) for i in range(7)]
+    table = build_link_table(es, str(tmp_path / "links.bin"), batch_size=3)
+    assert len(table) == 7
+    assert {url.short_code: table.original_url(url.short_code) for url in urls} == {url.short_code: url.original_url for url in urls}
+
+@pytest.fixture
+def shared_table(tmp_path, monkeypatch):
+    """A link table file the API's URL service reads"""
+    path = str(tmp_path / "links.bin")
+    LinkTable.build([("fromtable", "https://example.com/table", "2024-05-17T12:00:00+00:00")]).write(path)
+    monkeypatch.setattr(settings, "LINK_TABLE_PATH", path)
+    monkeypatch.setattr(link_table_module, "_link_table", None)
+    return path
+
+def test_redirects_are_served_from_the_table(shared_table, api, fake_es):
+    response = api.get("/api/r/fromtable", follow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://example.com/table"
+
+    # Codes the table lacks still come from Elasticsearch
+    short_code = api.post("/api/shorten", json={"original_url": "https://example.com/new"}).json()["short_code"]
+    assert api.get(f"/api/r/{short_code}", follow_redirects=False).headers["location"] == "https://example.com/new"
+    assert api.get("/api/fromtable").json() == {"url": "https://example.com/table"}
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+from app.services.memory_store import MemoryStore
+from app.services.storage import MemoryStorage
+
+MAY_17 = datetime(2024, 5, 17, 12, 0, tzinfo=timezone.utc).timestamp()
+DAY = 86400
+
+def test_urls_and_recent_ring():
+    store = MemoryStore(recent_size=3)
+    assert store.add_url("a", "https://example.com/a", "2024-05-17T10:00:00").original_url == "https://example.com/a"
+    assert store.add_url("a", "https://example.com/other", "2024-05-17T11:00:00") is None
+    for code in "bcd":
+        store.add_url(code, f"https://example.com/{code}", "2024-05-17T12:00:00")
+    assert "a" in store and store.get_url("missing") is None
+    assert [url.short_code for url in store.recent_urls(10)] == ["d", "c", "b"]
+    assert [url.short_code for url in store.recent_urls(2)] == ["d", "c"]
+
+def test_clicks_are_counted_per_day_and_dimension():
+    store = MemoryStore()
+    store.add_click("a", "Chrome", "Desktop", "Windows", "US", "203.0.113.7", timestamp=MAY_17 + DAY)
+    store.add_click("a", "Firefox", "Mobile", "Android", "DE", "2001:db8::1", timestamp=MAY_17)
+    store.add_click("a", "Chrome", "Desktop", "Windows", "US", "", timestamp=MAY_17)
+    store.add_click("b", "Safari", "Mobile", "iOS", "FR", "198.51.100.1", timestamp=MAY_17)
+
+    assert store.click_count("a") == 3 and store.click_count("missing") == 0
+    counts = store.click_counts("a")
+    assert list(counts["date"].items()) == [("2024-05-17", 2), ("2024-05-18", 1)]
+    assert counts["browser"] == {"Chrome": 2, "Firefox": 1}
+    assert counts["os"] == {"Windows": 2, "Android": 1}
+    assert counts["country"] == {"US": 2, "DE": 1}
+    assert store.click_counts("missing") == {"date": {}, "browser": {}, "device": {}, "os": {}, "country": {}}
+
+def test_clicks_round_trip_through_the_columns():
+    store = MemoryStore()
+    store.add_click("a", "Chrome", "Desktop", "Windows", "US", "203.0.113.7", timestamp=MAY_17)
+    store.add_click("a", "Firefox", "Mobile", "Android", "DE", "2001:db8::1", timestamp=MAY_17 + 1)
+    store.add_click("a", "Chrome", "Desktop", "Windows", "US", "not an ip", timestamp=MAY_17 + 2)
+    rows = list(store.iter_clicks("a"))
+    assert [row["ip"] for row in rows] == ["203.0.113.7", "2001:db8::1", "not an ip"]
+    assert rows[1] == {
+        "short_code": "a", "timestamp": "2024-05-17T12:00:01", "browser": "Firefox", "device": "Mobile",
+        "os": "Android", "country": "DE", "ip": "2001:db8::1"
+    }
+    assert len(store.encoders["browser"]) == 2
+    assert list(store.iter_clicks("missing")) == []
+
+def test_memory_storage_backend():
+    storage = MemoryStorage()
+    assert storage.put_url("a", "https://example.com/a", "2024-05-17T10:00:00")
+    assert not storage.put_url("a", "https://example.com/b", "2024-05-17T10:00:00")
+    storage.append_clicks([{
+        "short_code": "a", "timestamp": datetime(2024, 5, 17, 12, 0), "browser": "Chrome", "device": "Desktop",
+        "os": "Windows", "country": "US", "ip": "203.0.113.7", "user_agent": "Mozilla/5.0"
+    }])
+    counts = storage.click_counts("a")
+    assert counts["total_clicks"] == 1 and counts["date"] == {"2024-05-17": 1}
@@ -0,0 +1,45 @@
+from datetime import datetime
+import pytest
+from elasticsearch import ApiError
+from app.core.config import settings
+from app.services import es_queries
+from app.services.click_pipeline import ClickPipeline
+
+def test_clicks_are_partitioned_by_month_or_day(monkeypatch):
+    assert es_queries.click_partition(datetime(2024, 5, 17, 23, 59)) == "clicks-2024.05"
+    assert es_queries.click_partition("2024-12-01T00:00:00") == "clicks-2024.12"
+    monkeypatch.setattr(settings, "CLICKS_PARTITION_INTERVAL", "day")
+    assert es_queries.click_partition(datetime(2024, 5, 17, 23, 59)) == "clicks-2024.05.17"
+
+def test_searches_read_only_the_partitions_of_their_window(monkeypatch):
+    assert es_queries.click_indices() == es_queries.CLICKS_ALIAS
+    assert es_queries.click_indices(datetime(2024, 4, 30), datetime(2024, 6, 1)) == (
+        f"{es_queries.LEGACY_CLICKS_INDEX},clicks-2024.04,clicks-2024.05,clicks-2024.06"
+    )
+    monkeypatch.setattr(settings, "CLICKS_MAX_PARTITIONS_PER_QUERY", 2)
+    assert es_queries.click_indices(datetime(2024, 4, 30), datetime(2024, 6, 1)) == es_queries.CLICKS_ALIAS
+
+def test_retention_is_set_on_every_partition(monkeypatch):
+    template = es_queries.clicks_index_template()
+    assert template["index_patterns"] == ["clicks-*"]
+    assert template["template"]["settings"]["index.lifecycle.name"] == es_queries.CLICKS_ILM_POLICY
+    assert es_queries.clicks_ilm_policy()["phases"]["delete"]["min_age"] == f"{settings.CLICKS_RETENTION_DAYS}d"
+
+    monkeypatch.setattr(settings, "CLICKS_RETENTION_DAYS", 0)
+    assert "index.lifecycle.name" not in es_queries.clicks_index_template()["template"]["settings"]
+
+def test_clicks_are_written_to_the_partition_of_their_time(es, raw_clicks):
+    click = es_queries.click_document("abc", "Chrome", "Desktop", "US", "203.0.113.7")
+    ClickPipeline(es)._flush([dict(click, timestamp=datetime(2024, 4, 30, 23, 59)), dict(click, timestamp=datetime(2024, 5, 1))])
+    assert sorted(hit["_index"] for hit in raw_clicks()) == ["clicks-2024.04", "clicks-2024.05"]
+
+def test_searches_that_matched_no_partition_count_nothing():
+    counts = es_queries.analytics_counts({"hits": {"hits": []}})
+    assert counts["total_clicks"] == 0 and not counts["date"] and not counts["browser"]
+
+def test_a_failed_msearch_search_raises_its_error():
+    result = {"responses": [{"aggregations": {}}, {"error": {"type": "es_rejected_execution_exception", "reason": "queue full"}, "status": 429}]}
+    with pytest.raises(ApiError) as raised:
+        es_queries.analytics_msearch_counts(result)
+    assert raised.value.status_code == 429
+    assert "queue full" in str(raised.value)
@@ -0,0 +1,33 @@
+from app.core.config import settings
+from app.services.async_url_service import get_async_url_service
+
+CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+def test_redirect_counts_gets_only(api):
+    short_code = api.post("/api/shorten", json={"original_url": "https://example.com/ä?q=1"}).json()["short_code"]
+
+    response = api.get(f"/api/r/{short_code}", headers={"user-agent": CHROME}, follow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://example.com/%C3%A4?q=1"
+    assert response.headers["cache-control"] == settings.REDIRECT_CACHE_CONTROL
+    assert response.content == b""
+    # Link previews ask with HEAD
+    assert api.head(f"/api/r/{short_code}", follow_redirects=False).status_code == 302
+
+    # Stopping the pipeline flushes the batch its worker is holding
+    pipeline = get_async_url_service().click_pipeline
+    pipeline.stop()
+    assert pipeline.metrics()["enqueued"] == 1
+    analytics = api.get(f"/api/analytics/{short_code}").json()
+    assert analytics["total_clicks"] == 1
+    assert analytics["clicks_by_browser"] == [{"browser": "Chrome", "count": 1}]
+
+def test_redirect_status_is_configurable(api, monkeypatch):
+    monkeypatch.setattr(settings, "REDIRECT_STATUS_CODE", 301)
+    short_code = api.post("/api/shorten", json={"original_url": "https://example.com/a"}).json()["short_code"]
+    response = api.get(f"/api/r/{short_code}", follow_redirects=False)
+    assert (response.status_code, response.headers["location"]) == (301, "https://example.com/a")
+
+def test_redirect_of_unknown_codes_is_404(api):
+    response = api.get("/api/r/missing", follow_redirects=False)
+    assert response.status_code == 404 and response.json() == {"detail": "URL not found"}
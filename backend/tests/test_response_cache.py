@@ -0,0 +1,172 @@
+import asyncio
+import time
+from datetime import datetime
+import pytest
+from app.core.config import settings
+from app.services import es_queries
+from app.services.async_url_service import get_async_url_service
+from app.utils.response_cache import CachedResponse, ResponseCache
+
+class Backend:
+    """Counts builds; ``release`` holds them until set"""
+
+    def __init__(self, body: bytes = b"[]"):
+        self.body = body
+        self.calls = 0
+        self.release = None
+        self.error = None
+
+    async def build(self):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.body, {"X-Total": "0"}
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_invalidation_forces_one_rebuild():
+    async def scenario():
+        cache, backend = ResponseCache(ttl=60), Backend()
+        first = await cache.get_or_build("k", "analytics:abc", backend.build)
+        assert await cache.get_or_build("k", "analytics:abc", backend.build) is first
+        cache.invalidate("analytics:other")
+        assert await cache.get_or_build("k", "analytics:abc", backend.build) is first
+
+        cache.invalidate("analytics:abc")
+        cache.invalidate("analytics:abc")
+        backend.body = b"[1]"
+        rebuilt = await cache.get_or_build("k", "analytics:abc", backend.build)
+        assert rebuilt.body == b"[1]" and rebuilt.headers == {"X-Total": "0"}
+        assert await cache.get_or_build("k", "analytics:abc", backend.build) is rebuilt
+        assert (backend.calls, cache.hits, cache.invalidations) == (2, 3, 3)
+    run(scenario())
+
+def test_build_racing_an_invalidation_is_not_served_again():
+    async def scenario():
+        cache, backend = ResponseCache(ttl=60), Backend()
+        backend.release = asyncio.Event()
+        pending = asyncio.ensure_future(cache.get_or_build("k", "recent", backend.build))
+        while not backend.calls:
+            await asyncio.sleep(0)
+        cache.invalidate("recent")
+        backend.release.set()
+        await pending
+
+        await cache.get_or_build("k", "recent", backend.build)
+        assert backend.calls == 2
+    run(scenario())
+
+def test_concurrent_misses_share_one_build():
+    async def scenario():
+        cache, backend = ResponseCache(ttl=60), Backend()
+        backend.release = asyncio.Event()
+        pending = [asyncio.ensure_future(cache.get_or_build("k", "recent", backend.build)) for _ in range(5)]
+        await asyncio.sleep(0)
+        backend.release.set()
+        responses = await asyncio.gather(*pending)
+        assert all(response is responses[0] for response in responses)
+        assert (backend.calls, cache.builds, cache.coalesced) == (1, 1, 4)
+    run(scenario())
+
+def test_uncacheable_results_are_rebuilt():
+    async def scenario():
+        cache = ResponseCache(ttl=60)
+        calls = []
+
+        async def not_found():
+            calls.append(1)
+            return None
+
+        assert await cache.get_or_build("k", "recent", not_found) is None
+        assert await cache.get_or_build("k", "recent", not_found) is None
+        assert len(calls) == 2
+    run(scenario())
+
+def test_stale_response_is_served_on_accepted_errors(clock):
+    async def scenario():
+        cache = ResponseCache(ttl=5, stale_if_error=lambda e: isinstance(e, ConnectionError))
+        backend = Backend()
+        first = await cache.get_or_build("k", "recent", backend.build)
+        clock.now += 10
+
+        backend.error = ConnectionError()
+        assert await cache.get_or_build("k", "recent", backend.build) is first
+        assert cache.stale_served == 1
+
+        backend.error = KeyError("bug")
+        with pytest.raises(KeyError):
+            await cache.get_or_build("k", "recent", backend.build)
+    run(scenario())
+
+def test_errors_propagate_without_a_stale_response():
+    async def scenario():
+        cache, backend = ResponseCache(stale_if_error=lambda e: True), Backend()
+        backend.error = ConnectionError()
+        with pytest.raises(ConnectionError):
+            await cache.get_or_build("k", "recent", backend.build)
+    run(scenario())
+
+def test_conditional_requests():
+    response = CachedResponse(b'{"clicks": 1}')
+    assert response.etag == CachedResponse(b'{"clicks": 1}').etag != CachedResponse(b'{"clicks": 2}').etag
+    assert response.not_modified({"if-none-match": response.etag})
+    assert response.not_modified({"if-none-match": f'"other", W/{response.etag}'})
+    assert response.not_modified({"if-none-match": "*"})
+    assert not response.not_modified({"if-none-match": '"other"'})
+    # If-None-Match wins over If-Modified-Since
+    assert not response.not_modified({"if-none-match": '"other"', "if-modified-since": response.last_modified})
+    assert response.not_modified({"if-modified-since": response.last_modified})
+    assert not response.not_modified({"if-modified-since": "Thu, 01 Jan 1970 00:00:00 GMT"})
+    assert not response.not_modified({"if-modified-since": "yesterday"})
+    assert not response.not_modified({})
+
+def test_scheduled_invalidation_applies_once_due(clock):
+    async def scenario():
+        cache, backend = ResponseCache(ttl=60), Backend()
+        first = await cache.get_or_build("k", "analytics:abc", backend.build)
+        cache.invalidate("analytics:abc", delay=1.5)
+        # Built before the writes are visible: still the same data
+        assert await cache.get_or_build("k", "analytics:abc", backend.build) is first
+        clock.now += 1.5
+        backend.body = b"[1]"
+        assert (await cache.get_or_build("k", "analytics:abc", backend.build)).body == b"[1]"
+        assert await cache.get_or_build("k", "analytics:abc", backend.build) is not first
+        assert (backend.calls, cache.invalidations) == (2, 1)
+    run(scenario())
+
+def test_scheduled_invalidations_do_not_pile_up_unread(clock):
+    cache = ResponseCache(ttl=60)
+    for i in range(100):
+        cache.invalidate(f"analytics:{i}", delay=1.5)
+        clock.now += 0.5
+    assert len(cache._scheduled) <= 4
+    assert cache.invalidations >= 96
+
+def test_last_modified_comes_from_the_data():
+    response = CachedResponse(b"[]", {}, modified_at=1715947200.7)
+    assert response.last_modified == "Fri, 17 May 2024 12:00:00 GMT"
+    assert response.not_modified({"if-modified-since": "Fri, 17 May 2024 12:00:00 GMT"})
+    assert not response.not_modified({"if-modified-since": "Fri, 17 May 2024 11:59:59 GMT"})
+    # Never later than the response itself
+    assert CachedResponse(b"[]", {}, modified_at=time.time() + 3600).modified_at <= time.time()
+
+def test_analytics_last_modified_is_the_newest_click(api, es, monkeypatch):
+    monkeypatch.setattr(settings, "ELASTICSEARCH_REFRESH_DELAY", 0.0)
+    es.index(index=es_queries.URLS_INDEX, id="abc", document=es_queries.url_document("https://example.com/a", "abc", datetime(2024, 5, 17, 8, 0)), refresh=True)
+    assert api.get("/api/analytics/abc").headers["Last-Modified"] == "Fri, 17 May 2024 08:00:00 GMT"
+    assert api.get("/api/recent").headers["Last-Modified"] == "Fri, 17 May 2024 08:00:00 GMT"
+
+    pipeline = get_async_url_service().click_pipeline
+    click = es_queries.click_document("abc", "Chrome", "Desktop", "US", "203.0.113.7")
+    pipeline._flush([dict(click, timestamp=datetime(2024, 5, 17, 12, 0, 30)), dict(click, timestamp=datetime(2024, 5, 17, 9, 0))])
+    # Raw clicks: the newest one
+    hourly = api.get("/api/analytics/abc", params={"interval": "hour"})
+    assert hourly.json()["total_clicks"] == 2
+    assert hourly.headers["Last-Modified"] == "Fri, 17 May 2024 12:00:30 GMT"
+    # Rolled up, the day is all that is left: its end
+    daily = api.get("/api/analytics/abc")
+    assert daily.json()["total_clicks"] == 2
+    assert daily.headers["Last-Modified"] == "Sat, 18 May 2024 00:00:00 GMT"
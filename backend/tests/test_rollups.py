@@ -0,0 +1,55 @@
+from datetime import datetime
+from app.services import rollups
+from app.services.click_pipeline import ClickPipeline
+
+def click(browser: str) -> dict:
+    return {
+        "short_code": "abc", "timestamp": datetime(2024, 5, 17, 12, 0),
+        "browser": browser, "device": "Desktop", "os": "Windows", "country": "DE",
+        "ip": "10.0.0.1", "user_agent": None,
+    }
+
+def test_rollup_key_buckets_by_day():
+    doc = click("Chrome")
+    assert rollups.rollup_key(doc) == ("abc", "2024-05-17", "Chrome", "Desktop", "DE")
+    assert rollups.rollup_id(rollups.rollup_key(doc)) == rollups.rollup_id(rollups.rollup_key(dict(doc, timestamp=datetime(2024, 5, 17, 23, 59))))
+    assert rollups.summarize([doc, doc, click("Firefox")])[rollups.rollup_key(doc)] == 2
+
+def test_flushed_clicks_are_rolled_up_and_flagged(es, rollup_counts, raw_clicks):
+    pipeline = ClickPipeline(es, rollups=True)
+    assert pipeline._flush([click("Chrome"), click("Chrome"), click("Firefox")])
+
+    assert rollup_counts() == {"Chrome": 2, "Firefox": 1}
+    assert all(hit["_source"].get("rolled_up") for hit in raw_clicks())
+    assert pipeline._unrolled == []
+
+def test_retried_rollup_update_is_not_counted_twice(es, rollup_counts, raw_clicks):
+    ClickPipeline(es, rollups=True)._flush([click("Chrome"), click("Firefox")])
+
+    # The same clicks with the same batch token, as after a lost response
+    assert rollups.roll_up(es, raw_clicks()) == []
+    assert rollup_counts() == {"Chrome": 1, "Firefox": 1}
+
+def test_clicks_stay_unflagged_until_their_rollup_update_succeeds(fake_es, es, rollup_counts, raw_clicks,
+                                                                   fail_rollup_updates, monkeypatch):
+    update = fail_rollup_updates()
+    pipeline = ClickPipeline(es, rollups=True)
+    pipeline._flush([click("Chrome"), click("Firefox")])
+
+    assert len(pipeline._unrolled) == 2
+    assert not any(hit["_source"].get("rolled_up") for hit in raw_clicks())
+    assert rollup_counts() == {}
+
+    monkeypatch.setattr(fake_es.store, "update", update)
+    pipeline._retry_rollups()
+    assert pipeline._unrolled == []
+    assert rollup_counts() == {"Chrome": 1, "Firefox": 1}
+    assert all(hit["_source"].get("rolled_up") for hit in raw_clicks())
+
+def test_refused_rollup_update_leaves_clicks_in_the_tail(es, raw_clicks, fail_rollup_updates):
+    fail_rollup_updates(400)
+    pipeline = ClickPipeline(es, rollups=True)
+    pipeline._flush([click("Chrome")])
+
+    assert pipeline._unrolled == []
+    assert not any(hit["_source"].get("rolled_up") for hit in raw_clicks())
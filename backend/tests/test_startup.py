@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+from app import cli
+from app.core.config import settings
+from app.services import es_queries
+
+def test_importing_the_api_builds_no_service():
+    # A fresh interpreter, pointed at a port nothing listens on
+    code = (
+        "import app.api.api, app.services.async_url_service as a, app.services.url_service as s; "
+        "assert a._async_url_service is None and s._url_service is None"
+    )
+    env = dict(os.environ, ELASTICSEARCH_PORT="9", ELASTICSEARCH_MIGRATE_ON_STARTUP="false")
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)),
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+def test_migrate_command_creates_every_index(fake_es, monkeypatch):
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", fake_es.url)
+    assert cli.main(["migrate"]) == 0
+    for index in es_queries.INDICES:
+        assert index in fake_es.store.indices
+    # Running it again changes nothing
+    assert cli.main(["migrate"]) == 0
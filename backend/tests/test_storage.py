@@ -0,0 +1,80 @@
+from datetime import datetime
+from app.services.sqlite_storage import SQLiteStorage
+from app.services.storage import ClickBuffer, StorageBackend
+
+def click(short_code="abc", day=17, browser="Chrome", country="US"):
+    return {
+        "short_code": short_code,
+        "timestamp": datetime(2024, 5, day, 12, 0),
+        "browser": browser,
+        "device": "Desktop",
+        "os": "Windows",
+        "country": country,
+        "ip": "203.0.113.7",
+        "user_agent": "Mozilla/5.0"
+    }
+
+class RecordingStorage(StorageBackend):
+    def __init__(self, batches_clicks=False):
+        self.batches_clicks = batches_clicks
+        self.appends = []
+
+    def append_clicks(self, clicks):
+        self.appends.append(list(clicks))
+
+def test_sqlite_stores_urls_and_counts_clicks(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "links.db"))
+    assert storage.put_url("abc", "https://example.com/a", "2024-05-17T10:00:00")
+    assert not storage.put_url("abc", "https://example.com/other", "2024-05-17T11:00:00")
+    assert storage.put_url("def", "https://example.com/d", "2024-05-17T11:00:00")
+    assert storage.get_url("abc").original_url == "https://example.com/a"
+    assert storage.get_url("missing") is None
+    assert [url.short_code for url in storage.recent_urls(10)] == ["def", "abc"]
+
+    storage.append_clicks([click(), click(day=18, browser="Firefox"), click(country="DE"), click("def")])
+    counts = storage.click_counts("abc")
+    assert counts["total_clicks"] == 3
+    assert counts["date"] == {"2024-05-17": 2, "2024-05-18": 1}
+    assert counts["browser"] == {"Chrome": 2, "Firefox": 1}
+    assert counts["country"] == {"US": 2, "DE": 1}
+    assert storage.click_counts("missing")["total_clicks"] == 0
+    storage.close()
+
+def test_sqlite_keeps_data_and_drops_the_timestamp_index(tmp_path):
+    path = str(tmp_path / "links.db")
+    storage = SQLiteStorage(path)
+    storage.put_url("abc", "https://example.com/a", "2024-05-17T10:00:00")
+    storage.append_clicks([click()])
+    connection = storage._connection()
+    connection.execute("CREATE INDEX clicks_timestamp ON clicks (timestamp)")
+    storage.close()
+
+    reopened = SQLiteStorage(path)
+    indexes = {row[0] for row in reopened._connection().execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "clicks_timestamp" not in indexes
+    assert "clicks_short_code_timestamp" in indexes
+    assert reopened.click_counts("abc")["total_clicks"] == 1
+    reopened.close()
+
+def test_click_buffer_appends_in_batches():
+    storage = RecordingStorage()
+    buffer = ClickBuffer(storage, batch_size=3, flush_interval=60)
+    for _ in range(4):
+        buffer.add(click())
+    assert [len(batch) for batch in storage.appends] == [3]
+    buffer.flush()
+    buffer.flush()
+    assert [len(batch) for batch in storage.appends] == [3, 1]
+    buffer.add(click())
+    buffer.close()
+    assert [len(batch) for batch in storage.appends] == [3, 1, 1]
+
+def test_click_buffer_passes_clicks_through_to_batching_backends():
+    storage = RecordingStorage(batches_clicks=True)
+    buffer = ClickBuffer(storage, batch_size=3, flush_interval=60)
+    buffer.add(click())
+    buffer.add(click("def"))
+    assert [[c["short_code"] for c in batch] for batch in storage.appends] == [["abc"], ["def"]]
+    buffer.flush()
+    buffer.close()
+    assert len(storage.appends) == 2
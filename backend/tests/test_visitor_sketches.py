@@ -0,0 +1,86 @@
+from datetime import datetime
+from elasticsearch import Elasticsearch
+from app.services import es_queries
+from app.services.visitor_sketches import VisitorSketches
+from app.utils.hyperloglog import HyperLogLog
+
+def click(ip: str, short_code: str = "abc") -> dict:
+    return {"short_code": short_code, "timestamp": datetime(2024, 5, 17, 12, 0), "ip": ip}
+
+def ip(i: int) -> str:
+    return f"10.0.{i // 256}.{i % 256}"
+
+def add(sketches: VisitorSketches, start: int, stop: int):
+    for i in range(start, stop):
+        sketches.add(click(ip(i)))
+
+def estimate(ips) -> int:
+    sketch = HyperLogLog()
+    for value in ips:
+        sketch.add(value)
+    return sketch.count()
+
+def stored_count(fake_es, short_code: str = "abc") -> int:
+    doc = fake_es.store.indices[es_queries.VISITOR_SKETCHES_INDEX][es_queries.visitor_sketch_id(short_code, "2024-05-17")]
+    return es_queries.visitor_sketch_from_source(doc["_source"]).count()
+
+def test_flushes_merge_into_the_stored_sketch(fake_es, es):
+    first, second = VisitorSketches(es), VisitorSketches(es)
+    add(first, 0, 100)
+    first.flush()
+    add(second, 50, 150)
+    second.flush()
+
+    assert stored_count(fake_es) == estimate(ip(i) for i in range(150))
+    assert (first.pending(), second.pending()) == (0, 0)
+
+    # Sending the same visitors again changes nothing
+    add(first, 0, 100)
+    first.flush()
+    assert stored_count(fake_es) == estimate(ip(i) for i in range(150))
+
+def test_concurrent_write_is_merged_again(fake_es, es, monkeypatch):
+    sketches, other = VisitorSketches(es), VisitorSketches(Elasticsearch(fake_es.url))
+    add(sketches, 0, 100)
+    other.add(click("192.168.0.1"))
+    mget = es.mget
+
+    def racing_mget(**kwargs):
+        result = mget(**kwargs)
+        if other.pending():
+            other.flush()
+        return result
+
+    monkeypatch.setattr(es, "mget", racing_mget)
+    sketches.flush()
+    assert sketches.conflicts == 1
+    assert stored_count(fake_es) == estimate([ip(i) for i in range(100)] + ["192.168.0.1"])
+
+def test_sketches_elasticsearch_cannot_take_now_stay_pending(fake_es, es, fail_writes):
+    write = fail_writes(429, "es_rejected_execution_exception", lambda source: source["short_code"] == "busy")
+    sketches = VisitorSketches(es)
+    sketches.add(click("10.0.0.1", "busy"))
+    sketches.add(click("10.0.0.1", "ok"))
+    sketches.flush()
+    assert (sketches.pending(), sketches.deferred, sketches.failed) == (1, 1, 0)
+
+    sketches.add(click("10.0.0.2", "busy"))
+    fake_es.store.write = write
+    sketches.flush()
+    assert sketches.pending() == 0
+    assert stored_count(fake_es, "busy") == estimate(["10.0.0.1", "10.0.0.2"])
+
+def test_sketches_refused_for_good_are_counted_as_failed(es, fail_writes):
+    fail_writes(400, "mapper_parsing_exception", lambda source: source["short_code"] == "bad")
+    sketches = VisitorSketches(es)
+    sketches.add(click("10.0.0.1", "bad"))
+    sketches.flush()
+    assert (sketches.pending(), sketches.deferred, sketches.failed) == (0, 0, 1)
+
+def test_unreachable_cluster_keeps_every_sketch():
+    # Nothing listens on port 9
+    sketches = VisitorSketches(Elasticsearch("http://127.0.0.1:9", max_retries=0))
+    add(sketches, 0, 3)
+    sketches.add(click("10.0.0.1", "other"))
+    sketches.flush()
+    assert (sketches.pending(), sketches.deferred, sketches.failed) == (2, 2, 0)
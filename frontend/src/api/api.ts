@@ -18,6 +18,7 @@ export interface URLAnalytics {
   short_code: string;
   original_url: string;
   total_clicks: number;
+  unique_visitors?: number | null;
   created_at: string;
   clicks_by_date: { date: string; count: number }[];
   clicks_by_browser: { browser: string; count: number }[];
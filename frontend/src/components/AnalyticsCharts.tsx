@@ -43,7 +43,10 @@ const AnalyticsCharts: React.FC<AnalyticsChartsProps> = ({ data, isLoading }) =>
         >
           <StatLabel fontSize="sm" fontWeight="medium">Total Clicks</StatLabel>
           <StatNumber fontSize="3xl">{data.total_clicks}</StatNumber>
-          <StatHelpText>Since {new Date(data.created_at).toLocaleDateString()}</StatHelpText>
+          <StatHelpText>
+            {data.unique_visitors != null && <>~{data.unique_visitors} unique visitors · </>}
+            Since {new Date(data.created_at).toLocaleDateString()}
+          </StatHelpText>
         </Stat>
         
         {/* Top Browser */}